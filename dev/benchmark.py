@@ -0,0 +1,337 @@
+import argparse
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.autograd import Variable
+from torch.profiler import profile, ProfilerActivity
+
+from models.ntm.memory import NTMMemory
+from models.ntm.reversible_memory import ReversibleNTMMemory
+from models import reinforcement_models
+
+
+# Micro-benchmarks of the memory-augmented Q-networks' hot paths
+parser = argparse.ArgumentParser(description='Benchmarks of the NTM/LRUA memory operations',
+                                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument('benchmarks', nargs='*', default=['lrua', 'allocations', 'reversible', 'checkpointing'],
+                    help='Benchmarks to run (lrua, allocations, reversible, checkpointing)')
+parser.add_argument('--batch-size', type=int, default=32, metavar='B',
+                    help='Batch size')
+parser.add_argument('--N', type=int, default=128, metavar='N',
+                    help='Number of memory slots')
+parser.add_argument('--M', type=int, default=40, metavar='M',
+                    help='Memory slot size')
+parser.add_argument('--heads', type=int, default=4, metavar='H',
+                    help='Number of (write) heads')
+parser.add_argument('--steps', type=int, default=30, metavar='T',
+                    help='Number of timesteps (the episode size)')
+parser.add_argument('--repeats', type=int, default=5, metavar='R',
+                    help='Number of timed episodes (the fastest is reported)')
+parser.add_argument('--segments', type=int, nargs='+', default=[0, 2, 5, 10], metavar='K',
+                    help='Checkpointing segment lengths (0 = no checkpointing)')
+
+
+def reference_similarity(memory, k, β=1):
+    """
+    The previous content addressing (offset copies of the memory and key), kept for comparison.
+    """
+    k = k.view(memory.batch_size, 1, -1)
+    return F.softmax(β * F.cosine_similarity(memory.memory + 1e-16, k + 1e-16, dim=-1), dim=1)
+
+
+def reference_write(memory, w, e, a):
+    """
+    The previous NTM write (throwaway memory tensor, separate erase and add matrices), kept for comparison.
+    """
+    memory.prev_mem = memory.memory
+    memory.memory = Variable(torch.Tensor(memory.batch_size, memory.N, memory.M))
+    erase = torch.matmul(w.unsqueeze(-1), e.unsqueeze(1))
+    add = torch.matmul(w.unsqueeze(-1), a.unsqueeze(1))
+    memory.memory = memory.prev_mem * (1 - erase) + add
+    memory.row_norms = None
+
+
+def reference_lrua_write(memory, w, k):
+    """
+    The previous LRUA write (throwaway memory tensor), kept for comparison.
+    """
+    memory.prev_mem = memory.memory
+    memory.memory = Variable(torch.Tensor(memory.batch_size, memory.N, memory.M))
+    lrua = torch.matmul(w.unsqueeze(-1), k.unsqueeze(1))
+    memory.memory = memory.prev_mem + lrua
+    memory.row_norms = None
+
+
+def reference_lrua_address(memory, k, g, n, gamma, w_prev):
+    """
+    The previous LRUA write addressing (NumPy least-used vector, per-slot zeroing), kept for comparison.
+    """
+    w_r = reference_similarity(memory, k)
+    w_u_prev = w_prev[:, 0]
+    w_r_prev = w_prev[:, 1]
+    w_lu_prev = w_prev[:, 2]
+    w_w = memory._interpolate(w_lu_prev, w_r_prev, g)
+    w_u = gamma*w_u_prev + w_r + w_w
+
+    n_smallest_matrix = np.partition(np.array(w_u.data), n-1)[:, n-1]
+    w_lu = Variable(torch.FloatTensor(((np.array(w_u.data).transpose() <= n_smallest_matrix).astype(int)).transpose()))
+
+    erase_vector = Variable(torch.ones(w_lu_prev.size()[:]).type(torch.LongTensor)) - w_lu_prev.type(torch.LongTensor)
+    zeroed_memory = memory.memory.data.clone()
+    for b in range(len(erase_vector)):
+        for m in range(len(erase_vector[b])):
+            if erase_vector.data[b][m] == 0:
+                zeroed_memory[b][m] = torch.zeros(memory.M)
+    memory.memory = Variable(zeroed_memory)
+    memory.row_norms = None
+
+    return w_u, w_r, w_w, w_lu
+
+
+def bytes_allocated(function):
+    """
+    :return: Number of bytes allocated (on the CPU) while running function, whether freed again or not.
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as profiler:
+        function()
+    return sum(event.self_cpu_memory_usage for event in profiler.events() if event.self_cpu_memory_usage > 0)
+
+
+def peak_bytes(function):
+    """
+    :return: Peak number of bytes allocated (on the CPU) while running function, above what was allocated before.
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as profiler:
+        function()
+    allocated, peak = 0, 0
+    for event in sorted(profiler.events(), key=lambda event: event.time_range.start):
+        allocated += event.self_cpu_memory_usage
+        peak = max(peak, allocated)
+    return peak
+
+
+def saved_bytes(function):
+    """
+    :return: The result of function, and the number of bytes autograd keeps for backward while running it.
+    """
+    storages = {}
+
+    def pack(tensor):
+        storages[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        result = function()
+    return result, sum(storages.values())
+
+
+def time_episodes(episode, repeats):
+    # Fastest of the repeats, in milliseconds:
+    timings = []
+    for r in range(repeats):
+        start = time.time()
+        episode()
+        timings.append((time.time() - start) * 1000)
+    return min(timings)
+
+
+def benchmark_lrua(args):
+    """
+    LRUA write addressing and writing of an episode, with the current and the reference least-used path.
+    """
+    torch.manual_seed(0)
+    memory = NTMMemory(args.N, args.M)
+    keys = torch.randn(args.steps, args.heads, args.batch_size, args.M)
+    gates = torch.rand(args.steps, args.heads, args.batch_size, 1)
+
+    def episode(address):
+        memory.reset(args.batch_size)
+        w_prev = [torch.zeros(args.batch_size, 3, args.N) for h in range(args.heads)]
+        for t in range(args.steps):
+            for h in range(args.heads):
+                w_u, w_r, w_w, w_lu = address(keys[t, h], gates[t, h], w_prev[h])
+                memory.lrua_write(w_w, keys[t, h])
+                w_prev[h] = torch.stack((w_u, w_r, w_lu), dim=1)
+        return memory.memory
+
+    def current(k, g, w_prev):
+        w = memory.lrua_address(k, g, args.heads, 0.95, w_prev, 0)
+        memory.lrua_erase(w_prev[:, 2])
+        return w
+
+    def reference(k, g, w_prev):
+        return reference_lrua_address(memory, k, g, args.heads, 0.95, w_prev)
+
+    # The forward results are identical:
+    torch.manual_seed(0)
+    difference = (episode(current) - episode(reference)).abs().max().item()
+
+    current_time = time_episodes(lambda: episode(current), args.repeats)
+    reference_time = time_episodes(lambda: episode(reference), args.repeats)
+
+    print("LRUA addressing (B=" + str(args.batch_size) + ", N=" + str(args.N) + ", M=" + str(args.M) +
+          ", heads=" + str(args.heads) + ", T=" + str(args.steps) + "):")
+    print("\tReference:\t%.1f ms/episode" % reference_time)
+    print("\tCurrent:\t%.1f ms/episode (x%.1f)" % (current_time, reference_time / current_time))
+    print("\tMax. memory difference: " + str(difference))
+
+
+def benchmark_allocations(args):
+    """
+    Bytes allocated per write step (addressing + write of one head), with the current and the reference write path.
+    """
+    torch.manual_seed(0)
+    B, N, M = args.batch_size, args.N, args.M
+    memory = NTMMemory(N, M)
+    k, e, a = torch.randn(B, M, requires_grad=True), torch.rand(B, M), torch.randn(B, M)
+    β, g, γ = torch.rand(B, 1) + 1, torch.rand(B, 1), torch.rand(B, 1) + 1
+    s = F.softmax(torch.randn(B, 3), dim=1)
+
+    def ntm_current(w_prev):
+        w = memory.address(k, β, g, s, γ, w_prev)
+        memory.write(w, e, a)
+        return w
+
+    def ntm_reference(w_prev):
+        w_r = reference_similarity(memory, k, β)
+        w = memory._sharpen(memory._shift(memory._interpolate(w_prev, w_r, g), s), γ)
+        reference_write(memory, w, e, a)
+        return w
+
+    def lrua_current(w_prev):
+        w_u, w_r, w_w, w_lu = memory.lrua_address(k, g, args.heads, 0.95, w_prev, 0)
+        memory.lrua_erase(w_prev[:, 2])
+        memory.lrua_write(w_w, k)
+        return torch.stack((w_u, w_r, w_lu), dim=1)
+
+    def lrua_reference(w_prev):
+        # The per-slot zeroing loop is left out (see the lrua benchmark), it would dominate the profile:
+        w_r = reference_similarity(memory, k)
+        w_w = memory._interpolate(w_prev[:, 2], w_prev[:, 1], g)
+        w_u = 0.95*w_prev[:, 0] + w_r + w_w
+        w_lu = (w_u <= torch.kthvalue(w_u, args.heads, dim=1, keepdim=True)[0]).float()
+        memory.lrua_erase(w_prev[:, 2])
+        reference_lrua_write(memory, w_w, k)
+        return torch.stack((w_u, w_r, w_lu), dim=1)
+
+    def per_step(step, state_size, grad):
+        def episode():
+            with torch.set_grad_enabled(grad):
+                memory.reset(B)
+                w = torch.zeros(state_size)
+                for t in range(args.steps):
+                    w = step(w)
+        return bytes_allocated(episode) / args.steps
+
+    print("Bytes allocated per write step (B=" + str(B) + ", N=" + str(N) + ", M=" + str(M) +
+          ", memory=" + str(B * N * M * 4 // 1024) + " KB):")
+    for name, current, reference, state_size in (("NTM", ntm_current, ntm_reference, (B, N)),
+                                                  ("LRUA", lrua_current, lrua_reference, (B, 3, N))):
+        for grad in (True, False):
+            before = per_step(reference, state_size, grad)
+            after = per_step(current, state_size, grad)
+            print("\t%s (%s):\t%.0f KB -> %.0f KB" % (name, "autograd" if grad else "no autograd",
+                                                     before / 1024, after / 1024))
+
+
+def benchmark_reversible(args):
+    """
+    Storage kept for backward, and time of forward + backward, of an episode of NTM/LRUA addressing, reading and
+    writing, with the memory kept by autograd and with the reversible memory.
+    """
+    B, N, M, H = args.batch_size, args.N, args.M, args.heads
+    torch.manual_seed(0)
+    dense, reversible = NTMMemory(N, M), ReversibleNTMMemory(N, M)
+    reversible.load_state_dict(dense.state_dict())
+    keys = torch.randn(args.steps, B, H, M, requires_grad=True)
+    e, a = torch.rand(args.steps, B, H, M, requires_grad=True), torch.randn(args.steps, B, H, M, requires_grad=True)
+    β, g, γ = torch.rand(B, H, 1) + 1, torch.rand(B, H, 1), torch.rand(B, H, 1) + 1
+    s = F.softmax(torch.randn(B, H, 3), dim=-1)
+
+    def ntm_step(memory, t, w_prev):
+        w = memory.address(keys[t], β, g, s, γ, w_prev)
+        for h in range(H):
+            memory.write(w[:, h], e[t, :, h], a[t, :, h])
+        return memory.read(w), w
+
+    def lrua_step(memory, t, w_prev):
+        w_u, w_r, w_w, w_lu = memory.lrua_address(keys[t], g, H, 0.95, w_prev, 0)
+        for h in range(H):
+            memory.lrua_erase(w_prev[:, h, 2])
+            memory.lrua_write(w_w[:, h], keys[t, :, h])
+        return memory.read(w_r), torch.stack((w_u, w_r, w_lu), dim=2)
+
+    def episode(memory, step, state_size):
+        def forward():
+            memory.reset(B)
+            w, loss = torch.zeros(state_size), 0
+            for t in range(args.steps):
+                r, w = step(memory, t, w)
+                loss = loss + r.pow(2).sum()
+            return loss
+
+        loss, kept = saved_bytes(forward)
+        if isinstance(memory, ReversibleNTMMemory):
+            kept += memory.tape.nbytes()
+        keys.grad = e.grad = a.grad = None
+        loss.backward()
+        return kept, [keys.grad, e.grad, a.grad]
+
+    print("Storage kept for backward per episode (B=" + str(B) + ", N=" + str(N) + ", M=" + str(M) +
+          ", heads=" + str(H) + ", T=" + str(args.steps) + "):")
+    for name, step, state_size in (("NTM", ntm_step, (B, H, N)), ("LRUA", lrua_step, (B, H, 3, N))):
+        before, gradients = episode(dense, step, state_size)
+        after, reversible_gradients = episode(reversible, step, state_size)
+        difference = max(((x - y).norm() / y.norm()).item() for x, y in zip(reversible_gradients, gradients)
+                         if y is not None)
+        before_time = time_episodes(lambda: episode(dense, step, state_size), args.repeats)
+        after_time = time_episodes(lambda: episode(reversible, step, state_size), args.repeats)
+        print("\t%s:\t%.0f KB -> %.0f KB, %.1f ms -> %.1f ms/episode (max. relative gradient difference: %.1e)" %
+              (name, before / 1024, after / 1024, before_time, after_time, difference))
+
+
+def benchmark_checkpointing(args):
+    """
+    Peak memory and time of forward + backward of a Q-network episode, at several checkpointing segment lengths.
+    """
+    B, classes = args.batch_size, 3
+    inputs = torch.rand(args.steps, B, 400 + classes)
+
+    print("Gradient checkpointing of an episode (B=" + str(B) + ", N=" + str(args.N) + ", T=" + str(args.steps) +
+          "):")
+    for name, model in (("LSTM", reinforcement_models.ReinforcedRNN), ("NTM", reinforcement_models.ReinforcedNTM),
+                        ("LRUA", reinforcement_models.ReinforcedLRUA)):
+        gradients = None
+        for segment in args.segments:
+            torch.manual_seed(0)
+            kwargs = {} if model is reinforcement_models.ReinforcedRNN else {'memory_slots': args.N}
+            q_network = model(B, False, classes, 400, checkpoint_segment=segment, **kwargs)
+
+            def episode():
+                q_network.zero_grad()
+                hidden, loss = q_network.reset_hidden(B), 0
+                for t in range(args.steps):
+                    q_values, hidden = q_network(inputs[t], hidden)
+                    loss = loss + q_values.pow(2).sum()
+                loss.backward()
+
+            peak = peak_bytes(episode)
+            episode_time = time_episodes(episode, args.repeats)
+            if gradients is None:
+                gradients = [p.grad.clone() for p in q_network.parameters() if p.grad is not None]
+            difference = max((p.grad - g).abs().max().item() for p, g in
+                             zip([p for p in q_network.parameters() if p.grad is not None], gradients))
+            print("\t%s (%s):\t%.0f KB peak, %.1f ms/episode (max. gradient difference: %.1e)" %
+                  (name, "segments of " + str(segment) if segment > 0 else "no checkpointing", peak / 1024,
+                   episode_time, difference))
+
+
+BENCHMARKS = {'lrua': benchmark_lrua, 'allocations': benchmark_allocations, 'reversible': benchmark_reversible,
+              'checkpointing': benchmark_checkpointing}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        BENCHMARKS[name](args)
@@ -1,13 +1,12 @@
 from __future__ import print_function
 import torch.utils.data as data
-from PIL import Image
 import random
 import os
 import os.path
 import errno
 import torch
 import numpy as np
-from utils import transforms
+from data.images.omniglot.omniglot_cache import OmniglotCache, VARIANTS
 
 
 class OMNIGLOT(data.Dataset):
@@ -40,9 +39,9 @@ class OMNIGLOT(data.Dataset):
         self.test = test
         self.scenario_size = scenario_size
         self.classify = omniglot_loader.classify
-        if self.classify:
-            self.training_file = "classify_" + self.training_file
-            self.test_file = "classify_" + self.test_file
+        # The processed (versioned) files are written by the loader:
+        self.training_file = omniglot_loader.training_file
+        self.test_file = omniglot_loader.test_file
         self.partition = partition
 
         if download and not self._check_exists():
@@ -54,12 +53,16 @@ class OMNIGLOT(data.Dataset):
             raise RuntimeError('Dataset not found.' +
                                ' You can use download=True to download it')
 
+        # Images are drawn from a pre-transformed cache of shape (classes, samples, rotations, H, W):
+        data_file = self.training_file if self.train else self.test_file
+        self.image_cache = OmniglotCache(os.path.join(self.root, self.processed_folder), data_file, self.transform)
+        if not self.image_cache.exists():
+            self.image_cache.build(*torch.load(os.path.join(self.root, self.processed_folder, data_file)))
+
         if self.train:
-            self.train_data, self.train_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.training_file))
+            self.train_data, self.train_labels = self.image_cache.load()
         else:
-            self.test_data, self.test_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.test_file))
+            self.test_data, self.test_labels = self.image_cache.load()
 
     def __getitem__(self, index):
         if self.scenario:
@@ -72,9 +75,9 @@ class OMNIGLOT(data.Dataset):
                     for i in img_classes:
                         if ind == 0:
                             for j in range(self.scenario_size):
-                                images.append((self.train_data[i][j], ind))
+                                images.append(((i, j), ind))
                         else:
-                            images.append((self.train_data[i][random.randint(0, len(self.train_data[i]) - 1)], ind))
+                            images.append(((i, random.randint(0, len(self.train_data[i]) - 1)), ind))
                         ind += 1
                 else:
                     img_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
@@ -82,9 +85,9 @@ class OMNIGLOT(data.Dataset):
                     for i in img_classes:
                         if ind == 0:
                             for j in range(self.scenario_size):
-                                images.append((self.test_data[i][j], ind))
+                                images.append(((i, j), ind))
                         else:
-                            images.append((self.test_data[i][random.randint(0, len(self.test_data[i]) - 1)], ind))
+                            images.append(((i, random.randint(0, len(self.test_data[i]) - 1)), ind))
                         ind += 1
 
             # My own:
@@ -96,9 +99,9 @@ class OMNIGLOT(data.Dataset):
                         if ind == self.class_choice:
                             img_samples = np.random.choice(len(self.train_data[i]), self.scenario_size, replace=False)
                             for j in img_samples:
-                                images.append((self.train_data[i][j], ind))
+                                images.append(((i, j), ind))
                         else:
-                            images.append((self.train_data[i][random.randint(0, len(self.train_data[i]) - 1)], ind))
+                            images.append(((i, random.randint(0, len(self.train_data[i]) - 1)), ind))
                         ind += 1
                 else:
                     img_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
@@ -107,9 +110,9 @@ class OMNIGLOT(data.Dataset):
                         if ind == self.class_choice:
                             img_samples = np.random.choice(len(self.test_data[i]), self.scenario_size, replace=False)
                             for j in img_samples:
-                                images.append((self.test_data[i][j], ind))
+                                images.append(((i, j), ind))
                         else:
-                            images.append((self.test_data[i][random.randint(0, len(self.test_data[i]) - 1)], ind))
+                            images.append(((i, random.randint(0, len(self.test_data[i]) - 1)), ind))
                         ind += 1
             elif self.scenario_type == 2:
                 if self.train:
@@ -118,7 +121,7 @@ class OMNIGLOT(data.Dataset):
                     for i in img_classes:
                         img_samples = np.random.choice(len(self.train_data[i]), self.scenario_size, replace=False)
                         for j in img_samples:
-                            images.append((self.train_data[i][j], ind))
+                            images.append(((i, j), ind))
                         ind += 1
                 else:
                     img_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
@@ -126,7 +129,7 @@ class OMNIGLOT(data.Dataset):
                     for i in img_classes:
                         img_samples = np.random.choice(len(self.test_data[i]), self.scenario_size, replace=False)
                         for j in img_samples:
-                            images.append((self.test_data[i][j], ind))
+                            images.append(((i, j), ind))
                         ind += 1
 
             elif self.scenario_type == 3:
@@ -143,11 +146,11 @@ class OMNIGLOT(data.Dataset):
                         for j in img_samples:
                             if ind == self.class_choice:
                                 if k == 0:
-                                    images.append((self.train_data[i][j], ind))
+                                    images.append(((i, j), ind))
                                 else:
-                                    appended_images.append((self.train_data[i][j], ind))
+                                    appended_images.append(((i, j), ind))
                             else:
-                                images.append((self.train_data[i][j], ind))
+                                images.append(((i, j), ind))
                             k += 1
 
                         ind += 1
@@ -166,11 +169,11 @@ class OMNIGLOT(data.Dataset):
                         for j in img_samples:
                             if ind == self.class_choice:
                                 if k == 0:
-                                    images.append((self.test_data[i][j], ind))
+                                    images.append(((i, j), ind))
                                 else:
-                                    appended_images.append((self.test_data[i][j], ind))
+                                    appended_images.append(((i, j), ind))
                             else:
-                                images.append((self.test_data[i][j], ind))
+                                images.append(((i, j), ind))
                             k += 1
                         ind += 1
                     for img in appended_images:
@@ -179,16 +182,9 @@ class OMNIGLOT(data.Dataset):
             img_list, target_list = [], [] 
 
             for i in range(len(images)):
-                img, label = images[i]
-                img = Image.fromarray(img.numpy())
-
-                if self.transform is not None:
-                    img = self.transform(img)
+                (c, j), label = images[i]
+                img = self.image_cache.image(c, j)
 
-                # Normalizing (pixels are binary):
-                threshold = torch.Tensor([0.0])
-                img = (img == threshold).float() * 1
-                
                 img_list.append(img)
                 target_list.append(label)
 
@@ -206,15 +202,15 @@ class OMNIGLOT(data.Dataset):
                         img_classes.append(r)
                 ind = 0
                 for i in img_classes:
-                    for j in self.train_data[i]:
-                        images.append((j, ind))
+                    for j in range(len(self.train_data[i])):
+                        images.append(((i, j), ind))
                     ind += 1
             else:
                 img_classes = np.random.choice(len(self.test_labels), self.classes, replace=False)
                 ind = 0
                 for i in img_classes:
-                    for j in self.test_data[i]:
-                        images.append((j, ind))
+                    for j in range(len(self.test_data[i])):
+                        images.append(((i, j), ind))
                     ind += 1
 
             images_indexes = []
@@ -226,35 +222,56 @@ class OMNIGLOT(data.Dataset):
 
             img_list = []
             target_list = []
-            rotations = [0, 90, 180, 270]
-
-            image_rotations = [rotations[random.randint(0, len(rotations)-1)] for i in range(len(img_classes))]
+            # Class specific rotations (index of the cached variant: none, vflip, hflip, both):
+            image_rotations = [random.randint(0, 3) for i in range(len(img_classes))]
             for i in images_indexes:
-                img, label = images[i]
-                img = Image.fromarray(img.numpy())
-
-                if self.transform is not None:
-                    if self.train and not self.test:
-                        # Applying class specific rotations:
-                        if image_rotations[label] == 90:
-                            img = transforms.vflip(img)
-                        elif image_rotations[label] == 180:
-                            img = transforms.hflip(img)
-                        elif image_rotations[label] == 270:
-                            img = transforms.hflip(transforms.vflip(img))
-                    img = self.transform(img)
-                if self.target_transform is not None:
-                    target = self.target_transform(target)
-
-                # Normalizing (pixels are binary):
-                threshold = torch.Tensor([0.0])
-                img = (img == threshold).float() * 1
-                
+                (c, j), label = images[i]
+
+                if self.train and not self.test:
+                    img = self.image_cache.image(c, j, image_rotations[label])
+                else:
+                    img = self.image_cache.image(c, j)
+
                 img_list.append(img)
                 target_list.append(label)
 
             return img_list, target_list
 
+    def sample_episode_batch(self, batch_size):
+        """
+        Draws a whole batch of (non-scenario) episodes at once, with a single gather from the image cache.
+        :param batch_size: Number of episodes.
+        :return: FloatTensor (episode_size, batch_size, H, W) of images,
+                 LongTensor (episode_size, batch_size) of labels.
+        """
+        if self.train:
+            images = self.train_data
+        else:
+            images = self.test_data
+        nof_classes, nof_samples = images.shape[0], images.shape[1]
+
+        # Distinct classes for every episode, the class' slot in the episode is its label:
+        img_classes = np.argsort(np.random.rand(batch_size, nof_classes), axis=1)[:, :self.classes]
+
+        # Drawing (with replacement) among all images of the episode's classes:
+        images_indexes = np.random.randint(0, self.classes * nof_samples, (batch_size, self.episode_size))
+        labels = images_indexes // nof_samples
+        samples = images_indexes % nof_samples
+
+        # Class specific rotations:
+        if self.train and not self.test:
+            image_rotations = np.random.randint(0, VARIANTS, (batch_size, self.classes))
+        else:
+            image_rotations = np.zeros((batch_size, self.classes), dtype=np.int64)
+
+        classes = np.take_along_axis(img_classes, labels, axis=1)
+        rotations = np.take_along_axis(image_rotations, labels, axis=1)
+
+        # Gathering in (episode, batch) order:
+        episode_batch = images[classes.T, samples.T, rotations.T].astype(np.float32)
+
+        return torch.from_numpy(episode_batch), torch.from_numpy(np.ascontiguousarray(labels.T))
+
     def __len__(self):
         if self.train:
             return len(self.train_data)
@@ -283,3 +300,19 @@ class OMNIGLOT(data.Dataset):
             torch.save(self.test_set, f)
 
         print("Data successfully written...")
+
+
+class OmniglotEpisodes(data.Dataset):
+    """
+    Batch-level view of an OMNIGLOT dataset, where every item is a whole batch of episodes.
+    Meant for a DataLoader with batch_size=None.
+    """
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __getitem__(self, index):
+        return self.dataset.sample_episode_batch(self.batch_size)
+
+    def __len__(self):
+        return max(1, len(self.dataset) // self.batch_size)
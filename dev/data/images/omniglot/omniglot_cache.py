@@ -0,0 +1,92 @@
+from __future__ import print_function
+import hashlib
+import os
+import os.path
+import numpy as np
+import torch
+from PIL import Image
+from utils import transforms
+
+
+# Class specific rotations: [none, vflip, hflip, vflip + hflip]
+VARIANTS = 4
+
+
+def transform_key(transform):
+    """Short hash identifying the parameters of a (composed) transform."""
+    parts = []
+    for t in getattr(transform, 'transforms', [transform]):
+        parts.append(type(t).__name__ + str(sorted(vars(t).items())))
+    return hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()[0:8]
+
+
+def apply_variant(img, variant):
+    """Applies one of the class specific rotations to a PIL image."""
+    if variant == 1:
+        img = transforms.vflip(img)
+    elif variant == 2:
+        img = transforms.hflip(img)
+    elif variant == 3:
+        img = transforms.hflip(transforms.vflip(img))
+    return img
+
+
+class OmniglotCache:
+    """
+    Omniglot images stored already transformed and binarized, for every rotation variant.
+    The images are kept as a uint8 array of shape (classes, samples, VARIANTS, H, W) in a memory-mapped
+    .npy file, keyed by the transform parameters, so drawing an image is plain indexing (no PIL).
+    """
+
+    def __init__(self, folder, data_file, transform):
+        """
+        :param folder: Folder holding the processed dataset.
+        :param data_file: Name of the processed dataset file (e.g. training.pt).
+        :param transform: The transform (resize + to-tensor) the cache is built with.
+        """
+        self.folder = folder
+        self.transform = transform
+        name = os.path.splitext(data_file)[0] + "_" + transform_key(transform)
+        self.image_file = os.path.join(folder, name + "_images.npy")
+        self.label_file = os.path.join(folder, name + "_labels.npy")
+        self.images = None
+        self.labels = None
+
+    def exists(self):
+        return os.path.exists(self.image_file) and os.path.exists(self.label_file)
+
+    def build(self, data, labels):
+        """
+        One-time transform of the full dataset.
+        :param data: ByteTensor (classes, samples, 105, 105) of raw images.
+        :param labels: LongTensor (classes) of class labels.
+        """
+        print("Building image cache " + self.image_file + "...")
+        classes, samples = data.size(0), data.size(1)
+        height, width = self.transform(Image.fromarray(data[0][0].numpy())).size()[-2:]
+
+        # Written to a temporary file first, so an interrupted build is never picked up:
+        temporary_file = self.image_file + ".tmp"
+        images = np.lib.format.open_memmap(temporary_file, mode='w+', dtype=np.uint8,
+                                           shape=(classes, samples, VARIANTS, height, width))
+        for c in range(classes):
+            for s in range(samples):
+                img = Image.fromarray(data[c][s].numpy())
+                for v in range(VARIANTS):
+                    # Normalizing (pixels are binary):
+                    images[c, s, v] = (self.transform(apply_variant(img, v))[0] == 0).numpy()
+        images.flush()
+        del images
+        os.replace(temporary_file, self.image_file)
+        np.save(self.label_file, np.asarray(labels, dtype=np.int64))
+
+        print("Image cache successfully written...")
+
+    def load(self):
+        self.images = np.load(self.image_file, mmap_mode='r')
+        self.labels = np.load(self.label_file)
+        return self.images, self.labels
+
+    def image(self, c, s, variant=0):
+        """Returns the image as a FloatTensor (1, H, W), as produced by the transform + normalization."""
+        return torch.from_numpy(self.images[c, s, variant].astype(np.float32)).unsqueeze(0)
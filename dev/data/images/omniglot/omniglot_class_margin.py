@@ -1,6 +1,5 @@
 from __future__ import print_function
 import torch.utils.data as data
-from PIL import Image
 import random
 import os
 import operator
@@ -9,7 +8,8 @@ import errno
 import torch
 from torch.autograd import Variable
 import numpy as np
-from utils import transforms
+from data.images.omniglot.omniglot_cache import OmniglotCache
+from reinforcement_utils.class_difficulty import ClassDifficultyIndex
 
 
 
@@ -27,7 +27,7 @@ class OMNIGLOT_MARGIN(data.Dataset):
     - target_transform: how to transform the target
     - download: need to download the dataset
     '''
-    def __init__(self, root, train=True, transform=None, target_transform=None, download=False, partition=0.8, omniglot_loader=None, classes=3, episode_size=30, scenario=False, scenario_size=5, margin_time=2, MARGIN_SIZE=2, q_network=None):
+    def __init__(self, root, train=True, transform=None, target_transform=None, download=False, partition=0.8, omniglot_loader=None, classes=3, episode_size=30, scenario=False, scenario_size=5, margin_time=2, MARGIN_SIZE=2, margin_index=False, margin_refresh=0.25, margin_sampler=None, shared_network=None):
         self.root = os.path.expanduser(root)
         self.transform = transform
         self.target_transform = target_transform
@@ -40,11 +40,10 @@ class OMNIGLOT_MARGIN(data.Dataset):
         self.scenario = scenario
         self.scenario_size = scenario_size
         self.classify = omniglot_loader.classify
-        self.q_network = q_network
         self.margin_time = margin_time
-        if self.classify:
-            self.training_file = "classify_" + self.training_file
-            self.test_file = "classify_" + self.test_file
+        # The processed (versioned) files are written by the loader:
+        self.training_file = omniglot_loader.training_file
+        self.test_file = omniglot_loader.test_file
         self.partition = partition
 
         if download and not self._check_exists():
@@ -56,12 +55,27 @@ class OMNIGLOT_MARGIN(data.Dataset):
             raise RuntimeError('Dataset not found.' +
                                ' You can use download=True to download it')
 
+        # Images are drawn from a pre-transformed cache of shape (classes, samples, rotations, H, W):
+        data_file = self.training_file if self.train else self.test_file
+        self.image_cache = OmniglotCache(os.path.join(self.root, self.processed_folder), data_file, self.transform)
+        if not self.image_cache.exists():
+            self.image_cache.build(*torch.load(os.path.join(self.root, self.processed_folder, data_file)))
+
         if self.train:
-            self.train_data, self.train_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.training_file))
+            self.train_data, self.train_labels = self.image_cache.load()
         else:
-            self.test_data, self.test_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.test_file))
+            self.test_data, self.test_labels = self.image_cache.load()
+
+        # Persistent per-class margins, the training pool is drawn from:
+        self.class_index = None
+        if margin_index and self.train:
+            self.class_index = ClassDifficultyIndex(len(self.train_labels), refresh=margin_refresh)
+
+        # Margin sampling inside the DataLoader workers (see MarginCollate), on a shared snapshot of the Q-network:
+        self.margin_sampler = margin_sampler
+        self.shared_network = shared_network
+        if self.margin_sampler is not None:
+            self.margin_sampler.class_index = self.class_index
 
     def __getitem__(self, index):
         if self.scenario:
@@ -72,9 +86,9 @@ class OMNIGLOT_MARGIN(data.Dataset):
                 for i in img_classes:
                     if ind == 0:
                         for j in range(self.scenario_size):
-                            images.append((self.train_data[i][j], ind))
+                            images.append(((i, j), ind))
                     else:
-                        images.append((self.train_data[i][random.randint(0, 19)], ind))
+                        images.append(((i, random.randint(0, 19)), ind))
                     ind += 1
             else:
                 img_classes = np.random.choice(len(self.test_labels), 2, replace=False)
@@ -82,55 +96,47 @@ class OMNIGLOT_MARGIN(data.Dataset):
                 for i in img_classes:
                     if ind == 0:
                         for j in range(self.scenario_size):
-                            images.append((self.test_data[i][j], ind))
+                            images.append(((i, j), ind))
                     else:
-                        images.append((self.test_data[i][random.randint(0, 19)], ind))
+                        images.append(((i, random.randint(0, 19)), ind))
                     ind += 1
             img_list, target_list = [], [] 
 
             for i in range(len(images)):
-                img, label = images[i]
-                img = Image.fromarray(img.numpy())
-
-                if self.transform is not None:
-                    img = self.transform(img)
-
-                # Normalizing (pixels are binary):
-                for row in range(len(img[0])):
-                    for i in range(len(img[0][row])):
-                        if img[0][row][i] > 0:
-                            img[0][row][i] = 0.0
-                        else:
-                            img[0][row][i] = 1.0
-                
+                (c, j), label = images[i]
+                img = self.image_cache.image(c, j)
+
                 img_list.append(img)
                 target_list.append(label)
 
             return img_list, target_list
 
+        # Every image is returned with all its rotation variants (VARIANTS, H, W), the sampler picks one per class.
+        # The targets are the dataset classes, grouped per class:
         else:
             img_list, target_list = [], []
             if self.train:
                 # Train-dataset:
-                img_classes = np.random.choice(len(self.train_labels), int(self.classes*self.MARGIN_SIZE), replace=False)
+                if self.class_index is not None:
+                    img_classes = self.class_index.draw_pool(int(self.classes*self.MARGIN_SIZE), self.MARGIN_SIZE)
+                else:
+                    img_classes = np.random.choice(len(self.train_labels), int(self.classes*self.MARGIN_SIZE),
+                                                   replace=False)
 
-                ind = 0
                 for i in img_classes:
                     for j in self.train_data[i]:
-                        img_list.append(j)
-                        target_list.append(ind)
-                    ind += 1
+                        img_list.append(torch.from_numpy(np.array(j)))
+                        target_list.append(int(i))
 
             else:
                 # Test-dataset:
                 img_classes = np.random.choice(len(self.test_labels), int(self.classes*self.MARGIN_SIZE), replace=False)
-                ind = 0
                 for i in img_classes:
                     for j in self.test_data[i]:
-                        img_list.append(j)
-                        target_list.append(ind)
-                    ind += 1
+                        img_list.append(torch.from_numpy(np.array(j)))
+                        target_list.append(int(i))
 
+            # With margin workers, the batch of pools is scored by the loader's MarginCollate:
             return img_list, target_list
 
     def __len__(self):
@@ -5,6 +5,8 @@ import os.path
 import errno
 import torch
 import numpy as np
+from utils.text.packed_text import PackedText
+from reinforcement_utils.class_difficulty import ClassDifficultyIndex
 
 
 class TextMargin(data.Dataset):
@@ -25,7 +27,8 @@ class TextMargin(data.Dataset):
     '''
     def __init__(self, root, train=True, download=False, partition=0.8, data_loader=None, classes=3,
                  episode_size=30, tensor_length=18, sentence_length=50, cuda=False, scenario=False,
-                 scenario_size=5, embedding_size=200, margin_time=4, MARGIN_SIZE=2, q_network=None, glove=False):
+                 scenario_size=5, embedding_size=200, margin_time=4, MARGIN_SIZE=2, glove=False,
+                 margin_index=False, margin_refresh=0.25, margin_sampler=None, shared_network=None):
         self.root = os.path.expanduser(root)
         self.tensor_length = tensor_length
         self.sentence_length = sentence_length
@@ -37,7 +40,6 @@ class TextMargin(data.Dataset):
         self.margin_time = margin_time
         self.MARGIN_SIZE = MARGIN_SIZE
         self.print = True
-        self.q_network = q_network
         self.scenario = scenario
         self.all_margins = []
         self.cuda = cuda
@@ -47,9 +49,9 @@ class TextMargin(data.Dataset):
 
         # Saving different versions so we can experiment with different setups simultaneously
         self.training_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
-                              + "_" + str(self.pretrained_vectors) + ".pt"
+                              + "_" + str(self.pretrained_vectors)
         self.test_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
-                          + "_" + str(self.pretrained_vectors) + ".pt"
+                          + "_" + str(self.pretrained_vectors)
         self.dictionary_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
                                 + "_" + str(self.pretrained_vectors) + ".pt"
         self.word_vector_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
@@ -69,13 +71,25 @@ class TextMargin(data.Dataset):
             raise RuntimeError('Dataset not found.' +
                                'Check instructions at GitHub on where to download!')
 
+        # Packed, memory-mapped texts (see PackedText):
         if self.train:
-            self.train_data, self.train_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.training_file))
+            self.train_data = PackedText(os.path.join(self.root, self.processed_folder), self.training_file).load()
+            self.train_labels = self.train_data.labels
         else:
-            self.test_data, self.test_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.test_file))
-        
+            self.test_data = PackedText(os.path.join(self.root, self.processed_folder), self.test_file).load()
+            self.test_labels = self.test_data.labels
+
+        # Persistent per-class margins, the training pool is drawn from:
+        self.class_index = None
+        if margin_index and self.train:
+            self.class_index = ClassDifficultyIndex(len(self.train_labels), refresh=margin_refresh)
+
+        # Margin sampling inside the DataLoader workers (see MarginCollate), on a shared snapshot of the Q-network:
+        self.margin_sampler = margin_sampler
+        self.shared_network = shared_network
+        if self.margin_sampler is not None:
+            self.margin_sampler.class_index = self.class_index
+
         self.dictionary = torch.load(os.path.join(self.root, self.processed_folder, self.dictionary_file))
 
     def __getitem__(self, index):
@@ -84,25 +98,26 @@ class TextMargin(data.Dataset):
         label_list = []
         
         if self.train:
-            # Collect randomly drawn classes:
-            text_classes = np.random.choice(len(self.train_labels), self.classes*self.MARGIN_SIZE, replace=False)
-                
-            # Give random class-slot in vector:
-            ind = 0
+            # Collect the classes of the pool (randomly, or from the class index):
+            if self.class_index is not None:
+                text_classes = self.class_index.draw_pool(self.classes*self.MARGIN_SIZE, self.MARGIN_SIZE)
+            else:
+                text_classes = np.random.choice(len(self.train_labels), self.classes*self.MARGIN_SIZE, replace=False)
+
+            # The labels are the dataset classes, grouped per class:
             for i in text_classes:
-                text_samples = np.random.choice(len(self.train_data[i]), int(self.episode_size/self.classes),
+                text_samples = np.random.choice(self.train_data.class_size(i), int(self.episode_size/self.classes),
                                                 replace=False)
                 for j in text_samples:
-                    text_list.append(self.train_data[i][j])
-                    label_list.append(ind)
-                ind += 1
-
-        episode_tensor = torch.zeros(len(text_list), 1, self.sentence_length).type(torch.LongTensor)
+                    text_list.append((i, j))
+                    label_list.append(int(i))
 
-        # Iterating over all texts collected:
-        for i in range(len(text_list)):
-                episode_tensor[i][0] = text_list[i][0]
+        # Gathering the first sentence of all texts collected:
+        classes, documents = zip(*text_list)
+        episode_tensor = self.train_data.sentences(classes, documents, self.sentence_length).view(len(text_list), 1,
+                                                                                                  self.sentence_length)
 
+        # With margin workers, the batch of pools is scored by the loader's MarginCollate:
         return episode_tensor, torch.LongTensor(label_list)
 
     # Need to fake this so the batch-collector doesn't collect to few batches
@@ -110,8 +125,8 @@ class TextMargin(data.Dataset):
         return 256
 
     def _check_exists(self):
-        return os.path.exists(os.path.join(self.root, self.processed_folder, self.training_file)) and \
-        os.path.exists(os.path.join(self.root, self.processed_folder, self.test_file))
+        return PackedText(os.path.join(self.root, self.processed_folder), self.training_file).exists() and \
+            PackedText(os.path.join(self.root, self.processed_folder), self.test_file).exists()
 
     def write_datasets(self):
 
@@ -126,10 +141,8 @@ class TextMargin(data.Dataset):
             else:
                 raise
 
-        with open(os.path.join(self.root, self.processed_folder, self.training_file), 'wb') as f:
-            torch.save(self.training_set, f)
-        with open(os.path.join(self.root, self.processed_folder, self.test_file), 'wb') as f:
-            torch.save(self.test_set, f)
+        PackedText(os.path.join(self.root, self.processed_folder), self.training_file).build(*self.training_set)
+        PackedText(os.path.join(self.root, self.processed_folder), self.test_file).build(*self.test_set)
         with open(os.path.join(self.root, self.processed_folder, self.dictionary_file), 'wb') as f:
             torch.save(self.dictionary, f)
         with open(os.path.join(self.root, self.processed_folder, self.word_vector_file), 'wb') as f:
@@ -1,13 +1,11 @@
 from __future__ import print_function
 import torch.utils.data as data
-from PIL import Image
-import random
 import os
 import os.path
 import errno
 import torch
 import numpy as np
-from utils import transforms
+from utils.text.packed_text import PackedText, sample_distinct
 
 
 class TEXT(data.Dataset):
@@ -49,8 +47,8 @@ class TEXT(data.Dataset):
             self.pretrained_vectors = "glove"
 
         # Saving different versions so we can experiment with different setups simultaneously
-        self.training_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors) + ".pt"
-        self.test_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors) + ".pt"
+        self.training_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors)
+        self.test_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors)
         self.dictionary_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors) + ".pt"
         self.word_vector_file += "_" + str(sentence_length) + "_" + str(embedding_size) + "_" + str(self.pretrained_vectors) + ".pt"
 
@@ -68,202 +66,90 @@ class TEXT(data.Dataset):
             raise RuntimeError('Dataset not found.' +
                                'Check instructions at GitHub on where to download!')
 
+        # Packed, memory-mapped texts (see PackedText):
         if self.train:
-            self.train_data, self.train_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.training_file))
+            self.train_data = PackedText(os.path.join(self.root, self.processed_folder), self.training_file).load()
+            self.train_labels = self.train_data.labels
         else:
-            self.test_data, self.test_labels = torch.load(
-                os.path.join(self.root, self.processed_folder, self.test_file))
-        
+            self.test_data = PackedText(os.path.join(self.root, self.processed_folder), self.test_file).load()
+            self.test_labels = self.test_data.labels
+
         self.dictionary = torch.load(os.path.join(self.root, self.processed_folder, self.dictionary_file))
 
     def __getitem__(self, index):
+        episode_tensor, episode_labels = self.sample_episode_batch(1)
+        return episode_tensor[0], episode_labels[0]
+
+    def sample_episode_batch(self, batch_size):
+        """
+        Draws a whole batch of episodes (normal or scenario) at once, with a single gather from the packed texts.
+        :param batch_size: Number of episodes.
+        :return: LongTensor (batch_size, episode_length, 1, sentence_length) of texts,
+                 LongTensor (batch_size, episode_length) of labels.
+        """
+        if self.train:
+            packed = self.train_data
+        else:
+            packed = self.test_data
+        class_sizes = packed.class_sizes()
 
-        text_list = []
-        label_list = []
         if self.scenario:
-            texts = []
-            # As in Active One-Shot Learning:
-            if self.scenario_type == 0:
-                if self.train:
-                    txt_classes = np.random.choice(len(self.train_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        if ind == 0:
-                            for j in range(self.scenario_size):
-                                texts.append((self.train_data[i][j], ind))
-                        else:
-                            texts.append((self.train_data[i][random.randint(0, len(self.train_data[i]) - 1)], ind))
-                        ind += 1
-                else:
-                    txt_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        if ind == 0:
-                            for j in range(self.scenario_size):
-                                texts.append((self.test_data[i][j], ind))
-                        else:
-                            texts.append((self.test_data[i][random.randint(0, len(self.test_data[i]) - 1)], ind))
-                        ind += 1
-
-            # Zero-shot scenario:
-            elif self.scenario_type == 1:
-                if self.train:
-                    txt_classes = np.random.choice(len(self.train_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        if ind == self.class_choice:
-                            for j in range(self.scenario_size):
-                                texts.append((self.train_data[i][j], ind))
-                        else:
-                            texts.append((self.train_data[i][random.randint(0, len(self.train_data[i]) - 1)], ind))
-                        ind += 1
-                else:
-                    txt_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        if ind == self.class_choice:
-                            for j in range(self.scenario_size):
-                                texts.append((self.test_data[i][j], ind))
-                        else:
-                            texts.append((self.test_data[i][random.randint(0, len(self.test_data[i]) - 1)], ind))
-                        ind += 1
+            # Distinct classes for every episode, the class' slot in the episode is its label:
+            txt_classes = np.argsort(np.random.rand(batch_size, len(class_sizes)), axis=1)[:, :self.scenario_classes]
+            sizes = class_sizes[txt_classes]
+
+            # The texts of every slot (scenario_size only where the episode uses them, else one), and the
+            # (slot, draw) of every text in the episode:
+            documents = np.zeros((batch_size, self.scenario_classes, self.scenario_size), dtype=np.int64)
+            # As in Active One-Shot Learning (first class), and Zero-shot scenario (chosen class):
+            if self.scenario_type == 0 or self.scenario_type == 1:
+                chosen = 0 if self.scenario_type == 0 else self.class_choice
+                documents[:, :, 0:1] = sample_distinct(sizes, 1)
+                # The chosen class always shows its first texts:
+                assert (sizes[:, chosen] >= self.scenario_size).all(), "Fewer texts than the scenario size"
+                documents[:, chosen] = np.arange(self.scenario_size)
+                episode = [(s, k) for s in range(self.scenario_classes)
+                           for k in range(self.scenario_size if s == chosen else 1)]
             # K-shot scenario:
             elif self.scenario_type == 2:
-                if self.train:
-                    txt_classes = np.random.choice(len(self.train_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        txt_samples = np.random.choice(len(self.train_data[i]), self.scenario_size, replace=False)
-                        for j in txt_samples:
-                            texts.append((self.train_data[i][j], ind))
-                        ind += 1
-                else:
-                    txt_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
-                    ind = 0
-                    for i in txt_classes:
-                        txt_samples = np.random.choice(len(self.test_data[i]), self.scenario_size, replace=False)
-                        for j in txt_samples:
-                            texts.append((self.test_data[i][j], ind))
-                        ind += 1
-            # One-shot scenario:
-            elif self.scenario_type == 3:
-                if self.train:
-                    txt_classes = np.random.choice(len(self.train_labels), self.scenario_classes, replace=False)
-                    appended_texts = []
-                    ind = 0
-                    k = 0
-                    for i in txt_classes:
-                        if ind == self.class_choice:
-                            txt_samples = np.random.choice(len(self.train_data[i]), self.scenario_size, replace=False)
-                        else:
-                            txt_samples = np.random.choice(len(self.train_data[i]), 1, replace=False)
-                        for j in txt_samples:
-                            if ind == self.class_choice:
-                                if k == 0:
-                                    texts.append((self.train_data[i][j], ind))
-                                    k += 1
-                                else:
-                                    appended_texts.append((self.train_data[i][j], ind))
-                            else:
-                                texts.append((self.train_data[i][j], ind))
-                            
-                        ind += 1
-                    for txt in appended_texts:
-                        texts.append(txt)
-                else:
-                    txt_classes = np.random.choice(len(self.test_labels), self.scenario_classes, replace=False)
-                    appended_texts = []
-                    ind = 0
-                    k = 0
-                    for i in txt_classes:
-                        if ind == self.class_choice:
-                            txt_samples = np.random.choice(len(self.test_data[i]), self.scenario_size, replace=False)
-                        else:
-                            txt_samples = np.random.choice(len(self.test_data[i]), 1, replace=False)
-                        for j in txt_samples:
-                            if ind == self.class_choice:
-                                if k == 0:
-                                    texts.append((self.test_data[i][j], ind))
-                                    k += 1
-                                else:
-                                    appended_texts.append((self.test_data[i][j], ind))
-                            else:
-                                texts.append((self.test_data[i][j], ind))
-                            
-                        ind += 1
-                    for txt in appended_texts:
-                        texts.append(txt)
-
-            episode_texts, episode_labels = [], []
-            for index in range(len(texts)):
-                txt, lbl = texts[index]
-                episode_texts.append(txt)
-                episode_labels.append(lbl)
-
-            zero_tensor = torch.LongTensor(torch.cat([torch.LongTensor(
-                torch.cat([torch.zeros(self.sentence_length).type(torch.LongTensor)])) for j in range(len(texts))]))
-            episode_tensor = zero_tensor.view(len(texts), 1, self.sentence_length)
-
-            for i in range(len(episode_texts)):
-                episode_tensor[i][0] = episode_texts[i][0]
+                documents = sample_distinct(sizes, self.scenario_size)
+                episode = [(s, k) for s in range(self.scenario_classes) for k in range(self.scenario_size)]
+            # One-shot scenario (the other texts of the chosen class come last):
+            else:
+                documents[:, :, 0:1] = sample_distinct(sizes, 1)
+                documents[:, self.class_choice] = sample_distinct(sizes[:, self.class_choice], self.scenario_size)
+                episode = [(s, 0) for s in range(self.scenario_classes)] + \
+                          [(self.class_choice, k) for k in range(1, self.scenario_size)]
+            slots, draws = (np.asarray(x, dtype=np.int64) for x in zip(*episode))
 
-            return episode_tensor, torch.LongTensor(episode_labels)
+            labels = np.tile(slots, (batch_size, 1))
+            classes = txt_classes[:, slots]
+            documents = documents[:, slots, draws]
 
-        # Normal drawing (training):
+        # Normal drawing:
         else:
-            if self.train:
-                # Collect randomly drawn classes:
-                text_classes = np.random.choice(len(self.train_labels), self.classes, replace=False)
+            # Distinct classes for every episode, the class' slot in the episode is its label:
+            text_classes = np.argsort(np.random.rand(batch_size, len(class_sizes)), axis=1)[:, :self.classes]
 
-                # Give random class-slot in vector:
-                ind = 0
-                for i in text_classes:
-                    text_samples = np.random.choice(len(self.train_data[i]), 15, replace=False)
-                    for j in text_samples:
-                        text_list.append(self.train_data[i][j])
-                        label_list.append(ind)
-                    ind += 1
-            else:
-                # Collect randomly drawn classes:
-                text_classes = np.random.choice(len(self.test_labels), self.classes, replace=False)
+            # 15 distinct texts of every class, of which episode_size are drawn (in random order):
+            text_samples = sample_distinct(class_sizes[text_classes], 15).reshape(batch_size, -1)
+            text_indexes = np.argsort(np.random.rand(batch_size, self.classes * 15), axis=1)[:, :self.episode_size]
 
-                # Give random class-slot in vector:
-                ind = 0
-                for i in text_classes:
-                    text_samples = np.random.choice(len(self.test_data[i]), 15, replace=False)
-                    for j in text_samples:
-                        text_list.append(self.test_data[i][j])
-                        label_list.append(ind)
-                    ind += 1
-            # Select the random texts from all collected texts:
-            text_indexes = np.random.choice(len(text_list), self.episode_size, replace=False)
+            labels = text_indexes // 15
+            classes = np.take_along_axis(text_classes, labels, axis=1)
+            documents = np.take_along_axis(text_samples, text_indexes, axis=1)
 
-            episode_texts, episode_labels = [], []
-            for index in text_indexes:
-                episode_texts.append(text_list[index])
-                episode_labels.append(label_list[index])
+        # Gathering the first sentence of every text:
+        episode_tensor = packed.sentences(classes, documents, self.sentence_length).unsqueeze(2)
 
-            # Create empty tensor of desired size (including batch):
-            episode_tensor = torch.zeros(self.episode_size, 1, self.sentence_length).type(torch.LongTensor)
-
-            # Zip and shuffle:
-            episode_list = list(zip(episode_texts, episode_labels))
-            random.shuffle(episode_list)
-            # Unzip:
-            shuffled_text, shuffled_labels = zip(*episode_list)
-
-            # Insert all texts into final episode_tensor:
-            for i in range(self.episode_size):
-                episode_tensor[i][0] = shuffled_text[i][0]
-            return episode_tensor, torch.LongTensor(shuffled_labels)
+        return episode_tensor, torch.from_numpy(labels)
 
     def __len__(self):
         return 256
 
     def _check_exists(self):
-        return os.path.exists(os.path.join(self.root, self.processed_folder, self.training_file)) and \
-            os.path.exists(os.path.join(self.root, self.processed_folder, self.test_file))
+        return PackedText(os.path.join(self.root, self.processed_folder), self.training_file).exists() and \
+            PackedText(os.path.join(self.root, self.processed_folder), self.test_file).exists()
 
     def write_datasets(self):
 
@@ -278,13 +164,27 @@ class TEXT(data.Dataset):
             else:
                 raise
 
-        with open(os.path.join(self.root, self.processed_folder, self.training_file), 'wb') as f:
-            torch.save(self.training_set, f)
-        with open(os.path.join(self.root, self.processed_folder, self.test_file), 'wb') as f:
-            torch.save(self.test_set, f)
+        PackedText(os.path.join(self.root, self.processed_folder), self.training_file).build(*self.training_set)
+        PackedText(os.path.join(self.root, self.processed_folder), self.test_file).build(*self.test_set)
         with open(os.path.join(self.root, self.processed_folder, self.dictionary_file), 'wb') as f:
             torch.save(self.dictionary, f)
         with open(os.path.join(self.root, self.processed_folder, self.word_vector_file), 'wb') as f:
             torch.save(self.weight_vector, f)
 
         print("Data successfully written...")
+
+
+class TextEpisodes(data.Dataset):
+    """
+    Batch-level view of a TEXT dataset, where every item is a whole batch of episodes.
+    Meant for a DataLoader with batch_size=None.
+    """
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __getitem__(self, index):
+        return self.dataset.sample_episode_batch(self.batch_size)
+
+    def __len__(self):
+        return max(1, len(self.dataset) // self.batch_size)
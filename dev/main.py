@@ -5,6 +5,7 @@ import os
 
 # PyTorch
 import torch
+import torch.multiprocessing as multiprocessing
 import torch.nn as nn
 import torch.optim as optimizers
 
@@ -14,6 +15,8 @@ from utils.checkpoint import save_checkpoint, load_checkpoint
 from utils.arguments import parse_arguments
 from utils.status import print_best_stats, StatusHandler, generate_name_from_args
 from utils.plot_handler import PlotHandler
+from utils.episode_stream import EpisodeStream
+from utils import distributed
 
 # ML
 import train
@@ -27,6 +30,8 @@ from setup.images import ImageModelSetup, ImageNetworkSetup
 # ReinforcementLearning and Data-sets:
 from reinforcement_utils.reinforcement import ReinforcementLearning
 from reinforcement_utils.class_margin_sampling import ClassMarginSampler
+from reinforcement_utils.shared_network import SharedQNetwork
+from reinforcement_utils.actor_learner import ActorPool, RecordedActions
 
 
 # Training settings
@@ -35,27 +40,18 @@ parser = argparse.ArgumentParser(description='One-shot Learning',
 parse_arguments(parser)
 
 
-if __name__ == '__main__':
-
-    # Set up result directory
-    result_directory = 'results/'
-    if not os.path.exists(result_directory):
-        os.makedirs(result_directory)
-
-    # Parse arguments from CLI
-    args = parser.parse_args()
-    args.cuda = not args.no_cuda and torch.cuda.is_available()
+def main(rank, args):
+    """
+    Trains (rank 0 of args.processes data-parallel processes also reports, checkpoints and tests).
+    """
+    # Joining the other data-parallel processes:
+    if args.processes > 1:
+        distributed.init_process(rank, args)
 
-    assert args.LSTM or args.NTM or args.LRUA, \
-        "You need to chose a network architecture! type python main_text.py -h for help."
-
-    assert args.INH or args.REUTERS or args.QA or args.MNIST or args.OMNIGLOT, \
-        "You need to chose data-set type python main.py -h for help."
-
-    # Seed the RNG for consistent results
-    torch.manual_seed(args.seed)
+    # Seed the RNG for consistent results (independent streams per process)
+    torch.manual_seed(args.seed + rank)
     if args.cuda:
-        torch.cuda.manual_seed(args.seed)
+        torch.cuda.manual_seed(args.seed + rank)
 
     # Collecting correct data-set
     dataset = 'data'
@@ -70,8 +66,7 @@ if __name__ == '__main__':
                                 args.embedding_size, args.sentence_length)
 
     # Setting up Class Margin Sampler
-    class_margin_sampler = ClassMarginSampler(args, image_setup.train_transform,
-                                              text_setup.SENTENCE_LENGTH)
+    class_margin_sampler = ClassMarginSampler(args, text_setup.SENTENCE_LENGTH)
 
     # Creating setup based on data-set
     if args.MNIST:
@@ -92,6 +87,10 @@ if __name__ == '__main__':
 
     args.name = generate_name_from_args(args, TEXT)
 
+    # The first process builds the dataset files, the others wait for them:
+    if args.processes > 1 and rank > 0:
+        distributed.barrier()
+
     if TEXT:
         setup = TextNetworkSetup(text_setup, dataset, args)
         train_loader, test_loader, q_network = \
@@ -102,34 +101,101 @@ if __name__ == '__main__':
         train_loader, test_loader, q_network = \
             setup.train_loader, setup.test_loader, setup.q_network
 
+    if args.processes > 1 and rank == 0:
+        distributed.barrier()
+
     # Activating training on GPU
     if args.cuda:
         print("\n---Activating GPU Training---\n")
         q_network.cuda()
 
     # Loading Reinforcement module
-    ReinforcementLearning = ReinforcementLearning(args.class_vector_size)
+    reinforcement_learner = ReinforcementLearning(args.class_vector_size, seed=args.seed + rank)
+
+    # Persistent per-class margin index, shared with the margin pool dataset:
+    if args.margin_sampling and args.margin_index:
+        class_margin_sampler.class_index = train_loader.dataset.class_index
 
     # Initialize/Load Q Network & Statistics
     q_network, statistics = load_checkpoint(q_network, args)
+    if class_margin_sampler.class_index is not None:
+        if 'class_index' in statistics.statistics:
+            class_margin_sampler.class_index.load_state_dict(statistics.statistics['class_index'])
+        # The (shared) index tensors themselves, so checkpoints always hold the current index:
+        statistics.statistics['class_index'] = class_margin_sampler.class_index.state_dict()
+
+    # Every process starts from rank 0's Q-network:
+    if args.processes > 1:
+        distributed.broadcast_state(q_network)
+
+    # The margin workers score with the loaded weights from the start, not only after the next refresh:
+    if args.margin_sampling and args.margin_workers:
+        train_loader.dataset.shared_network.refresh(q_network, args.start_epoch - 1, force=True)
+
+    # Actor-learner mode: the actors run the episodes with a snapshot of the Q-network, the learner replays them:
+    actor_pool = None
+    if args.actors > 0:
+        shared_network = SharedQNetwork(q_network, args.actor_refresh, epoch=args.start_epoch - 1)
+        actor_pool = ActorPool(args.actors, train_loader, shared_network, args, TEXT, queue_size=args.actor_queue)
+    else:
+        # Long-lived episode stream, preparing batches ahead of the training step:
+        train_loader = EpisodeStream(train_loader, prefetch=args.prefetch)
+    test_loader = EpisodeStream(test_loader, prefetch=args.prefetch)
 
     # Initialize Optimizer & Loss Function
     optimizer = optimizers.Adam(q_network.parameters())
     criterion = nn.MSELoss()
 
+    # Every process steps with the gradients averaged over the processes:
+    train_statistics = statistics
+    if args.processes > 1:
+        optimizer = distributed.DistributedOptimizer(optimizer, q_network.parameters())
+        train_statistics = distributed.DistributedStatistics(statistics)
+
     training_status_handler = StatusHandler(args)
 
     # Training loop
     for epoch in range(args.start_epoch, args.epochs + 1):
 
+        # Replaying the next rollout of the actors:
+        if actor_pool is not None:
+            rollout = actor_pool.next_rollout()
+            train.train(q_network, epoch, optimizer, [(rollout.sample_batch, rollout.label_batch)], args,
+                        RecordedActions(reinforcement_learner, rollout), training_status_handler.episode,
+                        criterion, train_statistics, TEXT, margin=False, class_margin_sampler=class_margin_sampler)
+
+            # Epochs the actor's weights were behind the learner's, and rollouts still waiting:
+            statistics.push_variables({'staleness': epoch - 1 - rollout.epoch, 'queue_depth': actor_pool.depth()})
+            shared_network.refresh(q_network, epoch)
+
         # Train for one epoch
-        train.train(q_network, epoch, optimizer, train_loader, args, ReinforcementLearning,
-                    training_status_handler.episode, criterion, statistics, TEXT,
-                    margin=args.margin_sampling, class_margin_sampler=class_margin_sampler)
+        else:
+            train.train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner,
+                        training_status_handler.episode, criterion, train_statistics, TEXT,
+                        margin=args.margin_sampling and not args.margin_workers,
+                        class_margin_sampler=class_margin_sampler)
+
+        # Refresh the Q-network snapshot the margin workers score with:
+        if args.margin_sampling and args.margin_workers:
+            train_loader.dataset.shared_network.refresh(q_network, epoch)
+
+        # One epoch of the class index (its staleness), however many pools were scored:
+        if class_margin_sampler.class_index is not None:
+            class_margin_sampler.class_index.step()
+
+        # Only the first process reports and writes:
+        if rank > 0:
+            continue
 
         # Status update
         print("\n\n--- " + args.name + ": Training epoch " + str(epoch) + " ---\n\n")
         print_best_stats(statistics.statistics)
+        if actor_pool is not None:
+            print("Time waiting on actors: " + str(100.0 * actor_pool.wait_fraction())[0:4] + " %")
+            print("Weight staleness: " + str(statistics.statistics['staleness'][-1]) + " epochs, queue depth: "
+                  + str(statistics.statistics['queue_depth'][-1]))
+        else:
+            print("Time waiting on data: " + str(100.0 * train_loader.wait_fraction())[0:4] + " %")
         training_status_handler.update_status(epoch, statistics)
 
         # Write results to file
@@ -139,7 +205,7 @@ if __name__ == '__main__':
         if epoch % 10 == 0:
             # Don't want to save all test-stats
             test.validate(q_network, epoch, test_loader, args,
-                          ReinforcementLearning, statistics, TEXT, still_training=True)
+                          reinforcement_learner, statistics, TEXT, still_training=True)
             # Save best checkpoint
             if training_status_handler.update_best(statistics.statistics['training_test_reward']):
                 statistics.update_state(q_network.state_dict())
@@ -155,6 +221,21 @@ if __name__ == '__main__':
             statistics.update_state(q_network.state_dict())
             save_checkpoint(statistics.statistics, args.name, filename="backup.pth.tar")
 
+    if actor_pool is not None:
+        actor_pool.close()
+
+    # Stopping the episode streams (producer threads and workers), testing draws from the loaders themselves:
+    if isinstance(train_loader, EpisodeStream):
+        train_loader.close()
+        train_loader = train_loader.loader
+    test_loader.close()
+    test_loader = test_loader.loader
+
+    if args.processes > 1:
+        distributed.destroy_process()
+    if rank > 0:
+        return
+
     # Final checkpoint
     statistics.update_state(q_network.state_dict())
     save_checkpoint(statistics.statistics, args.name)
@@ -177,7 +258,7 @@ if __name__ == '__main__':
     # Validate model
     if choice == "1":
         validation.validate_model(args, statistics, q_network, test_loader,
-                                  train_loader, TEXT, ReinforcementLearning)
+                                  train_loader, TEXT, reinforcement_learner)
         statistics.update_state(q_network.state_dict())
         save_checkpoint(statistics.statistics, args.name, filename="testpoint.pth.tar")
 
@@ -192,10 +273,10 @@ if __name__ == '__main__':
         # Write result in tables
         tablewriter.write_stats(statistics.statistics['test_train_requests'],
                                 statistics.statistics['test_train_prediction_accuracy'],
-                                ReinforcementLearning.prediction_penalty, args.name + "/")
+                                reinforcement_learner.prediction_penalty, args.name + "/")
         tablewriter.write_stats(statistics.statistics['test_requests'],
                                 statistics.statistics['test_prediction_accuracy'],
-                                ReinforcementLearning.prediction_penalty, args.name + "/", test=True)
+                                reinforcement_learner.prediction_penalty, args.name + "/", test=True)
 
         # Write K-shot tables for test-set testing
         tablewriter.print_k_shot_tables(statistics.statistics['test_pred_dict'],
@@ -207,3 +288,42 @@ if __name__ == '__main__':
                                         statistics.statistics['test_train_acc_dict'],
                                         statistics.statistics['test_train_req_dict'],
                                         "train", args.name + "/")
+
+
+if __name__ == '__main__':
+
+    # Set up result directory
+    result_directory = 'results/'
+    if not os.path.exists(result_directory):
+        os.makedirs(result_directory)
+
+    # Parse arguments from CLI
+    args = parser.parse_args()
+    args.cuda = not args.no_cuda and torch.cuda.is_available()
+
+    assert args.LSTM or args.NTM or args.LRUA, \
+        "You need to chose a network architecture! type python main_text.py -h for help."
+
+    assert args.INH or args.REUTERS or args.QA or args.MNIST or args.OMNIGLOT, \
+        "You need to chose data-set type python main.py -h for help."
+
+    assert args.checkpoint_segment == 0 or (args.sparse_k == 0 and not args.reversible_memory), \
+        "Gradient checkpointing needs the dense memory, type python main.py -h for help."
+
+    assert args.processes == 1 or not args.cuda, \
+        "Data-parallel training runs on the CPU, type python main.py -h for help."
+
+    assert args.actors == 0 or (args.processes == 1 and not args.cuda and not args.margin_sampling), \
+        "The actor-learner mode runs in one process on the CPU, without margin sampling, " \
+        "type python main.py -h for help."
+
+    # Data-parallel processes, this process being rank 0 (keeping the interactive testing after training):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=main, args=(rank, args)) for rank in range(1, args.processes)]
+    for process in processes:
+        process.start()
+
+    main(0, args)
+
+    for process in processes:
+        process.join()
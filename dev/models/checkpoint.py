@@ -0,0 +1,115 @@
+"""Gradient checkpointing of the recurrent Q-networks' rollouts, over segments of timesteps."""
+import torch
+
+
+def _boundary(state):
+    """Detached copy of the tensors of a (nested) state of lists/tuples, requiring grad as the originals."""
+    if isinstance(state, (list, tuple)):
+        return type(state)(_boundary(s) for s in state)
+    if torch.is_tensor(state):
+        return state.detach().requires_grad_(state.requires_grad)
+    return state
+
+
+class _Segment:
+    """
+    The timesteps of a segment: its boundary state (the hidden state and the memory it starts from), and the
+    inputs of every call. The tensors autograd saves during the calls are dropped (replaced by their index),
+    and recomputed for the whole segment at once, from the boundary state, when backward first needs one.
+    """
+
+    def __init__(self, step, hidden, memory, load_memory):
+        self.step = step
+        self.hidden = hidden
+        self.memory = memory
+        self.load_memory = load_memory
+        self.calls = []
+        self.steps = 0
+
+        # Saved tensors (indexes while running forward, and the recomputed tensors):
+        self.packed = 0
+        self.saved = None
+
+    def pack(self, tensor):
+        self.packed += 1
+        return self.packed - 1
+
+    def unpack(self, index):
+        if self.saved is None:
+            self.recompute()
+
+        # Every saved tensor is unpacked once, in backward:
+        tensor, self.saved[index] = self.saved[index], None
+        return tensor
+
+    def recompute(self):
+        saved = []
+
+        def store(tensor):
+            saved.append(tensor)
+            return len(saved) - 1
+
+        # Replaying the calls from the boundary state, leaving the sequence's current memory as it is:
+        current = self.load_memory(_boundary(self.memory)) if self.load_memory is not None else None
+        hidden = _boundary(self.hidden)
+        with torch.enable_grad(), torch.autograd.graph.saved_tensors_hooks(store, lambda index: saved[index]):
+            for inp, advance, kwargs in self.calls:
+                next_hidden = self.step(inp, hidden, **kwargs)[1]
+                if advance:
+                    hidden = next_hidden
+        if self.load_memory is not None:
+            self.load_memory(current)
+
+        if len(saved) != self.packed:
+            raise RuntimeError("Recomputing a checkpointed segment saved " + str(len(saved)) + " tensors instead of "
+                               + str(self.packed) + ", the rollout must be deterministic")
+        self.saved = saved
+
+
+class SegmentCheckpoint:
+    """
+    Runs the timesteps of a recurrent Q-network in segments of (at most) length steps. Autograd keeps only the
+    segment boundary states (the hidden state, and the memory of the NTM/LRUA) instead of the activations of every
+    timestep, and the activations of a segment are recomputed during backward. The gradients are exact, for
+    memory of O(episode_size / length + length) timesteps, at the cost of one more forward pass.
+    A call continues the segment if it is given the hidden state of the previous (advancing) call, any other
+    hidden state (e.g. from reset_hidden, or detached) starts a new segment. Calls without autograd are not
+    checkpointed.
+    """
+
+    def __init__(self, length, memory_state=None, load_memory_state=None):
+        """
+        :param length: Number of timesteps per segment (0 disables checkpointing).
+        :param memory_state: Function giving the state of the memory (if any) that is not part of the hidden state.
+        :param load_memory_state: Function loading a memory state, and returning the previous one.
+        """
+        self.length = length
+        self.memory_state = memory_state
+        self.load_memory_state = load_memory_state
+        self.segment = None
+        self.hidden = None
+
+    def __call__(self, step, inp, hidden, advance=True, **kwargs):
+        """
+        :param step: The Q-network's step function (inp, hidden, **kwargs) -> (q_values, hidden).
+        :param advance: Whether the call advances the sequence (False for read-only calls on the same state).
+        """
+        if self.length == 0 or not torch.is_grad_enabled():
+            # The state may change outside of the segment:
+            self.segment = None
+            return step(inp, hidden, **kwargs)
+
+        # Starting a new segment:
+        if self.segment is None or hidden is not self.hidden or (advance and self.segment.steps == self.length):
+            memory = self.memory_state() if self.memory_state is not None else None
+            self.segment = _Segment(step, hidden, memory, self.load_memory_state)
+
+        segment = self.segment
+        with torch.autograd.graph.saved_tensors_hooks(segment.pack, segment.unpack):
+            q_values, next_hidden = step(inp, hidden, **kwargs)
+        segment.calls.append((inp, advance, kwargs))
+
+        if advance:
+            segment.steps += 1
+            self.hidden = next_hidden
+        return q_values, next_hidden
@@ -8,13 +8,24 @@ from .controller import LSTMController
 from .head import NTMReadHead, NTMWriteHead
 from .lrua_head import NTMReadHead as LRUAReadHead, NTMWriteHead as LRUAWriteHead
 from .memory import NTMMemory
+from .reversible_memory import ReversibleNTMMemory
+from .sparse_head import SparseReadHead, SparseWriteHead, SparseLRUAReadHead, SparseLRUAWriteHead
+from .sparse_memory import SparseNTMMemory
+
+
+def _detach_state(state):
+    """Detaches all tensors of a (nested) state of lists/tuples."""
+    if isinstance(state, (list, tuple)):
+        return type(state)(_detach_state(s) for s in state)
+    return state.detach()
 
 
 class EncapsulatedNTM(nn.Module):
 
     def __init__(self, num_inputs, num_outputs, num_classes, lrua,
                  controller_size, controller_layers, num_read_heads, num_write_heads, N, M,
-                 embedding_weight_matrix=None, embedding=False, dict_size=5000, embedding_size=128):
+                 embedding_weight_matrix=None, embedding=False, dict_size=5000, embedding_size=128, sparse_k=0,
+                 reversible=False):
         """Initialize an EncapsulatedNTM.
         :param num_inputs: External number of inputs.
         :param num_outputs: External number of outputs.
@@ -23,6 +34,8 @@ class EncapsulatedNTM(nn.Module):
         :param num_heads: Number of heads.
         :param N: Number of rows in the memory bank.
         :param M: Number of cols/features in the memory bank.
+        :param sparse_k: If > 0, every head accesses only k rows of a sparse memory (see SparseNTMMemory).
+        :param reversible: Reconstructs the memory during backward, instead of keeping it (see ReversibleNTMMemory).
         """
         super(EncapsulatedNTM, self).__init__()
 
@@ -42,29 +55,25 @@ class EncapsulatedNTM(nn.Module):
         self.dict_size = dict_size
 
         # Create the NTM components
-        memory = NTMMemory(N, M)
+        if sparse_k > 0:
+            memory = SparseNTMMemory(N, M, sparse_k)
+            read_head, write_head = (SparseLRUAReadHead, SparseLRUAWriteHead) if lrua else \
+                (SparseReadHead, SparseWriteHead)
+        else:
+            memory = ReversibleNTMMemory(N, M) if reversible else NTMMemory(N, M)
+            read_head, write_head = (LRUAReadHead, LRUAWriteHead) if lrua else (NTMReadHead, NTMWriteHead)
         controller = LSTMController(num_inputs + M*num_read_heads, controller_size, controller_layers, num_classes,
                                     embedding_weight_matrix=embedding_weight_matrix, embedding=embedding,
                                     dict_size=dict_size, embedding_size=embedding_size)
         heads = nn.ModuleList([])
         for i in range(num_read_heads):
-            if self.lrua:
-                heads += [
-                    LRUAReadHead(memory, controller_size),
-                ]
-            else:
-                heads += [
-                    NTMReadHead(memory, controller_size),
-                ]
+            heads += [
+                read_head(memory, controller_size),
+            ]
         for i in range(num_write_heads):
-            if self.lrua:
-                heads += [
-                    LRUAWriteHead(memory, controller_size),
-                ]
-            else:
-                heads += [
-                    NTMWriteHead(memory, controller_size),
-                ]
+            heads += [
+                write_head(memory, controller_size),
+            ]
         self.ntm = NTM(num_inputs, num_outputs, controller, memory, heads, embedding=embedding)
         self.memory = memory
 
@@ -75,6 +84,12 @@ class EncapsulatedNTM(nn.Module):
         self.previous_state = self.ntm.create_new_state(batch_size)
         return self.previous_state
 
+    def detach_sequence(self, state):
+        """Detaching the state and memory from the sequence so far (truncated backpropagation through time)."""
+        self.memory.detach()
+        self.previous_state = _detach_state(state)
+        return self.previous_state
+
     def forward(self, x=None, previous_state=None, class_vector=None, read_only=False, text=False):
         # For testing copy-task:
         if x is None:
@@ -3,17 +3,23 @@ import torch
 from torch import nn
 from torch.autograd import Variable
 import torch.nn.functional as F
-import numpy as np
 
 
 def _split_cols(mat, lengths):
-    """Split a 2D matrix to variable length columns."""
-    assert mat.size()[1] == sum(lengths), "Lengths must be summed to num columns"
-    l = np.cumsum([0] + lengths)
-    results = []
-    for s, e in zip(l[:-1], l[1:]):
-        results += [mat[:, s:e]]
-    return results
+    """Split a matrix (... x columns) to variable length columns."""
+    assert mat.size()[-1] == sum(lengths), "Lengths must be summed to num columns"
+    return torch.split(mat, lengths, dim=-1)
+
+
+def _fused_linear(linears, embeddings):
+    """Applies the linear layers of several heads as one projection.
+    :param linears: The heads' :class:`nn.Linear` (with identical output sizes).
+    :param embeddings: input representation of the controller (batch_size x controller_size).
+    :return: The outputs of every head (batch_size x heads x output size).
+    """
+    weight = torch.cat([linear.weight for linear in linears])
+    bias = torch.cat([linear.bias for linear in linears])
+    return F.linear(embeddings, weight, bias).view(embeddings.size(0), len(linears), -1)
 
 
 class NTMHeadBase(nn.Module):
@@ -41,7 +47,6 @@ class NTMHeadBase(nn.Module):
 
     def _address_memory(self, k, β, g, s, γ, w_prev):
         # Handle Activations
-        k = k.clone()
         β = F.softplus(β)
         g = F.sigmoid(g)
         s = F.softmax(F.softplus(s), dim=0)
@@ -87,6 +92,23 @@ class NTMReadHead(NTMHeadBase):
 
         return r, w_r
 
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        """Forward function of several read heads at once (one projection and one addressing pass).
+        :param heads: The read heads, sharing the same memory.
+        :param embeddings: input representation of the controller.
+        :param w_prev: previous step states, per head
+        :return: The reads and the new states, per head.
+        """
+        o = _fused_linear([head.fc_read for head in heads], embeddings)
+        k, β, g, s, γ = _split_cols(o, heads[0].read_lengths)
+
+        # Read from memory
+        w_r = heads[0]._address_memory(k, β, g, s, γ, torch.stack(w_prev, dim=1))
+        r = heads[0].memory.read(w_r)
+
+        return list(r.unbind(1)), list(w_r.unbind(1))
+
 
 class NTMWriteHead(NTMHeadBase):
     def __init__(self, memory, controller_size):
@@ -123,4 +145,27 @@ class NTMWriteHead(NTMHeadBase):
         w = self._address_memory(k, β, g, s, γ, w_prev)
         self.memory.write(w, e, a)
 
-        return w
\ No newline at end of file
+        return w
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        """Forward function of several write heads at once (one projection).
+        The heads then address and write in head order, so every head sees the writes of the heads before it.
+        :param heads: The write heads, sharing the same memory.
+        :param embeddings: input representation of the controller.
+        :param w_prev: previous step states, per head
+        :return: The new states, per head.
+        """
+        o = _fused_linear([head.fc_write for head in heads], embeddings)
+        k, β, g, s, γ, e, a = _split_cols(o, heads[0].write_lengths)
+
+        # e should be in [0, 1]
+        e = F.sigmoid(e)
+
+        # Write to memory
+        w = []
+        for h, head in enumerate(heads):
+            w += [head._address_memory(k[:, h], β[:, h], g[:, h], s[:, h], γ[:, h], w_prev[h])]
+            head.memory.write(w[h], e[:, h], a[:, h])
+
+        return w
@@ -3,17 +3,7 @@ import torch
 from torch import nn
 from torch.autograd import Variable
 import torch.nn.functional as F
-import numpy as np
-
-
-def _split_cols(mat, lengths):
-    """Split a 2D matrix to variable length columns."""
-    assert mat.size()[1] == sum(lengths), "Lengths must be summed to num columns"
-    l = np.cumsum([0] + lengths)
-    results = []
-    for s, e in zip(l[:-1], l[1:]):
-        results += [mat[:, s:e]]
-    return results
+from .head import _split_cols, _fused_linear
 
 
 class NTMHeadBase(nn.Module):
@@ -41,7 +31,6 @@ class NTMHeadBase(nn.Module):
 
     def _address_memory(self, k, g, n, w_prev, access):
         # Handle Activations
-        k = k.clone()
         g = F.sigmoid(g)
         gamma = 0.95
 
@@ -91,6 +80,23 @@ class NTMReadHead(NTMHeadBase):
 
         return r, w_r
 
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        """Forward function of several read heads at once (one projection and one addressing pass).
+        :param heads: The read heads, sharing the same memory.
+        :param embeddings: input representation of the controller.
+        :param w_prev: previous step states, per head (unused, the read weights are content based only)
+        :return: The reads and the new states, per head.
+        """
+        o = _fused_linear([head.fc_read for head in heads], embeddings)
+        k, g = _split_cols(o, heads[0].read_lengths)
+
+        # Read from memory
+        w_r = heads[0]._address_memory(k, g, n, None, 1)
+        r = heads[0].memory.read(w_r)
+
+        return list(r.unbind(1)), list(w_r.unbind(1))
+
 
 class NTMWriteHead(NTMHeadBase):
     def __init__(self, memory, controller_size):
@@ -123,9 +129,35 @@ class NTMWriteHead(NTMHeadBase):
         # Address memory
         w_u, w_r, w_w, w_lu = self._address_memory(k, g, n, w_prev, 0)
 
-        # With LRUA we use the weight-vector w_w for writing to memory:
+        # With LRUA we use the weight-vector w_w for writing to memory, after erasing the least-used slots:
+        self.memory.lrua_erase(w_prev[:, 2])
         self.memory.lrua_write(w_w, k)
 
-        w = torch.cat((w_u, w_r, w_lu), dim=1).view(w_u.size()[0], 3, w_u.size()[1])
+        w = torch.stack((w_u, w_r, w_lu), dim=1)
+
+        return w
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        """Forward function of several write heads at once (one projection).
+        The heads then address, erase and write in head order, so every head sees the writes of the heads before it.
+        :param heads: The write heads, sharing the same memory.
+        :param embeddings: input representation of the controller.
+        :param w_prev: previous step states (batch_size x 3 x N), per head
+        :return: The new states, per head.
+        """
+        o = _fused_linear([head.fc_write for head in heads], embeddings)
+        k, g = _split_cols(o, heads[0].write_lengths)
+
+        w = []
+        for h, head in enumerate(heads):
+            # Address memory
+            w_u, w_r, w_w, w_lu = head._address_memory(k[:, h], g[:, h], n, w_prev[h], 0)
+
+            # With LRUA we use the weight-vector w_w for writing to memory, after erasing the least-used slots:
+            head.memory.lrua_erase(w_prev[h][:, 2])
+            head.memory.lrua_write(w_w, k[:, h])
+
+            w += [torch.stack((w_u, w_r, w_lu), dim=1)]
 
-        return w
\ No newline at end of file
+        return w
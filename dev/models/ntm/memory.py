@@ -1,21 +1,25 @@
 """An NTM's memory implementation."""
 import torch
-from torch.autograd import Variable
 import torch.nn.functional as F
 from torch import nn
 import numpy as np
 
 
 def _convolve(w, s):
-    """Circular convolution implementation."""
-    assert s.size(0) == 3
-    t = torch.cat([w[-1:], w, w[:1]])
-    c = F.conv1d(t.view(1, 1, -1), s.view(1, 1, -1)).view(-1)
-    return c
+    """Circular convolution implementation, for a whole batch (and heads) at once.
+    :param w: Weightings (batch_size x [heads x] N).
+    :param s: Shift weightings (batch_size x [heads x] 3), over the shifts -1, 0, +1.
+    """
+    assert s.size(-1) == 3
+    return s[..., 0:1] * torch.roll(w, 1, dims=-1) + s[..., 1:2] * w + s[..., 2:3] * torch.roll(w, -1, dims=-1)
 
 
 class NTMMemory(nn.Module):
     """Memory bank for NTM."""
+
+    # Whether the memory of a sequence can be saved and loaded (see sequence_state), e.g. for gradient checkpointing:
+    checkpointable = True
+
     def __init__(self, N, M):
         """Initialize the NTM Memory matrix.
         The memory's dimensions are (batch_size x N x M).
@@ -37,39 +41,73 @@ class NTMMemory(nn.Module):
         stdev = 1 / (np.sqrt(N + M))
         nn.init.uniform(self.mem_bias, -stdev, stdev)
 
+        # Scratch space for the erase matrix when writing without autograd (reused across steps):
+        self.scratch = None
+
+        # Cached norms of the memory rows (see _row_norms):
+        self.row_norms = None
+
     def reset(self, batch_size):
         """Initialize memory from bias, for start-of-sequence."""
         self.batch_size = batch_size
-        self.memory = Variable(self.mem_bias.clone().repeat(batch_size, 1, 1))
+        # Repeat copies, so the sequence owns its memory:
+        self.memory = self.mem_bias.repeat(batch_size, 1, 1)
+        self.row_norms = None
+
+    def detach(self):
+        """Detaches the memory from the history of the sequence (for truncated backpropagation through time)."""
+        self.memory = self.memory.detach()
+        self.row_norms = None
+
+    def sequence_state(self):
+        """The memory of the sequence (and its cached row norms), e.g. for checkpointing."""
+        return self.memory, self.row_norms
+
+    def load_sequence_state(self, state):
+        """Loads a sequence state (see sequence_state), returning the previous one."""
+        previous = self.sequence_state()
+        self.memory, self.row_norms = state
+        return previous
 
     def size(self):
         return self.N, self.M
 
     def read(self, w):
-        """Read from memory (according to section 3.1)."""
-        return torch.matmul(w.unsqueeze(1), self.memory).squeeze(1)
+        """Read from memory (according to section 3.1).
+        :param w: Read weightings (batch_size x N), or (batch_size x heads x N) for several heads at once.
+        """
+        if w.dim() == 3:
+            return self._matmul(w)
+        return self._matmul(w.unsqueeze(1)).squeeze(1)
 
     # Standard NTM write procedure
     def write(self, w, e, a):
-        """write to memory (according to section 3.2)."""
-        self.prev_mem = self.memory
-        self.memory = Variable(torch.Tensor(self.batch_size, self.N, self.M))
-        erase = torch.matmul(w.unsqueeze(-1), e.unsqueeze(1))
-        add = torch.matmul(w.unsqueeze(-1), a.unsqueeze(1))
-        self.memory = self.prev_mem * (1 - erase) + add
+        """write to memory (according to section 3.2).
+        Erase and add are fused: memory - memory * (w e^T) + w a^T.
+        """
+        if self._in_place():
+            erase = torch.mul(w.unsqueeze(-1), e.unsqueeze(1), out=self._scratch())
+            self.memory.addcmul_(self.memory, erase, value=-1).baddbmm_(w.unsqueeze(-1), a.unsqueeze(1))
+        else:
+            erase = w.unsqueeze(-1) * e.unsqueeze(1)
+            self.memory = torch.baddbmm(torch.addcmul(self.memory, self.memory, erase, value=-1),
+                                        w.unsqueeze(-1), a.unsqueeze(1))
+        self.row_norms = None
 
     # LRUA write procedure
     def lrua_write(self, w, k):
         """ Write to memory using the Least Recently Used Addressing scheme, used in MANN"""
-        self.prev_mem = self.memory
-        self.memory = Variable(torch.Tensor(self.batch_size, self.N, self.M))
-        lrua = torch.matmul(w.unsqueeze(-1), k.unsqueeze(1))
-        self.memory = self.prev_mem + lrua
+        if self._in_place():
+            self.memory.baddbmm_(w.unsqueeze(-1), k.unsqueeze(1))
+        else:
+            self.memory = torch.baddbmm(self.memory, w.unsqueeze(-1), k.unsqueeze(1))
+        self.row_norms = None
 
     # Standard NTM addressing
     def address(self, k, β, g, s, γ, w_prev):
         """NTM Addressing (according to section 3.3).
         Returns a softmax weighting over the rows of the memory matrix.
+        All arguments may have an extra heads dimension after the batch, to address with several heads at once.
         :param k: The key vector.
         :param β: The key strength (focus).
         :param g: Scalar interpolation gate (with previous weighting).
@@ -93,6 +131,8 @@ class NTMMemory(nn.Module):
     def lrua_address(self, k, g, n, gamma, w_prev, access):
         """NTM Addressing (according to section 3.3).
         Returns a softmax weighting over the rows of the memory matrix.
+        All arguments may have an extra heads dimension after the batch, to address with several heads at once.
+        The least-used slots are not erased here, see lrua_erase.
         :param k: The key vector.
         :param β: The key strength (focus).
         :param g: Scalar interpolation gate (with previous weighting).
@@ -107,9 +147,9 @@ class NTMMemory(nn.Module):
             return w_r
 
         # Unpacking previous weights:
-        w_u_prev = w_prev[:, 0]
-        w_r_prev = w_prev[:, 1]
-        w_lu_prev = w_prev[:, 2]
+        w_u_prev = w_prev[..., 0, :]
+        w_r_prev = w_prev[..., 1, :]
+        w_lu_prev = w_prev[..., 2, :]
 
         # Calc. the write weights:
         w_w = self._interpolate(w_lu_prev, w_r_prev, g)
@@ -117,43 +157,71 @@ class NTMMemory(nn.Module):
         # Calc. the usage weights:
         w_u = gamma*w_u_prev + w_r + w_w
 
-        # Creating the Least Recently Used Vector, by Equation (6) from MANN:
-        n_smallest_matrix = np.partition(np.array(w_u.data), n-1)[:, n-1]
-        w_lu = Variable(torch.FloatTensor(((np.array(w_u.data).transpose() <= n_smallest_matrix).astype(int)).transpose()))
+        # Creating the Least Recently Used Vector, by Equation (6) from MANN (the n smallest usages, with ties):
+        n_smallest = torch.kthvalue(w_u.detach(), n, dim=-1, keepdim=True)[0]
+        w_lu = (w_u.detach() <= n_smallest).type_as(w_u)
 
-        # Zero out all least-used slots (from previous step):
-        erase_vector = Variable(torch.ones(w_lu_prev.size()[:]).type(torch.LongTensor)) - w_lu_prev.type(torch.LongTensor)
-        zeroed_memory = self.memory.data.clone()
-        for b in range(len(erase_vector)):
-            for m in range(len(erase_vector[b])):
-                if erase_vector.data[b][m] == 0:
-                    zeroed_memory[b][m] = torch.zeros(self.M)
+        return w_u, w_r, w_w, w_lu
 
-        self.memory = Variable(zeroed_memory)
+    def lrua_erase(self, w_lu_prev):
+        """Zero out all least-used slots (from previous step), before an LRUA write."""
+        erased = w_lu_prev != 0
+        if self._in_place():
+            self.memory.masked_fill_(erased.unsqueeze(-1), 0)
+        else:
+            self.memory = self.memory.masked_fill(erased.unsqueeze(-1), 0)
 
-        return w_u, w_r, w_w, w_lu
+        # The erased rows' norms are simply zero:
+        if self.row_norms is not None:
+            self.row_norms = self.row_norms.masked_fill(erased, 0)
 
     # Utility functions
+    def _in_place(self):
+        # Without autograd (e.g. margin scoring, scenarios), the sequence's memory is updated in place:
+        return not torch.is_grad_enabled() and not self.memory.requires_grad
+
+    def _matmul(self, x, transpose=False):
+        """x (batch_size x rows x N) @ memory, or x (batch_size x rows x M) @ memory^T if transpose."""
+        return torch.matmul(x, self.memory.transpose(1, 2) if transpose else self.memory)
+
+    def _row_norms(self):
+        """Norms of the memory rows (batch_size x N), kept until the memory is written again."""
+        if self.row_norms is None:
+            self.row_norms = torch.norm(self.memory, dim=-1)
+        return self.row_norms
+
+    def _scratch(self):
+        if self.scratch is None or self.scratch.size() != self.memory.size() or \
+                self.scratch.device != self.memory.device:
+            self.scratch = torch.empty_like(self.memory)
+        return self.scratch
+
     def _similarity(self, k, β):
-        k = k.view(self.batch_size, 1, -1)
-        w = F.softmax(β * F.cosine_similarity(self.memory + 1e-16, k + 1e-16, dim=-1), dim=1)
+        w = F.softmax(β * self._cosine_similarity(k), dim=-1)
         return w
 
     def _similarity_mann(self, k):
-        k = k.view(self.batch_size, 1, -1)
-        w = F.softmax(F.cosine_similarity(self.memory + 1e-16, k + 1e-16, dim=-1), dim=1)
+        w = F.softmax(self._cosine_similarity(k), dim=-1)
         return w
 
+    def _cosine_similarity(self, k):
+        """Cosine similarity of the key(s) (batch_size x [heads x] M) with every memory row, in one matmul.
+        Zero rows/keys are handled by clamping the norms, so no offset copy of the memory is needed.
+        The row norms are shared by all heads addressing the same memory (see _row_norms).
+        """
+        keys = k.view(self.batch_size, -1, self.M)
+        dot = self._matmul(keys, transpose=True)
+        norms = torch.norm(keys, dim=-1, keepdim=True) * self._row_norms().unsqueeze(1)
+        similarity = dot / torch.clamp(norms, min=1e-8)
+        return similarity.view(k.size()[:-1] + (self.N,))
+
     def _interpolate(self, w_prev, wc, g):
         return g * wc + (1 - g) * w_prev
 
     def _shift(self, wg, s):
-        result = Variable(torch.zeros(wg.size()))
-        for b in range(self.batch_size):
-            result[b] = _convolve(wg[b], s[b])
-        return result
+        return _convolve(wg, s)
 
     def _sharpen(self, ŵ, γ):
         w = ŵ ** γ
-        w = torch.div(w, torch.sum(w, dim=1).view(-1, 1) + 1e-16)
+        w = torch.div(w, torch.sum(w, dim=-1, keepdim=True) + 1e-16)
         return w
\ No newline at end of file
@@ -15,8 +15,9 @@ class NTM(nn.Module):
         :param memory: :class:`NTMMemory`
         :param heads: list of :class:`NTMReadHead` or :class:`NTMWriteHead`
         Note: This design allows the flexibility of using any number of read and
-              write heads independently, also, the order by which the heads are
-              called in controlled by the user (order in list)
+              write heads independently. The read heads are applied together
+              (before the writes), then the write heads, which write in the
+              order of the list.
         """
         super(NTM, self).__init__()
 
@@ -31,6 +32,10 @@ class NTM(nn.Module):
         self.N, self.M = memory.size()
         _, self.controller_size = controller.size()
 
+        # The heads of each kind are applied as one bank (plain lists, the heads are registered in self.heads):
+        self.read_heads = [head for head in heads if head.is_read_head()]
+        self.write_heads = [head for head in heads if not head.is_read_head()]
+
         # Initialize the initial previous read values to random biases
         self.num_read_heads = 0
         self.init_r = []
@@ -78,21 +83,21 @@ class NTM(nn.Module):
             inp = torch.cat([x] + prev_reads, dim=1)
             controller_outp, controller_state = self.controller(inp, prev_controller_state)
 
-        # Read/Write from the list of heads
-        reads = []
-        heads_states = []
-        head_nr = 0
-        for head, prev_head_state in zip(self.heads, prev_heads_states):
-            if head.is_read_head():
-                r, head_state = head(controller_outp, prev_head_state, self.num_read_heads)
-                reads += [r]
-
-            else:
-                # When getting future Q-values, we need only read, NOT WRITE:
-                if not read_only:
-                    head_state = head(controller_outp, prev_head_state, self.num_read_heads)
-                    head_nr += 1
-            heads_states += [head_state]
+        # Read from all read heads at once:
+        prev_read_states = [s for head, s in zip(self.heads, prev_heads_states) if head.is_read_head()]
+        prev_write_states = [s for head, s in zip(self.heads, prev_heads_states) if not head.is_read_head()]
+        reads, read_states = type(self.read_heads[0]).fused_forward(self.read_heads, controller_outp,
+                                                                    prev_read_states, self.num_read_heads)
+
+        # When getting future Q-values, we need only read, NOT WRITE:
+        write_states = prev_write_states
+        if len(self.write_heads) > 0 and not read_only:
+            write_states = type(self.write_heads[0]).fused_forward(self.write_heads, controller_outp,
+                                                                   prev_write_states, self.num_read_heads)
+
+        # Head states, in the order of the heads list:
+        read_states, write_states = iter(read_states), iter(write_states)
+        heads_states = [next(read_states) if head.is_read_head() else next(write_states) for head in self.heads]
 
         # Generate Output and collect predictions:
         ntm_out = torch.cat([controller_outp] + reads, dim=1)
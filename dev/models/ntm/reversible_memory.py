@@ -0,0 +1,295 @@
+"""An NTM memory that keeps only the per-step write vectors for backward, reconstructing the memory from them."""
+import torch
+from torch.autograd import Function
+
+from .memory import NTMMemory
+
+
+class _ReversibleTape:
+    """
+    The memory of a sequence, updated in place, and the log of its updates (the write weightings, erase and add
+    vectors of every step, and the few rows that cannot be reconstructed from them).
+    Every memory operation passes a (scalar) token on to the next one, so the operations are always differentiated
+    in reverse order: during backward, the updates are undone one by one on a copy of the memory, which then holds
+    the memory as it was at the time of the operation being differentiated, and the gradient rows hold its gradient.
+    """
+
+    def __init__(self, rows, stable_erase):
+        self.rows = rows
+        self.stable_erase = stable_erase
+        self.log = []
+
+        # Backward state:
+        self.gradient = None
+        self.backward_rows = None
+        self.backward_position = 0
+        self.gradient_position = 0
+
+    def position(self):
+        return len(self.log)
+
+    def write(self, w, e, a, record):
+        """NTM write: rows * (1 - w e^T) + w a^T."""
+        w, e, a = w.detach(), e.detach(), a.detach()
+        erase = w.unsqueeze(-1) * e.unsqueeze(1)
+        if record:
+            # Rows with (almost) fully erased entries cannot be recovered by dividing, they are kept as they are:
+            unstable = (w * e.max(dim=-1, keepdim=True)[0] > 1 - self.stable_erase).nonzero(as_tuple=True)
+            self.log.append(('write', w, e, a, unstable, self.rows[unstable]))
+        self.rows.addcmul_(self.rows, erase, value=-1).baddbmm_(w.unsqueeze(-1), a.unsqueeze(1))
+
+    def erase(self, erased, record):
+        """Zeroes the rows where erased (batch_size x N) is True."""
+        if record:
+            self.log.append(('erase', erased, self.rows[erased]))
+        self.rows.masked_fill_(erased.unsqueeze(-1), 0)
+
+    def add(self, w, k, record):
+        """LRUA write: rows + w k^T."""
+        w, k = w.detach(), k.detach()
+        if record:
+            self.log.append(('add', w, k))
+        self.rows.baddbmm_(w.unsqueeze(-1), k.unsqueeze(1))
+
+    def memory_at(self, position):
+        """The memory after the first position updates (during backward, for non-increasing positions)."""
+        self._begin_backward()
+        while self.backward_position > position:
+            self.backward_position -= 1
+            self._undo(self.log[self.backward_position], self.backward_rows)
+        return self.backward_rows
+
+    def gradient_at(self, position):
+        """The gradient of the memory after the first position updates (during backward, as memory_at)."""
+        self._begin_backward()
+        while self.gradient_position > position:
+            self.gradient_position -= 1
+            self._differentiate(self.log[self.gradient_position], self.gradient)
+        return self.gradient
+
+    def _begin_backward(self):
+        if self.gradient is None:
+            self.gradient = torch.zeros_like(self.rows)
+            self.backward_rows = self.rows.clone()
+            self.backward_position = self.gradient_position = len(self.log)
+
+    def end_backward(self):
+        self.gradient = None
+        self.backward_rows = None
+
+    def nbytes(self):
+        """Size of the log, in bytes."""
+        return sum(t.numel() * t.element_size() for entry in self.log for t in entry[1:] if torch.is_tensor(t))
+
+    @staticmethod
+    def _differentiate(entry, gradient):
+        # The gradient of the memory before an update, from the gradient after it:
+        if entry[0] == 'write':
+            w, e = entry[1:3]
+            gradient.addcmul_(gradient, w.unsqueeze(-1) * e.unsqueeze(1), value=-1)
+        elif entry[0] == 'erase':
+            gradient.masked_fill_(entry[1].unsqueeze(-1), 0)
+
+    @staticmethod
+    def _undo(entry, rows):
+        if entry[0] == 'write':
+            _, w, e, a, unstable, unstable_rows = entry
+            rows.baddbmm_(w.unsqueeze(-1), a.unsqueeze(1), alpha=-1).div_(1 - w.unsqueeze(-1) * e.unsqueeze(1))
+            rows[unstable] = unstable_rows
+        elif entry[0] == 'erase':
+            _, erased, erased_rows = entry
+            rows[erased] = erased_rows
+        else:
+            _, w, k = entry
+            rows.baddbmm_(w.unsqueeze(-1), k.unsqueeze(1), alpha=-1)
+
+
+class _TapeMatmul(Function):
+    """x @ memory (x @ memory^T if transpose), the gradient of the memory is added to the tape's in backward."""
+
+    @staticmethod
+    def forward(ctx, token, tape, x, transpose, first):
+        ctx.tape, ctx.transpose, ctx.first = tape, transpose, first
+        ctx.position = tape.position()
+        ctx.save_for_backward(x)
+        return torch.matmul(x, tape.rows.transpose(1, 2) if transpose else tape.rows), token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_output, grad_token):
+        x, = ctx.saved_tensors
+        memory, gradient = ctx.tape.memory_at(ctx.position), ctx.tape.gradient_at(ctx.position)
+        if ctx.transpose:
+            grad_x = torch.matmul(grad_output, memory)
+            gradient.baddbmm_(grad_output.transpose(1, 2), x)
+        else:
+            grad_x = torch.matmul(grad_output, memory.transpose(1, 2))
+            gradient.baddbmm_(x.transpose(1, 2), grad_output)
+        if ctx.first:
+            ctx.tape.end_backward()
+        return grad_token, None, grad_x, None, None
+
+
+class _TapeRowNorms(Function):
+    """Norms of the memory rows (batch_size x N)."""
+
+    @staticmethod
+    def forward(ctx, token, tape, first):
+        ctx.tape, ctx.first = tape, first
+        ctx.position = tape.position()
+        norms = torch.norm(tape.rows, dim=-1)
+        ctx.save_for_backward(norms)
+        return norms, token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_norms, grad_token):
+        norms, = ctx.saved_tensors
+        memory, gradient = ctx.tape.memory_at(ctx.position), ctx.tape.gradient_at(ctx.position)
+        scale = (grad_norms / norms).masked_fill_(norms == 0, 0)
+        gradient.addcmul_(memory, scale.unsqueeze(-1))
+        if ctx.first:
+            ctx.tape.end_backward()
+        return grad_token, None, None
+
+
+class _TapeWrite(Function):
+    """NTM write of the erase vector e and add vector a (batch_size x M) with the weightings w (batch_size x N)."""
+
+    @staticmethod
+    def forward(ctx, token, tape, w, e, a, record, first):
+        ctx.tape, ctx.first = tape, first
+        ctx.position = tape.position()
+        ctx.save_for_backward(w, e, a)
+        tape.write(w, e, a, record)
+        return token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_token):
+        w, e, a = ctx.saved_tensors
+
+        # Of memory * (1 - w e^T) + w a^T, with the memory before the write and the gradient after it:
+        memory, gradient = ctx.tape.memory_at(ctx.position), ctx.tape.gradient_at(ctx.position + 1)
+        grad_memory = gradient * memory
+        grad_a = torch.matmul(w.unsqueeze(1), gradient).squeeze(1)
+        grad_w = torch.matmul(gradient, a.unsqueeze(-1)).squeeze(-1) - \
+            torch.matmul(grad_memory, e.unsqueeze(-1)).squeeze(-1)
+        grad_e = -torch.matmul(w.unsqueeze(1), grad_memory).squeeze(1)
+
+        if ctx.first:
+            ctx.tape.end_backward()
+        return grad_token, None, grad_w, grad_e, grad_a, None, None
+
+
+class _TapeErase(Function):
+    """Zeroes the memory rows where erased (batch_size x N) is True."""
+
+    @staticmethod
+    def forward(ctx, token, tape, erased, record, first):
+        ctx.tape, ctx.first = tape, first
+        ctx.position = tape.position()
+        tape.erase(erased, record)
+        return token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_token):
+        # Nothing to differentiate, the gradient passes through the erase in gradient_at:
+        if ctx.first:
+            ctx.tape.end_backward()
+        return grad_token, None, None, None, None
+
+
+class _TapeAdd(Function):
+    """LRUA write of the key k (batch_size x M) with the weightings w (batch_size x N)."""
+
+    @staticmethod
+    def forward(ctx, token, tape, w, k, record, first):
+        ctx.tape, ctx.first = tape, first
+        ctx.position = tape.position()
+        ctx.save_for_backward(w, k)
+        tape.add(w, k, record)
+        return token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_token):
+        w, k = ctx.saved_tensors
+        gradient = ctx.tape.gradient_at(ctx.position + 1)
+        grad_w = torch.matmul(gradient, k.unsqueeze(-1)).squeeze(-1)
+        grad_k = torch.matmul(w.unsqueeze(1), gradient).squeeze(1)
+        if ctx.first:
+            ctx.tape.end_backward()
+        return grad_token, None, grad_w, grad_k, None, None
+
+
+class ReversibleNTMMemory(NTMMemory):
+    """
+    NTM memory with a memory-efficient backward. The memory is updated in place, and autograd keeps no copy of it:
+    only the write weightings, erase and add vectors of every step are kept, and the earlier memory states are
+    reconstructed from them during backward, by undoing the writes. Storage per step is then O(N + M) (per batch
+    and head) instead of O(N x M). The few rows a write (almost) completely erases are kept as they are, as
+    dividing by their erase factor would not be stable.
+    """
+
+    # Rows with an erase factor (1 - w e) below this are kept instead of being reconstructed:
+    stable_erase = 0.9
+
+    # The memory is updated in place, its earlier states are only known to backward:
+    checkpointable = False
+
+    def reset(self, batch_size):
+        """Initialize memory from bias, for start-of-sequence."""
+        self.batch_size = batch_size
+        self.tape = _ReversibleTape(self.mem_bias.repeat(batch_size, 1, 1), self.stable_erase)
+        self.memory = self.tape.rows
+        self.row_norms = None
+
+        # The token threaded through the memory operations (see _ReversibleTape):
+        self.token = torch.zeros(1, device=self.mem_bias.device, requires_grad=True)
+        self.first_token = self.token
+
+    def detach(self):
+        """Detaches the memory from the history of the sequence (for truncated backpropagation through time).
+        The memory continues on a copy, as the history may still be differentiated from the memory it ends with.
+        """
+        self.tape = _ReversibleTape(self.tape.rows.clone(), self.stable_erase)
+        self.memory = self.tape.rows
+        self.row_norms = None
+        self.token = torch.zeros(1, device=self.mem_bias.device, requires_grad=True)
+        self.first_token = self.token
+
+    def write(self, w, e, a):
+        """write to memory (according to section 3.2)."""
+        self._apply(_TapeWrite, w, e, a, self._record())
+        self.row_norms = None
+
+    def lrua_write(self, w, k):
+        """ Write to memory using the Least Recently Used Addressing scheme, used in MANN"""
+        self._apply(_TapeAdd, w, k, self._record())
+        self.row_norms = None
+
+    def lrua_erase(self, w_lu_prev):
+        """Zero out all least-used slots (from previous step), before an LRUA write."""
+        erased = w_lu_prev != 0
+        self._apply(_TapeErase, erased, self._record())
+
+        # The erased rows' norms are simply zero:
+        if self.row_norms is not None:
+            self.row_norms = self.row_norms.masked_fill(erased, 0)
+
+    def _matmul(self, x, transpose=False):
+        return self._apply(_TapeMatmul, x, transpose)[0]
+
+    def _row_norms(self):
+        if self.row_norms is None:
+            self.row_norms = self._apply(_TapeRowNorms)[0]
+        return self.row_norms
+
+    def _record(self):
+        # Updates before the first differentiated operation are never undone:
+        return torch.is_grad_enabled() or self.token is not self.first_token
+
+    def _apply(self, function, *args):
+        """Applies a tape operation, passing the token on (only operations recorded by autograd take it)."""
+        outputs = function.apply(self.token, self.tape, *args, self.token is self.first_token)
+        token = outputs[-1] if isinstance(outputs, tuple) else outputs
+        if token.requires_grad:
+            self.token = token
+        return outputs
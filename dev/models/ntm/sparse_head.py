@@ -0,0 +1,126 @@
+"""Read/Write heads for the sparse access memory (see :class:`SparseNTMMemory`)."""
+import torch
+import torch.nn.functional as F
+
+from .head import NTMReadHead, NTMWriteHead, _split_cols, _fused_linear
+from .lrua_head import NTMReadHead as LRUAReadHead, NTMWriteHead as LRUAWriteHead
+
+
+# The heads have the same parameters as the dense heads, their state holds the indexes and weightings of the k
+# rows they addressed. The NTM heads use content addressing only (the location based gate, shift and sharpening
+# of the dense heads have no meaning over k rows, out of N).
+
+class SparseReadHead(NTMReadHead):
+
+    def create_new_state(self, batch_size):
+        k = self.memory.k
+        return torch.zeros(batch_size, k, dtype=torch.long), torch.zeros(batch_size, k)
+
+    def forward(self, embeddings, w_prev, n):
+        reads, states = self.fused_forward([self], embeddings, [w_prev], n)
+        return reads[0], states[0]
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        o = _fused_linear([head.fc_read for head in heads], embeddings)
+        k, β, g, s, γ = _split_cols(o, heads[0].read_lengths)
+
+        # Read from memory
+        indexes, rows, w = heads[0].memory.sparse_address(k, F.softplus(β))
+        r = heads[0].memory.sparse_read(rows, w)
+
+        return list(r.unbind(1)), list(zip(indexes.unbind(1), w.unbind(1)))
+
+
+class SparseWriteHead(NTMWriteHead):
+
+    def create_new_state(self, batch_size):
+        k = self.memory.k
+        return torch.zeros(batch_size, k, dtype=torch.long), torch.zeros(batch_size, k)
+
+    def forward(self, embeddings, w_prev, n):
+        return self.fused_forward([self], embeddings, [w_prev], n)[0]
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        o = _fused_linear([head.fc_write for head in heads], embeddings)
+        k, β, g, s, γ, e, a = _split_cols(o, heads[0].write_lengths)
+
+        # e should be in [0, 1]
+        e = F.sigmoid(e)
+
+        # The heads address and write in head order, every head sees the writes of the heads before it:
+        states = []
+        for h in range(len(heads)):
+            indexes, rows, w = heads[0].memory.sparse_address(k[:, h:h + 1], F.softplus(β[:, h:h + 1]))
+            heads[0].memory.sparse_write(indexes[:, 0], w[:, 0], e[:, h], a[:, h])
+            states += [(indexes[:, 0], w[:, 0])]
+
+        return states
+
+
+class SparseLRUAReadHead(LRUAReadHead):
+
+    def create_new_state(self, batch_size):
+        k = self.memory.k
+        return torch.zeros(batch_size, k, dtype=torch.long), torch.zeros(batch_size, k)
+
+    def forward(self, embeddings, w_prev, n):
+        reads, states = self.fused_forward([self], embeddings, [w_prev], n)
+        return reads[0], states[0]
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        o = _fused_linear([head.fc_read for head in heads], embeddings)
+        k, g = _split_cols(o, heads[0].read_lengths)
+
+        # Read from memory
+        indexes, rows, w_r = heads[0].memory.sparse_address(k)
+        r = heads[0].memory.sparse_read(rows, w_r)
+
+        return list(r.unbind(1)), list(zip(indexes.unbind(1), w_r.unbind(1)))
+
+
+class SparseLRUAWriteHead(LRUAWriteHead):
+
+    def create_new_state(self, batch_size):
+        # Usage (over all rows, without autograd), the read rows and weights, and the least-used rows and weights:
+        k = self.memory.k
+        return (torch.zeros(batch_size, self.N), torch.zeros(batch_size, k, dtype=torch.long),
+                torch.zeros(batch_size, k), torch.zeros(batch_size, 0, dtype=torch.long), torch.zeros(batch_size, 0))
+
+    def forward(self, embeddings, w_prev, n):
+        return self.fused_forward([self], embeddings, [w_prev], n)[0]
+
+    @staticmethod
+    def fused_forward(heads, embeddings, w_prev, n):
+        o = _fused_linear([head.fc_write for head in heads], embeddings)
+        k, g = _split_cols(o, heads[0].write_lengths)
+        g = F.sigmoid(g)
+        gamma = 0.95
+        memory = heads[0].memory
+
+        # The heads address, erase and write in head order, every head sees the writes of the heads before it:
+        states = []
+        for h, (w_u_prev, r_prev, w_r_prev, lu_prev, w_lu_prev) in enumerate(w_prev):
+            # Content addressing:
+            indexes, rows, w_r = memory.sparse_address(k[:, h:h + 1])
+            indexes, w_r = indexes[:, 0], w_r[:, 0]
+
+            # The write weights, over the previously read and least-used rows:
+            w_indexes = torch.cat((r_prev, lu_prev), dim=-1)
+            w_w = torch.cat((g[:, h] * w_r_prev, (1 - g[:, h]) * w_lu_prev), dim=-1)
+
+            # Usage weights and the least used rows, by Equation (6) from MANN:
+            with torch.no_grad():
+                w_u = (gamma * w_u_prev).scatter_add_(-1, indexes, w_r).scatter_add_(-1, w_indexes, w_w)
+                lu = w_u.topk(n, dim=-1, largest=False)[1]
+                w_lu = w_u.new_ones(lu.size())
+
+            # Erase the least-used rows (from previous step), then write:
+            memory.sparse_lrua_erase(lu_prev, w_lu_prev)
+            memory.sparse_lrua_write(w_indexes, w_w, k[:, h])
+
+            states += [(w_u, indexes, w_r, lu, w_lu)]
+
+        return states
@@ -0,0 +1,168 @@
+"""A sparse access memory for the NTM, where every head reads and writes only k rows."""
+import torch
+import torch.nn.functional as F
+from torch.autograd import Function
+
+from .memory import NTMMemory
+
+
+class _SparseTape:
+    """
+    The rows of a sparse memory, updated in place, and the gradient of the memory during a backward pass.
+    Every memory operation passes a (scalar) token on to the next one, so the operations are always
+    differentiated in reverse order: the gradient rows then hold the gradient of the memory as it was at the
+    time of the operation being differentiated.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.gradient = None
+
+    def gradient_rows(self):
+        if self.gradient is None:
+            self.gradient = torch.zeros_like(self.rows)
+        return self.gradient
+
+
+class _SparseRead(Function):
+    """Gathers memory rows, adding their gradient to the memory gradient in backward."""
+
+    @staticmethod
+    def forward(ctx, token, tape, indexes, first):
+        ctx.tape = tape
+        ctx.first = first
+        ctx.save_for_backward(indexes)
+        return tape.rows.index_select(0, indexes), token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_rows, grad_token):
+        indexes, = ctx.saved_tensors
+        ctx.tape.gradient_rows().index_add_(0, indexes, grad_rows)
+        if ctx.first:
+            ctx.tape.gradient = None
+        return grad_token, None, None, None
+
+
+class _SparseAdd(Function):
+    """Adds to memory rows (indexes may repeat), the gradient of the added values is that of the rows."""
+
+    @staticmethod
+    def forward(ctx, token, tape, indexes, delta, first):
+        ctx.tape = tape
+        ctx.first = first
+        ctx.save_for_backward(indexes)
+        tape.rows.index_add_(0, indexes, delta)
+        return token.clone()
+
+    @staticmethod
+    def backward(ctx, grad_token):
+        indexes, = ctx.saved_tensors
+        grad_delta = ctx.tape.gradient_rows().index_select(0, indexes)
+        if ctx.first:
+            ctx.tape.gradient = None
+        return grad_token, None, None, grad_delta, None
+
+
+class SparseNTMMemory(NTMMemory):
+    """
+    Sparse access memory (as in "Scaling Memory-Augmented Neural Networks with Sparse Reads and Writes").
+    Every head addresses only the k rows most similar to its key (found by an exact search over all rows,
+    without autograd), and reads/writes only those rows. The memory is updated in place, and autograd only
+    keeps the selected rows of every step, so time and storage per head and step no longer grow with N
+    (except for the search itself).
+    """
+
+    # The memory is updated in place, its earlier states are only known to backward:
+    checkpointable = False
+
+    def __init__(self, N, M, k):
+        """
+        :param N: Number of rows in the memory.
+        :param M: Number of columns/features in the memory.
+        :param k: Number of rows every head accesses.
+        """
+        super(SparseNTMMemory, self).__init__(N, M)
+        self.k = min(k, N)
+
+    def reset(self, batch_size):
+        """Initialize memory from bias, for start-of-sequence."""
+        self.batch_size = batch_size
+        self.tape = _SparseTape(self.mem_bias.repeat(batch_size, 1, 1).view(-1, self.M))
+        self.memory = self.tape.rows.view(batch_size, self.N, self.M)
+        self.row_norms = torch.norm(self.memory, dim=-1)
+        self.offsets = torch.arange(batch_size, device=self.mem_bias.device).unsqueeze(1) * self.N
+
+        # The token threaded through the memory operations (see _SparseTape):
+        self.token = torch.zeros(1, device=self.mem_bias.device, requires_grad=True)
+        self.first_token = self.token
+
+    def detach(self):
+        """Detaches the memory from the history of the sequence (for truncated backpropagation through time).
+        The memory continues on a copy, as the history may still be differentiated from the memory it ends with.
+        """
+        self.tape = _SparseTape(self.tape.rows.clone())
+        self.memory = self.tape.rows.view(self.batch_size, self.N, self.M)
+        self.token = torch.zeros(1, device=self.mem_bias.device, requires_grad=True)
+        self.first_token = self.token
+
+    def gather(self, indexes):
+        """
+        :param indexes: LongTensor (batch_size x R) of row indexes.
+        :return: The rows (batch_size x R x M).
+        """
+        rows, self.token = _SparseRead.apply(self.token, self.tape, (indexes + self.offsets).view(-1),
+                                             self.token is self.first_token)
+        return rows.view(indexes.size() + (self.M,))
+
+    def add(self, indexes, delta):
+        """
+        :param indexes: LongTensor (batch_size x R) of row indexes.
+        :param delta: The values (batch_size x R x M) added to the rows.
+        """
+        indexes = (indexes + self.offsets).view(-1)
+        self.token = _SparseAdd.apply(self.token, self.tape, indexes, delta.contiguous().view(-1, self.M),
+                                      self.token is self.first_token)
+
+        # Only the touched rows' norms change:
+        with torch.no_grad():
+            self.row_norms.view(-1)[indexes] = torch.norm(self.tape.rows[indexes], dim=-1)
+
+    def sparse_address(self, k, β=None):
+        """Content addressing over the top-k rows of every head.
+        :param k: The keys (batch_size x heads x M).
+        :param β: The key strengths (batch_size x heads x 1), if any.
+        :return: The row indexes (batch_size x heads x k), the rows (batch_size x heads x k x M) and the softmax
+                 weighting over them (batch_size x heads x k).
+        """
+        heads = k.size(1)
+
+        # Exact search of the most similar rows (an approximate index could be used here instead):
+        with torch.no_grad():
+            dot = torch.matmul(k, self.memory.transpose(1, 2))
+            indexes = dot.div_(torch.clamp(self.row_norms.unsqueeze(1), min=1e-8)).topk(self.k, dim=-1)[1]
+
+        rows = self.gather(indexes.view(self.batch_size, -1)).view(self.batch_size, heads, self.k, self.M)
+        dot = torch.matmul(rows, k.unsqueeze(-1)).squeeze(-1)
+        similarity = dot / torch.clamp(torch.norm(k, dim=-1, keepdim=True) * torch.norm(rows, dim=-1), min=1e-8)
+        if β is not None:
+            similarity = β * similarity
+
+        return indexes, rows, F.softmax(similarity, dim=-1)
+
+    def sparse_read(self, rows, w):
+        """Read the addressed rows (batch_size x heads x k x M) with their weightings (batch_size x heads x k)."""
+        return torch.matmul(w.unsqueeze(-2), rows).squeeze(-2)
+
+    def sparse_write(self, indexes, w, e, a):
+        """NTM write (erase, then add) to the rows (batch_size x k) with the weightings w (batch_size x k)."""
+        rows = self.gather(indexes)
+        self.add(indexes, w.unsqueeze(-1) * (a.unsqueeze(1) - rows * e.unsqueeze(1)))
+
+    def sparse_lrua_erase(self, indexes, w_lu):
+        """Zero out the least-used rows (batch_size x n) where w_lu (batch_size x n) is 1."""
+        rows = self.gather(indexes)
+        self.add(indexes, -rows * w_lu.unsqueeze(-1))
+
+    def sparse_lrua_write(self, indexes, w, k):
+        """LRUA write of the key k to the rows (batch_size x R) with the weightings w (batch_size x R)."""
+        self.add(indexes, w.unsqueeze(-1) * k.unsqueeze(1))
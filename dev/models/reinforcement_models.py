@@ -1,6 +1,7 @@
 from torch import nn
 from .lstm.model import ReinforcedLSTM
 from .ntm.aio import EncapsulatedNTM as NTM
+from .checkpoint import SegmentCheckpoint
 
 
 # Baseline LSTM:
@@ -10,12 +11,16 @@ class ReinforcedRNN(nn.Module):
     hidden_nodes = 200
 
     def __init__(self, batch_size, cuda, classes, input_size, embedding_weight_matrix=None,
-                 embedding=False, dict_size=5000):
+                 embedding=False, dict_size=5000, checkpoint_segment=0):
+        """
+        :param checkpoint_segment: If > 0, the rollouts are checkpointed in segments of this many timesteps.
+        """
 
         super(ReinforcedRNN, self).__init__()
         self.q_network = ReinforcedLSTM(input_size, self.hidden_nodes, self.hidden_layers, classes, batch_size,
                                         cuda, embedding_weight_matrix=embedding_weight_matrix, EMBEDDING=embedding,
                                         DICT_SIZE=dict_size + 2)
+        self.checkpoint = SegmentCheckpoint(checkpoint_segment)
 
         self.batch_size = batch_size
         self.gpu = cuda
@@ -29,8 +34,12 @@ class ReinforcedRNN(nn.Module):
         else:
             return self.q_network.reset_hidden(batch_size)
 
+    def detach_hidden(self, hidden):
+        return tuple(h.detach() for h in hidden)
+
     def forward(self, inp, hidden, class_vector=None, read_only=False, seq=1, display_embeddings=False):
-        return self.q_network(inp, hidden, class_vector=class_vector, seq=seq, display_embeddings=display_embeddings)
+        return self.checkpoint(self.q_network, inp, hidden, not read_only, class_vector=class_vector, seq=seq,
+                               display_embeddings=display_embeddings)
 
 
 # NTM:
@@ -49,15 +58,28 @@ class ReinforcedNTM(nn.Module):
     controller_layers = 1
 
     def __init__(self, batch_size, cuda, classes, input_size, embedding_weight_matrix=None,
-                 embedding=False, dict_size=5000):
+                 embedding=False, dict_size=5000, memory_slots=None, sparse_k=0,
+                 reversible_memory=False, checkpoint_segment=0):
+        """
+        :param memory_slots: Number of memory slots (N by default).
+        :param sparse_k: If > 0, a sparse memory is used, where every head accesses only its top-k slots.
+        :param reversible_memory: The memory is reconstructed during backward instead of kept (dense memory only).
+        :param checkpoint_segment: If > 0, the rollouts are checkpointed in segments of this many timesteps
+                                   (dense memory only).
+        """
 
         super(ReinforcedNTM, self).__init__()
 
         self.q_network = NTM(input_size + classes, classes + 1, classes, False,
                              self.controller_size, self.controller_layers, self.num_read_heads,
-                             self.num_write_heads, self.N, self.M,
+                             self.num_write_heads, memory_slots or self.N, self.M,
                              embedding_weight_matrix=embedding_weight_matrix, embedding=embedding,
-                             dict_size=dict_size + 2, embedding_size=input_size)
+                             dict_size=dict_size + 2, embedding_size=input_size, sparse_k=sparse_k,
+                             reversible=reversible_memory)
+        if checkpoint_segment > 0 and not self.q_network.memory.checkpointable:
+            raise ValueError("Gradient checkpointing needs the plain dense memory (no sparse_k or reversible_memory)")
+        self.checkpoint = SegmentCheckpoint(checkpoint_segment, self.q_network.memory.sequence_state,
+                                            self.q_network.memory.load_sequence_state)
 
         self.batch_size = batch_size
         self.gpu = cuda
@@ -71,8 +93,12 @@ class ReinforcedNTM(nn.Module):
         else:
             return self.q_network.init_sequence(batch_size)
 
+    def detach_hidden(self, hidden):
+        return self.q_network.detach_sequence(hidden)
+
     def forward(self, inp, hidden, class_vector=None, read_only=False, seq=1):
-        return self.q_network(inp, hidden, class_vector=class_vector, read_only=read_only)
+        return self.checkpoint(self.q_network, inp, hidden, not read_only, class_vector=class_vector,
+                               read_only=read_only)
 
 
 # LRUA:
@@ -91,15 +117,28 @@ class ReinforcedLRUA(nn.Module):
     controller_layers = 1
 
     def __init__(self, batch_size, cuda, classes, input_size, embedding_weight_matrix=None,
-                 embedding=False, dict_size=5000):
+                 embedding=False, dict_size=5000, memory_slots=None, sparse_k=0,
+                 reversible_memory=False, checkpoint_segment=0):
+        """
+        :param memory_slots: Number of memory slots (N by default).
+        :param sparse_k: If > 0, a sparse memory is used, where every head accesses only its top-k slots.
+        :param reversible_memory: The memory is reconstructed during backward instead of kept (dense memory only).
+        :param checkpoint_segment: If > 0, the rollouts are checkpointed in segments of this many timesteps
+                                   (dense memory only).
+        """
 
         super(ReinforcedLRUA, self).__init__()
 
         self.q_network = NTM(input_size + classes, classes + 1, classes, True,
                              self.controller_size, self.controller_layers, self.num_read_heads,
-                             self.num_write_heads, self.N, self.M,
+                             self.num_write_heads, memory_slots or self.N, self.M,
                              embedding_weight_matrix=embedding_weight_matrix, embedding=embedding,
-                             dict_size=dict_size + 2, embedding_size=input_size)
+                             dict_size=dict_size + 2, embedding_size=input_size, sparse_k=sparse_k,
+                             reversible=reversible_memory)
+        if checkpoint_segment > 0 and not self.q_network.memory.checkpointable:
+            raise ValueError("Gradient checkpointing needs the plain dense memory (no sparse_k or reversible_memory)")
+        self.checkpoint = SegmentCheckpoint(checkpoint_segment, self.q_network.memory.sequence_state,
+                                            self.q_network.memory.load_sequence_state)
 
         self.batch_size = batch_size
         self.gpu = cuda
@@ -113,5 +152,9 @@ class ReinforcedLRUA(nn.Module):
         else:
             return self.q_network.init_sequence(batch_size)
 
+    def detach_hidden(self, hidden):
+        return self.q_network.detach_sequence(hidden)
+
     def forward(self, inp, hidden, class_vector=None, read_only=False, seq=1):
-        return self.q_network(inp, hidden, class_vector=class_vector, read_only=read_only)
+        return self.checkpoint(self.q_network, inp, hidden, not read_only, class_vector=class_vector,
+                               read_only=read_only)
@@ -0,0 +1,129 @@
+import queue
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as multiprocessing
+
+import train
+from reinforcement_utils.reinforcement import ReinforcementLearning
+
+
+class Rollout:
+    """
+    An episode batch run by an actor: the episodes (images/sentences and labels), the Epsilon Greedy actions it
+    took and the rewards it received, and the epoch of the Q-network snapshot it ran with.
+    """
+
+    def __init__(self, sample_batch, label_batch, actions, rewards, epoch, actor):
+        self.sample_batch = sample_batch
+        self.label_batch = label_batch
+        self.actions = actions
+        self.rewards = rewards
+        self.epoch = epoch
+        self.actor = actor
+
+
+class RecordedActions:
+    """
+    Stands in for the ReinforcementLearning module while the learner replays a rollout: the actions are the ones
+    the actor took, and the rewards the ones it received. As the states follow from the actions, the learner sees
+    the same states as the actor.
+    """
+
+    def __init__(self, reinforcement_learner, rollout):
+        self.reinforcement_learner = reinforcement_learner
+        self.actions = rollout.actions
+        self.rewards = rollout.rewards
+        self.timestep = 0
+
+    def select_actions(self, model_actions, episode_labels):
+        return self.actions[self.timestep].to(model_actions.device)
+
+    def collect_reward_batch(self, actions, labels):
+        rewards = self.rewards[self.timestep].to(actions.device)
+        self.timestep += 1
+        return rewards
+
+    def __getattr__(self, name):
+        return getattr(self.reinforcement_learner, name)
+
+
+def run_actor(actor, loader, shared_network, rollouts, args, text_dataset):
+    """
+    Actor process: runs the episode batches of the loader with the latest snapshot of the Q-network, pushing the
+    rollouts to the learner.
+    """
+    torch.set_num_threads(1)
+
+    # Own streams for sampling and exploring:
+    seed = args.seed + actor + 1
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    reinforcement_learner = ReinforcementLearning(args.class_vector_size, seed=seed)
+
+    while True:
+        for sample_batch, label_batch in loader:
+            q_network = shared_network.local_network()
+            actions, rewards = train.act(q_network, sample_batch, label_batch, args, reinforcement_learner,
+                                         text_dataset)
+            rollouts.put(Rollout(sample_batch, label_batch, actions, rewards, shared_network.local_epoch, actor))
+
+
+class ActorPool:
+    """
+    Actor processes running the episodes of the training loader, and the (bounded) queue of their rollouts.
+    The learner only replays rollouts, leaving sampling the episodes and acting in them to the actors.
+    """
+
+    def __init__(self, actors, loader, shared_network, args, text_dataset, queue_size=4):
+        """
+        :param actors: Number of actor processes.
+        :param loader: The DataLoader to draw episode batches from.
+        :param shared_network: SharedQNetwork snapshot the actors act with.
+        :param queue_size: Number of rollouts the actors run ahead of the learner.
+        """
+        # Forked, so the actors share the loader and the snapshot as they are:
+        context = multiprocessing.get_context('fork')
+        self.rollouts = context.Queue(maxsize=queue_size)
+        self.processes = [context.Process(target=run_actor,
+                                          args=(actor, loader, shared_network, self.rollouts, args, text_dataset))
+                          for actor in range(actors)]
+        for process in self.processes:
+            process.start()
+
+        # Timing, for reporting how much of the time the learner spends waiting on the actors:
+        self.wait_time = 0.0
+        self.start_time = None
+
+    def next_rollout(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        wait_start = time.time()
+        while True:
+            try:
+                rollout = self.rollouts.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    raise RuntimeError("All actor processes have exited")
+        self.wait_time += time.time() - wait_start
+
+        return rollout
+
+    def depth(self):
+        """Number of rollouts waiting for the learner."""
+        return self.rollouts.qsize()
+
+    def wait_fraction(self):
+        """Fraction of the time since the first rollout was requested, spent waiting on the actors."""
+        if self.start_time is None:
+            return 0.0
+        return self.wait_time / max(time.time() - self.start_time, 1e-8)
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,99 @@
+import multiprocessing
+
+import torch
+import numpy as np
+
+
+class ClassDifficultyIndex:
+    """
+    Persistent estimate of the margin of every class in a dataset, kept as a running average.
+    The margin pool is drawn from it: the stalest classes (to be rescored), plus hard (low margin) classes.
+    The tensors live in shared memory, so DataLoader workers drawing the pool see the sampler's updates, and a
+    shared lock keeps concurrent workers from interleaving their updates.
+    """
+
+    def __init__(self, nof_classes, refresh=0.25, momentum=0.5):
+        """
+        :param nof_classes: Number of classes in the dataset.
+        :param refresh: Fraction of the pool rescored every epoch.
+        :param momentum: Weight of the previous estimate in the running average.
+        """
+        self.nof_classes = nof_classes
+        self.refresh = refresh
+        self.momentum = momentum
+
+        self.margins = torch.zeros(nof_classes).share_memory_()
+        # Epoch the class was last scored in (-1: never):
+        self.scored_epoch = torch.full((nof_classes,), -1, dtype=torch.long).share_memory_()
+        self.epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+        self.lock = multiprocessing.RLock()
+
+    def refresh_size(self, pool_size):
+        return min(pool_size, max(1, int(round(self.refresh * pool_size))))
+
+    def estimates(self):
+        # Classes never scored are assumed average:
+        margins = self.margins.numpy().copy()
+        scored = self.scored_epoch.numpy() >= 0
+        margins[~scored] = margins[scored].mean() if scored.any() else 0.0
+        return margins
+
+    def draw_pool(self, pool_size, margin_size=2):
+        """
+        :param pool_size: Number of (distinct) classes in the pool.
+        :param margin_size: The hard classes are drawn among the margin_size * (number of hard classes) lowest.
+        :return: Array of class indexes, where the first refresh_size(pool_size) are to be rescored.
+        """
+        with self.lock:
+            return self._draw_pool(pool_size, margin_size)
+
+    def _draw_pool(self, pool_size, margin_size):
+        refresh_size = self.refresh_size(pool_size)
+        hard_size = pool_size - refresh_size
+
+        # The stalest classes, never scored first (random among equally old):
+        refresh = np.lexsort((np.random.rand(self.nof_classes), self.scored_epoch.numpy()))[0:refresh_size]
+
+        # Hard classes among the lowest estimates:
+        estimates = self.estimates()
+        estimates[refresh] = np.inf
+        candidates = np.argsort(estimates, kind='stable')[0:min(self.nof_classes - refresh_size,
+                                                                 margin_size * hard_size)]
+        hard = np.random.choice(candidates, hard_size, replace=False)
+
+        return np.concatenate((refresh, hard))
+
+    def update(self, classes, margins):
+        """
+        :param classes: LongTensor of rescored class indexes.
+        :param margins: FloatTensor (same shape) of their margins.
+        """
+        classes = classes.contiguous().view(-1).long()
+        margins = margins.contiguous().view(-1).float()
+
+        # Mean margin of every rescored class:
+        sums = torch.zeros(self.nof_classes).index_add_(0, classes, margins)
+        counts = torch.zeros(self.nof_classes).index_add_(0, classes, torch.ones_like(margins))
+        scored = counts > 0
+        new_margins = sums[scored] / counts[scored]
+
+        with self.lock:
+            old_margins = self.margins[scored]
+            seen = self.scored_epoch[scored] >= 0
+            self.margins[scored] = torch.where(seen, self.momentum * old_margins + (1 - self.momentum) * new_margins,
+                                               new_margins)
+            self.scored_epoch[scored] = self.epoch.item()
+
+    def step(self):
+        with self.lock:
+            self.epoch += 1
+
+    def state_dict(self):
+        return {'margins': self.margins, 'scored_epoch': self.scored_epoch, 'epoch': self.epoch}
+
+    def load_state_dict(self, state):
+        # In place, so the workers keep seeing the shared tensors:
+        with self.lock:
+            self.margins.copy_(state['margins'])
+            self.scored_epoch.copy_(state['scored_epoch'])
+            self.epoch.copy_(state['epoch'])
@@ -1,15 +1,12 @@
-from PIL import Image
-import random
 import torch
 from torch.autograd import Variable
+from torch.utils.data.dataloader import default_collate
 import numpy as np
-from utils import transforms
-import copy
 
 
 class ClassMarginSampler:
 
-    def __init__(self, args, transform, sentence_length=12):
+    def __init__(self, args, sentence_length=12):
         # Class Margin Setup
         self.margin_size = args.margin_size
         self.margin_time = args.margin_time
@@ -17,13 +14,14 @@ class ClassMarginSampler:
         # Training Setup
         self.nof_classes = args.class_vector_size
         self.episode_size = args.episode_size
-
-        # Image Transforms
-        self.transform = transform
+        self.cuda = args.cuda
 
         # Text Embedding Setup
         self.sentence_length = sentence_length
 
+        # Persistent per-class margin index (see ClassDifficultyIndex), shared with the pool dataset:
+        self.class_index = None
+
         # Statistics
         self.all_margins = []
         self.low_margins = []
@@ -31,266 +29,205 @@ class ClassMarginSampler:
 
     def sample_images(self, image_batch, label_batch, q_network, batch_size, statistics):
 
-        # Size should be: (episode_size, batch_size, PIXEL_X, PIXEL_Y)
-        state = []
-        for b in range(batch_size):
-            state.append([0 for j in range(self.nof_classes)])
-
-        # Initial parameters:
-        hidden = q_network.reset_hidden(batch_size)
-        rand_label = random.randint(0, self.nof_classes)
-        current_margin_time = 0
-        next_class = False
-        current_class = 0
-        margins = torch.zeros(self.margin_size * self.nof_classes, batch_size)
-        choices = np.zeros(self.nof_classes + 1)
+        # Size should be: (pool_size, batch_size, VARIANTS, PIXEL_X, PIXEL_Y), grouped by class:
+        image_batch = torch.stack(list(image_batch))
+        nof_pool_classes = self.margin_size * self.nof_classes
+        class_size = int(image_batch.size(0) / nof_pool_classes)
 
-        rotations = [np.random.choice(4, batch_size, replace=True) for i in range(int(self.margin_size))]
-
-        # We want to iterate over all images m_c --> [0, 119]:
-        for m_c in range(len(image_batch)):
-
-            image_class_batch = image_batch[m_c]
-
-            # So we don't have to transform ALL images (AKA also the ones were not gonna use):
-            if next_class and current_class == label_batch[m_c][0]:
-                continue
-            else:
-                next_class = False
-                current_class = label_batch[m_c][0]
-            
-            # Transforming images
-            margin_image_batch = self.transform_images(image_class_batch, batch_size, rotations, current_class)
-            
-            # Get class prediction value:
-            # Tensoring the state
-            state = torch.FloatTensor(state)
-            
-            # Need to add image to the state vector:
-            state = torch.cat((state, margin_image_batch.view(batch_size, -1)), 1).view(batch_size, -1)
-            with torch.no_grad():
-                margin, hidden = q_network(Variable(state), hidden)
-
-            # Create new state:
-            state = []
-            for b in range(batch_size):
-                state.append([1 if j == rand_label else 0 for j in range(self.nof_classes)])
-            
-            # First time new class:
-            if current_margin_time < self.margin_time:
-                for m_ind in margin.data.max(1)[1]:
-                    choices[m_ind] += 1
-                margins[current_class] = torch.abs(margin.data.max(1)[0]) + margins[current_class]
-                current_margin_time += 1
-            
-            # n >= margin-time:
-            else:
-                # Initialize new zero-state
-                state = []
-                for b in range(batch_size):
-                    state.append([0 for j in range(self.nof_classes)])
-                # Reinitialize hidden state
-                hidden = q_network.reset_hidden(batch_size)
-                rand_label = random.randint(0, self.nof_classes)
-                current_margin_time = 0
-                next_class = True
+        # Class specific rotations:
+        rotations = torch.randint(0, image_batch.size(2), (nof_pool_classes, batch_size))
+        batch_indexes = torch.arange(batch_size).unsqueeze(0)
+        pool_classes = torch.stack(list(label_batch))[torch.arange(nof_pool_classes) * class_size]
+        nof_scored = self.nof_scored(nof_pool_classes)
+        class_offsets = torch.arange(nof_scored) * class_size
+
+        # The t'th image of every scored class, folded into the batch dimension:
+        def class_inputs(t):
+            images = image_batch[class_offsets + t]
+            return self.transform_images(images, rotations[0:nof_scored]).view(nof_scored * batch_size, -1)
+
+        margins, choices = self.score_margins(q_network, class_inputs, nof_scored, batch_size, text=False)
+        margins = self.estimate_margins(margins, pool_classes)
 
         # Get the c lowest margin class indexes:
         margin_class_batch = self.compare_margins(margins)
+        self.push_statistics(statistics, margins, choices, batch_size)
 
-        # Storing the max margin:
-        statistics.push_variables({'all_margins': torch.mean(margins.t().max(1)[0]).item(),
-                                   'low_margins': torch.mean(margins.t().min(1)[0]).item(),
-                                   'all_choices': np.array([float(c/batch_size) for c in choices])
-                                   })
+        # Drawing the episode among the images of the selected classes:
+        positions, pseudo_labels = self.select_episode(margin_class_batch, class_size, batch_size)
 
-        episode_batch_final = torch.FloatTensor(int(self.nof_classes*10), batch_size, 20, 20)
-        label_batch_final = torch.LongTensor(int(self.nof_classes*10), batch_size)
+        images = image_batch[positions.t(), batch_indexes]
+        episode_classes = positions.t() // class_size
+        episode_batch_final = self.transform_images(images, rotations[episode_classes, batch_indexes])
 
-        # Iterate over classes to select (meaning batch):
-        b = 0
-        for m_c in margin_class_batch.t():
-            images = []
-            for c in m_c:
-                for i in range(c*20, c*20 + 20):
-                    images.append((image_batch[i][b], c))
+        return episode_batch_final, pseudo_labels.t().contiguous()
 
-            class_indexes = np.random.choice(len(images), int(self.nof_classes*10), replace=False)
+    def sample_text(self, text_batch, label_batch, q_network, batch_size, statistics):
 
-            labels = {}
-            t = 0
-            inds = np.random.choice(self.nof_classes, self.nof_classes, replace=False)
-            ind = 0
+        # Size should be: (batch_size, pool_size, 1, SEN_LEN), grouped by class:
+        nof_pool_classes = self.margin_size * self.nof_classes
+        class_size = int(text_batch.size(1) / nof_pool_classes)
 
-            for c_i in class_indexes:
-                img, label = images[c_i]
+        pool_classes = label_batch[:, torch.arange(nof_pool_classes) * class_size].t()
+        nof_scored = self.nof_scored(nof_pool_classes)
+        class_offsets = torch.arange(nof_scored) * class_size
 
-                img = self.transform_image(img, rotations[label][b])
+        # The t'th text of every scored class, folded into the batch dimension:
+        def class_inputs(t):
+            texts = text_batch[:, class_offsets + t]
+            return texts.transpose(0, 1).contiguous().view(nof_scored * batch_size, -1)
 
-                if label not in labels:
-                    labels[label] = int(inds[ind])
-                    ind += 1
+        margins, choices = self.score_margins(q_network, class_inputs, nof_scored, batch_size, text=True)
+        margins = self.estimate_margins(margins, pool_classes)
 
-                pseudo_label = labels[label]
+        # Get the c lowest margin class indexes:
+        margin_class_batch = self.compare_margins(margins)
+        self.push_statistics(statistics, margins, choices, batch_size)
 
-                episode_batch_final[t][b] = img
-                label_batch_final[t][b] = pseudo_label
+        # Drawing the episode among the texts of the selected classes:
+        positions, pseudo_labels = self.select_episode(margin_class_batch, class_size, batch_size)
 
-                t += 1
-            b += 1
+        episode_batch_final = text_batch[torch.arange(batch_size).unsqueeze(1), positions].long()
 
-        return episode_batch_final, label_batch_final
+        return episode_batch_final, pseudo_labels
 
-    def sample_text(self, text_batch, label_batch, q_network, batch_size, statistics):
-        # Size should be: (episode_size, Batch_size, SEN_LEN, WORDS)
-        state = []
-        for b in range(batch_size):
-            state.append([0 for j in range(self.nof_classes)])
-
-        # Initial parameters:
-        hidden = q_network.reset_hidden(batch_size)
-        rand_label = random.randint(0, self.nof_classes)
-        current_margin_time = 0
-        next_class = False
-        current_class = 0
-        margins = torch.zeros(self.margin_size * self.nof_classes, batch_size)
-        choices = np.zeros(self.nof_classes + 1)
+    def nof_scored(self, nof_pool_classes):
+        # With a class index, only the first (refresh) classes of the pool are rescored:
+        if self.class_index is None:
+            return nof_pool_classes
+        return self.class_index.refresh_size(nof_pool_classes)
 
-        # We want to iterate over all images m_c --> [0, 119]:
-        for m_c in range(len(text_batch[0])):
+    def score_margins(self, q_network, class_inputs, nof_scored, batch_size, text):
+        """
+        Scores the classes at once, by folding the classes into the batch dimension.
+        Every class is shown margin_time samples (from a reset hidden state), accumulating the max Q-value.
+        :param class_inputs: Function giving the input batch (nof_scored * batch_size, ...) of timestep t.
+        :param nof_scored: Number of classes scored.
+        :return: FloatTensor (nof_scored, batch_size) of margins, and the counts of the chosen actions.
+        """
+        scoring_size = nof_scored * batch_size
 
-            text_class_batch = text_batch[:, m_c].squeeze()
-            label_class_batch = label_batch[:, m_c]
+        hidden = q_network.reset_hidden(scoring_size)
+        margins = torch.zeros(scoring_size)
+        choices = np.zeros(self.nof_classes + 1)
 
-            # So we dont have to transform ALL images (AKA also the ones were not gonna use):
-            if next_class == True and current_class == label_class_batch[0]:
-                continue
-            else:
-                next_class = False
-                current_class = label_class_batch[0]
+        # Zero-state first, then a random label per class (where nof_classes means no label):
+        state = torch.zeros(scoring_size, self.nof_classes)
+        rand_labels = torch.randint(0, self.nof_classes + 1, (nof_scored, 1)).repeat(1, batch_size).view(-1)
+        next_state = (rand_labels.unsqueeze(1) == torch.arange(self.nof_classes).unsqueeze(0)).float()
+        if self.cuda:
+            state = state.cuda()
+            next_state = next_state.cuda()
 
-            # Get class prediction value:
-            # Tensoring the state:
-            state = Variable(torch.FloatTensor(state))
+        for t in range(self.margin_time):
+            inputs = class_inputs(t)
+            if self.cuda:
+                inputs = inputs.cuda()
 
-            # Need to add text to the state vector:
             with torch.no_grad():
-                margin, hidden = q_network(Variable(text_class_batch), hidden, class_vector=state, seq=text_class_batch.size()[1])
-
-            # Create new state:
-            state = []
-            for b in range(batch_size):
-                state.append([1 if j == rand_label else 0 for j in range(self.nof_classes)])
-
-            # First time new class:
-            if current_margin_time < self.margin_time:
-                for m_ind in margin.data.max(1)[1]:
-                    choices[m_ind] += 1
-                margins[current_class] = torch.abs(margin.data.max(1)[0]) + margins[current_class]
-                current_margin_time += 1
-
-            # n >= margin-time:
-            else:
-                state = []
-                for b in range(batch_size):
-                    state.append([0 for j in range(self.nof_classes)])
-                hidden = q_network.reset_hidden(batch_size)
-                rand_label = random.randint(0, self.nof_classes)
-                current_margin_time = 0
-                next_class = True
-
-        # Get the c lowest margin class indexes:
-        margin_class_batch = self.compare_margins(margins)
+                if text:
+                    margin, hidden = q_network(Variable(inputs), hidden, class_vector=Variable(state),
+                                               seq=inputs.size()[1])
+                else:
+                    # Need to add image to the state vector:
+                    margin, hidden = q_network(Variable(torch.cat((state, inputs), 1)), hidden)
+
+            max_margin, max_action = margin.data.max(1)
+            choices += np.bincount(max_action.cpu().numpy(), minlength=self.nof_classes + 1)
+            margins += torch.abs(max_margin).cpu()
+
+            state = next_state
+
+        return margins.view(nof_scored, batch_size), choices
+
+    def estimate_margins(self, margins, pool_classes):
+        """
+        Updates the class index with the rescored classes, and estimates the margins of the others from it.
+        :param margins: FloatTensor (nof_scored, batch_size) of margins of the first pool classes.
+        :param pool_classes: LongTensor (nof_pool_classes, batch_size) of the dataset classes in the pool.
+        :return: FloatTensor (nof_pool_classes, batch_size) of margins.
+        """
+        if self.class_index is None:
+            return margins
+
+        nof_scored = margins.size(0)
+        self.class_index.update(pool_classes[0:nof_scored], margins)
+        estimates = torch.from_numpy(self.class_index.estimates()).float()[pool_classes]
+        estimates[0:nof_scored] = margins
+
+        return estimates
+
+    def select_episode(self, margin_class_batch, class_size, batch_size):
+        """
+        Draws nof_classes * 10 samples among the samples of the selected classes, in random order.
+        :param margin_class_batch: LongTensor (nof_classes, batch_size) of selected pool classes.
+        :param class_size: Number of samples per class in the pool.
+        :return: LongTensor (batch_size, nof_classes * 10) of pool positions and of their pseudo-labels.
+        """
+        # Positions of all samples of the selected classes (batch_size, nof_classes * class_size):
+        selected = margin_class_batch.t().numpy()
+        positions = (selected[:, :, None] * class_size + np.arange(class_size)).reshape(batch_size, -1)
+        order = np.argsort(np.random.rand(batch_size, positions.shape[1]), axis=1)[:, 0:int(self.nof_classes*10)]
+        positions = np.take_along_axis(positions, order, axis=1)
+
+        # Random pseudo-label for every selected class:
+        pseudo_labels = np.argsort(np.random.rand(batch_size, self.nof_classes), axis=1)
+        pseudo_labels = np.take_along_axis(pseudo_labels, order // class_size, axis=1)
+
+        return torch.from_numpy(positions), torch.from_numpy(pseudo_labels)
+
+    def push_statistics(self, statistics, margins, choices, batch_size):
+        if statistics is None:
+            return
 
         # Storing the max margin:
         statistics.push_variables({'all_margins': torch.mean(margins.t().max(1)[0]).item(),
                                    'low_margins': torch.mean(margins.t().min(1)[0]).item(),
-                                   'all_choices': np.array([float(c / batch_size) for c in choices])
+                                   'all_choices': np.array([float(c/batch_size) for c in choices])
                                    })
 
-        episode_batch_final = torch.zeros(batch_size, int(self.nof_classes * 10), 1,
-                                          self.sentence_length).type(torch.LongTensor)
-        # episode_batch_final = torch.LongTensor(batch_size, int(self.nof_classes*10), 1)
-        label_batch_final = torch.LongTensor(batch_size, int(self.nof_classes * 10))
-
-        # Iterate over classes to select (meaning batch):
-        b = 0
-        for m_c in margin_class_batch.t():
-            texts = []
-            for c in m_c:
-                for i in range(c*10, c*10 + 10):
-                    texts.append(([text_batch[b][i]], label_batch[b][i]))
-
-            class_indexes = np.random.choice(len(texts), int(self.nof_classes*10), replace=False)
-
-            labels = {}
-            t = 0
-            inds = np.random.choice(self.nof_classes, self.nof_classes, replace=False)
-            ind = 0
-
-            for c_i in class_indexes:
-                text, label = texts[c_i]
-                label = label.item()
-
-                if label not in labels:
-                    labels[label] = int(inds[ind])
-                    ind += 1
-
-                pseudo_label = labels[label]
-                episode_batch_final[b][t] = text[0]
-
-                label_batch_final[b][t] = pseudo_label
-                t += 1
-            b += 1
-        return episode_batch_final, label_batch_final
-
-    def transform_images(self, image_class_batch, batch_size, rotations, current_class):
-        margin_image_batch = torch.Tensor(batch_size, 20, 20)
-
-        # Transforming image batch (EITHER HERE OR IN DATALOADER):
-        for b in range(batch_size):
-            img = Image.fromarray(image_class_batch[b].numpy())
-            if self.transform is not None:
-                # Applying class specific rotations:
-                if rotations[current_class][b] == 1:
-                    img = transforms.vflip(img)
-                elif rotations[current_class][b] == 2:
-                    img = transforms.hflip(img)
-                elif rotations[current_class][b] == 3:
-                    img = transforms.hflip(transforms.vflip(img))
-
-            img = self.transform(img)
-
-            # Normalizing (pixels are binary):
-            threshold = torch.Tensor([0.0])
-            img = (img == threshold).float() * 1
-
-            # Adding to new tensor:
-            margin_image_batch[b] = img
-
-        return margin_image_batch
-
-    def transform_image(self, image, rotation):
-        img = Image.fromarray(image.numpy())
-        if self.transform is not None:
-            # Applying class specific rotations:
-            if rotation == 1:
-                img = transforms.vflip(img)
-            elif rotation == 2:
-                img = transforms.hflip(img)
-            elif rotation == 3:
-                img = transforms.hflip(transforms.vflip(img))
-
-        img = self.transform(img)
-
-        # Normalizing (pixels are binary):
-        threshold = torch.Tensor([0.0])
-        img = (img == threshold).float() * 1
-
-        return img
+    def transform_images(self, images, rotations):
+        # Picking the class specific rotation of each cached image (..., VARIANTS, 20, 20) --> (..., 20, 20):
+        return images.gather(-3, rotations.view(rotations.size() + (1, 1, 1)).expand(
+            rotations.size() + (1,) + images.size()[-2:])).squeeze(-3).float()
 
     def compare_margins(self, margins):
         # Get the classes with the lowest margin:
         margin_classes = margins.sort(0, descending=False)[1][0:self.nof_classes, :]
 
         return margin_classes
+
+
+class MarginStatistics:
+    """Keeps the margin statistics of a batch scored in a DataLoader worker, for the trainer to push."""
+
+    def __init__(self):
+        self.variables = {}
+
+    def push_variables(self, variables):
+        self.variables.update(variables)
+
+
+class MarginCollate:
+    """
+    DataLoader collate_fn scoring a whole batch of margin pools at once, inside the DataLoader worker, with the
+    worker's copy of the shared Q-network snapshot (see SharedQNetwork).
+    :return: The selected episode batch, its labels and the margin statistics of the batch.
+    """
+
+    def __init__(self, margin_sampler, shared_network, text):
+        self.margin_sampler = margin_sampler
+        self.shared_network = shared_network
+        self.text = text
+
+    def __call__(self, pools):
+        pool_batch, pool_label_batch = default_collate(pools)
+        statistics = MarginStatistics()
+        q_network = self.shared_network.local_network()
+        if self.text:
+            episode_batch, label_batch = self.margin_sampler.sample_text(pool_batch, pool_label_batch, q_network,
+                                                                         len(pools), statistics)
+        else:
+            episode_batch, label_batch = self.margin_sampler.sample_images(pool_batch, pool_label_batch, q_network,
+                                                                           len(pools), statistics)
+        return episode_batch, label_batch, statistics.variables
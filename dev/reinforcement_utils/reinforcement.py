@@ -1,5 +1,4 @@
-import random
-import numpy as np
+import torch
 
 
 class ReinforcementLearning:
@@ -7,69 +6,73 @@ class ReinforcementLearning:
     # For Epsilon Greedy Exploration:
     EPS = 0.05
 
-    def __init__(self, classes):
+    def __init__(self, classes, seed=None):
         self.classes = classes
         self.request_reward = -0.05
         self.prediction_reward = 1.0
         self.prediction_penalty = -1.0
 
-    def select_actions(self, epoch, model_actions, batch_size, class_vector_size, episode_labels):
+        # Own RNG stream for exploration, so it does not interfere with sampling:
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
 
-        # Performing Epsilon Greedy Exploration:
-        agent_actions = []
+    def select_actions(self, model_actions, episode_labels):
+        """
+        Epsilon Greedy action selection over the whole batch.
+        :param model_actions: LongTensor (batch_size) of greedy actions from the Q-network.
+        :param episode_labels: LongTensor (batch_size) of true labels.
+        :return: LongTensor (batch_size) of actions, where self.classes means "request label".
+        """
+        device = model_actions.device
+        model_actions = model_actions.view(-1).cpu()
+        episode_labels = episode_labels.view(-1).cpu().long()
+        batch_size = model_actions.size(0)
 
-        EPS = self.EPS
-        for i in range(batch_size):
+        # Which samples explore, and what kind of exploration (0: request, 1: wrong, 2: correct):
+        explore = torch.rand(batch_size, generator=self.generator) <= self.EPS
+        epsilon_action = torch.randint(0, 3, (batch_size,), generator=self.generator)
 
-            # Model choice:
-            if random.random() > EPS:
-                agent_actions.append(model_actions[i])
+        # Wrong label drawn uniformly from every class except the true one:
+        wrong_label = torch.randint(0, max(1, self.classes - 1), (batch_size,), generator=self.generator)
+        wrong_label = wrong_label + (wrong_label >= episode_labels).long()
 
-            # Epsilon Greedy:
-            else:
-                epsilon_action = random.randint(0, 2)
+        epsilon_actions = torch.where(epsilon_action == 0, torch.full_like(episode_labels, self.classes),
+                                      torch.where(epsilon_action == 1, wrong_label, episode_labels))
 
-                # Request:
-                if epsilon_action == 0:
-                    agent_actions.append(class_vector_size)
+        agent_actions = torch.where(explore, epsilon_actions, model_actions)
 
-                # Incorrect Prediction:
-                elif epsilon_action == 1:
-                    
-                    wrong_label = random.randint(0, class_vector_size - 1)
-                    while wrong_label == episode_labels[i]:
-                        wrong_label = random.randint(0, class_vector_size - 1)
-                    agent_actions.append(wrong_label)
+        return agent_actions.to(device)
 
-                # Correct Prediction:
-                else:
-                    agent_actions.append(episode_labels[i])
+    # Collecting the rewards received, given the action chosen:
+    def collect_reward_batch(self, actions, labels):
+        """
+        :param actions: LongTensor (batch_size) of chosen actions.
+        :param labels: LongTensor (batch_size) of true labels.
+        :return: FloatTensor (batch_size) of rewards.
+        """
+        actions = actions.view(-1)
+        labels = labels.view(-1).to(actions.device)
 
-        return agent_actions
+        rewards = torch.full(actions.size(), self.prediction_penalty, device=actions.device)
+        rewards.masked_fill_(actions == labels, self.prediction_reward)
+        rewards.masked_fill_(actions == self.classes, self.request_reward)
 
-    # Collecting the rewards received, given the action chosen:
-    def collect_reward_batch(self, actions, labels, batch_size):
-        # Last bit determines if the agent predicts or request the label:
-        rewards = []
-        for i in range(batch_size):
-            if int(actions[i]) == self.classes:
-                rewards.append(self.request_reward)
-            else:
-                if np.argmax(labels[i]) == int(actions[i]):
-                    rewards.append(self.prediction_reward)
-                else:
-                    rewards.append(self.prediction_penalty)
         return rewards
 
     # Collects a batch of next states, corresponding to the appropriate actions:
-    def next_state_batch(self, actions, one_hot_labels, batch_size):
-        actions = actions
-        states = []
-        for i in range(batch_size):
-            # Requesting the label:
-            if int(actions[i]) == self.classes:
-                states.append(one_hot_labels[i])
-            # Predicting (Thus returning a 0-vector to the input):
-            else:
-                states.append([0 for i in range(self.classes)])
+    def next_state_batch(self, actions, labels):
+        """
+        Requesting the label returns the one-hot label as next state, predicting returns a 0-vector.
+        :param actions: LongTensor (batch_size) of chosen actions.
+        :param labels: LongTensor (batch_size) of true labels.
+        :return: FloatTensor (batch_size, classes).
+        """
+        actions = actions.view(-1)
+        labels = labels.view(-1).to(actions.device).long()
+
+        states = torch.zeros(actions.size(0), self.classes, device=actions.device)
+        states.scatter_(1, labels.unsqueeze(1), 1.0)
+        states.mul_((actions == self.classes).float().unsqueeze(1))
+
         return states
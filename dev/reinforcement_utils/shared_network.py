@@ -0,0 +1,66 @@
+import copy
+import time
+import torch
+
+
+class SharedQNetwork:
+    """
+    Read-only snapshot of the Q-network's weights in shared memory, for margin scoring in DataLoader workers
+    (and for the actors of the actor-learner mode). The trainer copies its weights in every refresh_interval
+    epochs. Each worker keeps a local copy, which is re-synced when the snapshot's version changes (odd versions
+    mean a copy is in progress).
+    """
+
+    def __init__(self, q_network, refresh_interval=10, epoch=0):
+        """
+        :param q_network: The Q-network being trained.
+        :param refresh_interval: Number of epochs between weight refreshes.
+        :param epoch: Number of epochs the Q-network has been trained for.
+        """
+        self.refresh_interval = refresh_interval
+        self.network = copy.deepcopy(q_network).cpu()
+        self.network.share_memory()
+        self.network.eval()
+        self.version = torch.zeros(1, dtype=torch.long).share_memory_()
+        self.epoch = torch.full((1,), epoch, dtype=torch.long).share_memory_()
+
+        # Local to every process:
+        self.local = None
+        self.local_version = -1
+        self.local_epoch = epoch
+
+    def refresh(self, q_network, epoch, force=False):
+        """
+        Copies the Q-network's weights into the snapshot, every refresh_interval epochs.
+        :param epoch: Number of epochs the Q-network has been trained for.
+        :param force: Copies the weights regardless of the epoch (e.g. after loading a checkpoint).
+        """
+        if not force and epoch % self.refresh_interval != 0:
+            return
+        self.version += 1
+        shared_state = self.network.state_dict()
+        for name, value in q_network.state_dict().items():
+            shared_state[name].copy_(value)
+        self.epoch.fill_(epoch)
+        self.version += 1
+
+    def local_network(self):
+        """
+        :return: This process' copy of the latest complete snapshot (of the weights after local_epoch epochs).
+        """
+        if self.local is None:
+            self.local = copy.deepcopy(self.network)
+        while True:
+            version = self.version.item()
+            if version == self.local_version:
+                return self.local
+            if version % 2 == 1:
+                # Snapshot being written:
+                time.sleep(0.01)
+                continue
+            self.local.load_state_dict(self.network.state_dict())
+            epoch = self.epoch.item()
+            if self.version.item() == version:
+                self.local_version = version
+                self.local_epoch = epoch
+                return self.local
@@ -223,6 +223,12 @@ class Args:
         self.NTM = setup['NTM']
         self.LRUA = setup['LRUA']
 
+        # Q-network options (the defaults of utils/arguments.py):
+        self.memory_slots = setup.get('memory_slots', 128)
+        self.sparse_k = setup.get('sparse_k', 0)
+        self.reversible_memory = setup.get('reversible_memory', False)
+        self.checkpoint_segment = setup.get('checkpoint_segment', 0)
+
 
 if __name__ == '__main__':
     data_sets = ['OMNIGLOT', 'MNIST', 'INH', 'REUTERS', 'QA']
@@ -294,7 +300,8 @@ if __name__ == '__main__':
 
         if nof_scenarios > 1:
             print('\n--- Running scenario ' + str(i) + '---')
-            scenario_loader.dataset.scenario_type = i
+            # Text scenario loaders hold a batch-level view (TextEpisodes) of the dataset:
+            getattr(scenario_loader.dataset, 'dataset', scenario_loader.dataset).scenario_type = i
             scenario_type = i
 
         if scenario_type == 0:
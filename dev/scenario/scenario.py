@@ -15,14 +15,15 @@ def run(q_network, scenario_loader, args, reinforcement_learner, text_dataset):
     q_network.eval()
 
     # Collect a random batch:
-    sample_batch, label_batch = scenario_loader.__iter__().__next__()
+    sample_batch, label_batch = next(iter(scenario_loader))
 
     # Create initial state:
-    state = []
+    state = torch.zeros(args.batch_size, args.class_vector_size)
     label_dict = []
     for i in range(args.batch_size):
-        state.append([0 for i in range(args.class_vector_size)])
         label_dict.append({})
+    if args.cuda:
+        state = state.cuda()
 
     # Initialize q_network between each episode:
     hidden = q_network.reset_hidden(args.batch_size)
@@ -40,16 +41,10 @@ def run(q_network, scenario_loader, args, reinforcement_learner, text_dataset):
         else:
             episode_labels, episode_samples = label_batch[i_e], sample_batch[i_e]
 
-        # Tensoring the state:
-        state = Variable(torch.FloatTensor(state))
+        episode_labels = episode_labels.view(args.batch_size)
 
-        # Create possible next states and update stats:
-        one_hot_labels = []
-        for i in range(args.batch_size):
-            true_label = episode_labels.squeeze()[i].item()
-
-            # Creating one hot labels:
-            one_hot_labels.append([1 if j == true_label else 0 for j in range(args.class_vector_size)])
+        # Update stats:
+        for i, true_label in enumerate(episode_labels.tolist()):
 
             # Logging statistics:
             if true_label not in label_dict[i]:
@@ -69,13 +64,14 @@ def run(q_network, scenario_loader, args, reinforcement_learner, text_dataset):
             # Need to add image to the state vector:
             flat_images = episode_samples.squeeze().view(args.batch_size, -1)
 
+            if args.cuda:
+                flat_images = flat_images.cuda()
+
             # Concatenating possible labels/zero vector with image, to create the environment state:
-            state = torch.cat((state, flat_images), 1)
+            state = torch.cat((state, flat_images.float()), 1)
 
-            if args.cuda:
-                q_values, hidden = q_network(Variable(state, volatile=True).type(torch.FloatTensor).cuda(), hidden)
-            else:
-                q_values, hidden = q_network(Variable(state, volatile=True).type(torch.FloatTensor), hidden)
+            with torch.no_grad():
+                q_values, hidden = q_network(state, hidden)
 
         q_values = F.softmax(q_values, dim=1)
 
@@ -108,7 +104,7 @@ def run(q_network, scenario_loader, args, reinforcement_learner, text_dataset):
         agent_actions = model_actions
 
         # Observe next state and sample:
-        next_state_start = reinforcement_learner.next_state_batch(agent_actions, one_hot_labels, args.batch_size)
+        next_state_start = reinforcement_learner.next_state_batch(agent_actions, episode_labels)
 
         # Update current state:
         state = next_state_start
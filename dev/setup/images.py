@@ -3,7 +3,10 @@ from models import reinforcement_models
 import torch
 from utils.images import imageLoader as loader
 from data.images.omniglot.omniglot_class_margin import OMNIGLOT_MARGIN
-from data.images.omniglot.omniglot import OMNIGLOT
+from data.images.omniglot.omniglot import OMNIGLOT, OmniglotEpisodes
+from utils.episode_stream import seed_worker
+from reinforcement_utils.class_margin_sampling import ClassMarginSampler, MarginCollate
+from reinforcement_utils.shared_network import SharedQNetwork
 
 
 class ImageModelSetup:
@@ -44,13 +47,20 @@ class ImageNetworkSetup:
         print("Setting up Q Network...")
         if args.LSTM:
             q_network = reinforcement_models.ReinforcedRNN(args.batch_size, args.cuda,
-                                                           args.class_vector_size, setup.IMAGE_SIZE)
+                                                           args.class_vector_size, setup.IMAGE_SIZE,
+                                                           checkpoint_segment=args.checkpoint_segment)
         elif args.NTM:
             q_network = reinforcement_models.ReinforcedNTM(args.batch_size, args.cuda,
-                                                           args.class_vector_size, setup.IMAGE_SIZE)
+                                                           args.class_vector_size, setup.IMAGE_SIZE,
+                                                           memory_slots=args.memory_slots, sparse_k=args.sparse_k,
+                                                           reversible_memory=args.reversible_memory,
+                                                           checkpoint_segment=args.checkpoint_segment)
         else:
             q_network = reinforcement_models.ReinforcedLRUA(args.batch_size, args.cuda,
-                                                            args.class_vector_size, setup.IMAGE_SIZE)
+                                                            args.class_vector_size, setup.IMAGE_SIZE,
+                                                            memory_slots=args.memory_slots, sparse_k=args.sparse_k,
+                                                            reversible_memory=args.reversible_memory,
+                                                            checkpoint_segment=args.checkpoint_segment)
 
         return q_network
 
@@ -67,22 +77,38 @@ class ImageNetworkSetup:
             return scenario_loader
         else:
             if setup.CMS:
+                margin_sampler, shared_network, collate = None, None, None
+                if args.margin_workers:
+                    # The workers score their batches on the CPU, with a snapshot of the Q-network:
+                    margin_sampler = ClassMarginSampler(args)
+                    margin_sampler.cuda = False
+                    shared_network = SharedQNetwork(q_network, args.weight_refresh)
+                    collate = MarginCollate(margin_sampler, shared_network, text=False)
                 train_loader = torch.utils.data.DataLoader(
                     OMNIGLOT_MARGIN(dataset, train=True, transform=setup.train_transform, download=True,
                                     omniglot_loader=omniglot_loader, classes=args.class_vector_size,
                                     episode_size=args.episode_size, margin_time=setup.MARGIN_TIME,
-                                    MARGIN_SIZE=setup.MARGIN_SIZE, q_network=q_network),
-                    batch_size=args.batch_size, shuffle=True)
+                                    MARGIN_SIZE=setup.MARGIN_SIZE, margin_index=args.margin_index,
+                                    margin_refresh=args.margin_refresh, margin_sampler=margin_sampler,
+                                    shared_network=shared_network),
+                    batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers, collate_fn=collate,
+                    worker_init_fn=seed_worker, persistent_workers=args.num_workers > 0,
+                    # The stream keeps iterating over passes, a short final batch would not fit the episode batch:
+                    drop_last=True)
             else:
                 train_loader = torch.utils.data.DataLoader(
-                    OMNIGLOT(dataset, train=True, transform=setup.test_transform, download=True,
-                             omniglot_loader=omniglot_loader, classes=args.class_vector_size,
-                             episode_size=args.episode_size), batch_size=args.batch_size, shuffle=True)
+                    OmniglotEpisodes(OMNIGLOT(dataset, train=True, transform=setup.test_transform, download=True,
+                                              omniglot_loader=omniglot_loader, classes=args.class_vector_size,
+                                              episode_size=args.episode_size), args.batch_size),
+                    batch_size=None, num_workers=args.num_workers, worker_init_fn=seed_worker,
+                    persistent_workers=args.num_workers > 0)
 
             print("Loading testset...")
             test_loader = torch.utils.data.DataLoader(
-                OMNIGLOT(dataset, train=False, transform=setup.test_transform, omniglot_loader=omniglot_loader,
-                         classes=args.class_vector_size, episode_size=args.episode_size, test=True),
-                batch_size=args.test_batch_size, shuffle=True)
+                OmniglotEpisodes(OMNIGLOT(dataset, train=False, transform=setup.test_transform,
+                                          omniglot_loader=omniglot_loader, classes=args.class_vector_size,
+                                          episode_size=args.episode_size, test=True), args.test_batch_size),
+                batch_size=None, num_workers=args.num_workers, worker_init_fn=seed_worker,
+                persistent_workers=args.num_workers > 0)
 
         return train_loader, test_loader
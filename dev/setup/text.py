@@ -3,8 +3,11 @@ from data.text.fast_text.parse import FastText
 from models import reinforcement_models
 import torch
 
-from data.text.text_dataset import TEXT
+from data.text.text_dataset import TEXT, TextEpisodes
 from data.text.text_class_margin import TextMargin
+from utils.episode_stream import seed_worker
+from reinforcement_utils.class_margin_sampling import ClassMarginSampler, MarginCollate
+from reinforcement_utils.shared_network import SharedQNetwork
 
 
 class TextModelSetup:
@@ -70,19 +73,26 @@ class TextNetworkSetup:
                                                            setup.EMBEDDING_SIZE,
                                                            embedding_weight_matrix=
                                                            self.text_loader.embedding_weight_matrix,
-                                                           embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE)
+                                                           embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE,
+                                                           checkpoint_segment=args.checkpoint_segment)
         elif args.NTM:
             q_network = reinforcement_models.ReinforcedNTM(args.batch_size, args.cuda, args.class_vector_size,
                                                            setup.EMBEDDING_SIZE,
                                                            embedding_weight_matrix=
                                                            self.text_loader.embedding_weight_matrix,
-                                                           embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE)
+                                                           embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE,
+                                                           memory_slots=args.memory_slots, sparse_k=args.sparse_k,
+                                                           reversible_memory=args.reversible_memory,
+                                                           checkpoint_segment=args.checkpoint_segment)
         else:
             q_network = reinforcement_models.ReinforcedLRUA(args.batch_size, args.cuda, args.class_vector_size,
                                                             setup.EMBEDDING_SIZE,
                                                             embedding_weight_matrix=
                                                             self.text_loader.embedding_weight_matrix,
-                                                            embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE)
+                                                            embedding=True, dict_size=setup.DICTIONARY_MAX_SIZE,
+                                                            memory_slots=args.memory_slots, sparse_k=args.sparse_k,
+                                                            reversible_memory=args.reversible_memory,
+                                                            checkpoint_segment=args.checkpoint_segment)
         return q_network
 
     def setup_loaders(self, setup, dataset, q_network, args, text_loader, scenario=False):
@@ -90,24 +100,37 @@ class TextNetworkSetup:
         idx2word = []
         if scenario:
             scenario_loader = torch.utils.data.DataLoader(
-                TEXT(dataset, train=args.train, data_loader=text_loader, classes=args.class_vector_size,
-                     episode_size=args.episode_size, tensor_length=setup.NUMBER_OF_SENTENCES,
-                     sentence_length=setup.SENTENCE_LENGTH, scenario=True, embedding_size=setup.EMBEDDING_SIZE,
-                     scenario_size=self.scenario_setup[0], scenario_type=self.scenario_setup[1],
-                     class_choice=self.scenario_setup[2], scenario_classes=self.scenario_setup[3],
-                     glove=args.GLOVE),
-                batch_size=args.scenario_batch_size, shuffle=True)
+                TextEpisodes(TEXT(dataset, train=args.train, data_loader=text_loader, classes=args.class_vector_size,
+                                  episode_size=args.episode_size, tensor_length=setup.NUMBER_OF_SENTENCES,
+                                  sentence_length=setup.SENTENCE_LENGTH, scenario=True,
+                                  embedding_size=setup.EMBEDDING_SIZE, scenario_size=self.scenario_setup[0],
+                                  scenario_type=self.scenario_setup[1], class_choice=self.scenario_setup[2],
+                                  scenario_classes=self.scenario_setup[3], glove=args.GLOVE),
+                             args.scenario_batch_size),
+                batch_size=None)
 
             return scenario_loader
         else:
             # MARGIN SAMPLING:
             if setup.CMS:
+                margin_sampler, shared_network, collate = None, None, None
+                if args.margin_workers:
+                    # The workers score their batches on the CPU, with a snapshot of the Q-network:
+                    margin_sampler = ClassMarginSampler(args, setup.SENTENCE_LENGTH)
+                    margin_sampler.cuda = False
+                    shared_network = SharedQNetwork(q_network, args.weight_refresh)
+                    collate = MarginCollate(margin_sampler, shared_network, text=True)
                 train_loader = torch.utils.data.DataLoader(
                     TextMargin(dataset, train=True, download=True, data_loader=text_loader, classes=args.class_vector_size,
                                episode_size=args.episode_size, tensor_length=setup.NUMBER_OF_SENTENCES,
                                sentence_length=setup.SENTENCE_LENGTH, embedding_size=setup.EMBEDDING_SIZE, margin_time=setup.MARGIN_TIME,
-                               MARGIN_SIZE=setup.MARGIN_SIZE, q_network=q_network, glove=self.args.GLOVE),
-                    batch_size=args.batch_size, shuffle=False)
+                               MARGIN_SIZE=setup.MARGIN_SIZE, glove=self.args.GLOVE,
+                               margin_index=args.margin_index, margin_refresh=args.margin_refresh,
+                               margin_sampler=margin_sampler, shared_network=shared_network),
+                    batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers, collate_fn=collate,
+                    worker_init_fn=seed_worker, persistent_workers=args.num_workers > 0,
+                    # The stream keeps iterating over passes, a short final batch would not fit the episode batch:
+                    drop_last=True)
 
             # NO MARGIN:
             else:
@@ -117,13 +140,16 @@ class TextNetworkSetup:
                                   embedding_size=setup.EMBEDDING_SIZE, glove=self.args.GLOVE)
                 idx2word = text_class.dictionary.dictionary.idx2word
                 train_loader = torch.utils.data.DataLoader(
-                    text_class,
-                    batch_size=args.batch_size, shuffle=True)
+                    TextEpisodes(text_class, args.batch_size),
+                    batch_size=None, num_workers=args.num_workers,
+                    worker_init_fn=seed_worker, persistent_workers=args.num_workers > 0)
 
             test_loader = torch.utils.data.DataLoader(
-                TEXT(dataset, train=False, data_loader=text_loader, classes=args.class_vector_size,
-                     episode_size=args.episode_size, tensor_length=setup.NUMBER_OF_SENTENCES,
-                     sentence_length=setup.SENTENCE_LENGTH, embedding_size=setup.EMBEDDING_SIZE, glove=self.args.GLOVE),
-                batch_size=args.test_batch_size, shuffle=True)
+                TextEpisodes(TEXT(dataset, train=False, data_loader=text_loader, classes=args.class_vector_size,
+                                  episode_size=args.episode_size, tensor_length=setup.NUMBER_OF_SENTENCES,
+                                  sentence_length=setup.SENTENCE_LENGTH, embedding_size=setup.EMBEDDING_SIZE,
+                                  glove=self.args.GLOVE), args.test_batch_size),
+                batch_size=None, num_workers=args.num_workers,
+                worker_init_fn=seed_worker, persistent_workers=args.num_workers > 0)
 
             return train_loader, test_loader, idx2word
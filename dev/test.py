@@ -11,7 +11,8 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
     q_network.eval()
 
     # Collect a random batch:
-    sample_batch, label_batch = test_loader.__iter__().__next__()
+    batch = next(iter(test_loader))
+    sample_batch, label_batch = batch[0], batch[1]
 
     # Episode Statistics:
     episode_correct = 0.0
@@ -20,11 +21,12 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
     episode_reward = 0.0
 
     # Create initial state:
-    state = []
+    state = torch.zeros(args.test_batch_size, args.class_vector_size)
     label_dict = []
     for i in range(args.test_batch_size):
-        state.append([0 for i in range(args.class_vector_size)])
         label_dict.append({})
+    if args.cuda:
+        state = state.cuda()
 
     # Initialize q_network between each episode:
     hidden = q_network.reset_hidden(args.test_batch_size)
@@ -43,16 +45,10 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
         else:
             episode_labels, episode_samples = label_batch[i_e], sample_batch[i_e]
 
-        # Tensoring the state:
-        state = Variable(torch.FloatTensor(state))
+        episode_labels = episode_labels.view(args.test_batch_size)
 
-        # Create possible next states and update stats:
-        one_hot_labels = []
-        for i in range(args.test_batch_size):
-            true_label = episode_labels.squeeze()[i].item()
-
-            # Creating one hot labels:
-            one_hot_labels.append([1 if j == true_label else 0 for j in range(args.class_vector_size)])
+        # Update stats:
+        for i, true_label in enumerate(episode_labels.tolist()):
 
             # Logging statistics:
             if true_label not in label_dict[i]:
@@ -72,15 +68,14 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
             # Need to add image to the state vector:
             flat_images = episode_samples.squeeze().view(args.test_batch_size, -1)
 
+            if args.cuda:
+                flat_images = flat_images.cuda()
+
             # Concatenating possible labels/zero vector with image, to create the environment state:
-            state = torch.cat((state, flat_images), 1)
+            state = torch.cat((state, flat_images.float()), 1)
 
-            if args.cuda:
-                q_values, hidden = q_network(Variable(state, volatile=True).type(torch.FloatTensor).cuda(),
-                                             hidden)
-            else:
-                q_values, hidden = q_network(Variable(state, volatile=True).type(torch.FloatTensor),
-                                             hidden)
+            with torch.no_grad():
+                q_values, hidden = q_network(state, hidden)
 
         # Choosing the largest Q-values:
         q_network_actions = q_values.data.max(1)[1].view(args.test_batch_size)
@@ -89,11 +84,10 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
         agent_actions = q_network_actions
 
         # Collect rewards:
-        rewards = reinforcement_learner.collect_reward_batch(agent_actions,
-                                                             one_hot_labels, args.test_batch_size)
+        rewards = reinforcement_learner.collect_reward_batch(agent_actions, episode_labels)
 
         # Collecting average reward at time t over the batch:
-        episode_reward += float(sum(rewards) / args.test_batch_size)
+        episode_reward += rewards.mean().item()
 
         # Log statistics:
         stats = update_dicts(args, episode_labels, rewards, reinforcement_learner, label_dict,
@@ -103,7 +97,7 @@ def validate(q_network, epoch, test_loader, args, reinforcement_learner,
         episode_request += stats[2]
 
         # Observe next state and images:
-        next_state_start = reinforcement_learner.next_state_batch(agent_actions, one_hot_labels, args.test_batch_size)
+        next_state_start = reinforcement_learner.next_state_batch(agent_actions, episode_labels)
 
         # Update current state:
         state = next_state_start
@@ -150,19 +144,24 @@ def update_dicts(args, episode_labels, rewards, reinforcement_learner, label_dic
     predict = 0.0
     request = 0.0
     correct = 0.0
+
+    # Outcome masks of the batch:
+    requested = (rewards == reinforcement_learner.request_reward).tolist()
+    predicted = (rewards == reinforcement_learner.prediction_reward).tolist()
+    true_labels = episode_labels.view(-1).tolist()
+
     for i in range(args.test_batch_size):
-        true_label = episode_labels[i].item()
+        true_label = true_labels[i]
 
         # Statistics:
-        reward = rewards[i]
-        if reward == reinforcement_learner.request_reward:
+        if requested[i]:
             request += 1.0
             predict += 1.0
             if label_dict[i][true_label] in request_dict:
                 request_dict[label_dict[i][true_label]].append(1)
             if label_dict[i][true_label] in accuracy_dict:
                 accuracy_dict[label_dict[i][true_label]].append(0)
-        elif reward == reinforcement_learner.prediction_reward:
+        elif predicted[i]:
             correct += 1.0
             predict += 1.0
             if label_dict[i][true_label] in request_dict:
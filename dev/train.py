@@ -12,7 +12,12 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
     q_network.eval()
 
     # Collect a random batch:
-    margin_batch, margin_label_batch = train_loader.__iter__().__next__()
+    batch = next(iter(train_loader))
+    margin_batch, margin_label_batch = batch[0], batch[1]
+
+    # Statistics of the margin pools scored in the DataLoader workers (see MarginCollate):
+    if len(batch) > 2:
+        statistics.push_variables(batch[2])
 
     # Get margin classes:
     if margin:
@@ -37,11 +42,12 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
     total_loss = 0.0
 
     # Create initial state:
-    state = []
+    state = torch.zeros(args.batch_size, args.class_vector_size)
     label_dict = []
     for i in range(args.batch_size):
-        state.append([0 for i in range(args.class_vector_size)])
         label_dict.append({})
+    if args.cuda:
+        state = state.cuda()
 
     # Initialize q_network between each episode:
     hidden = q_network.reset_hidden(args.batch_size)
@@ -56,6 +62,13 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
     else:
         loss = Variable(torch.zeros(1).type(torch.Tensor))
 
+    # Q-values and rewards of the previous timestep, awaiting their Bellman target:
+    previous_q_values = None
+    previous_rewards = None
+
+    # Zero gradients (accumulated over the truncation windows of the episode):
+    optimizer.zero_grad()
+
     # Episode loop:
     for i_e in range(args.episode_size):
 
@@ -65,19 +78,10 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
         else:
             episode_labels, episode_samples = label_batch[i_e], sample_batch[i_e]
 
-        # Tensoring the state:
-        if args.cuda:
-            state = Variable(torch.FloatTensor(state)).cuda()
-        else:
-            state = Variable(torch.FloatTensor(state))
-
-        # Create possible next states and update stats:
-        one_hot_labels = []
-        for i in range(args.batch_size):
-            true_label = episode_labels[i].item()
+        episode_labels = episode_labels.view(args.batch_size)
 
-            # Creating one hot labels:
-            one_hot_labels.append([1 if j == true_label else 0 for j in range(args.class_vector_size)])
+        # Update stats:
+        for i, true_label in enumerate(episode_labels.tolist()):
 
             # Logging statistics:
             if true_label not in label_dict[i]:
@@ -85,38 +89,53 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
             else:
                 label_dict[i][true_label] += 1
 
-        # Selecting an action to perform (Epsilon Greedy):
+        # Collecting the network input:
         if text_dataset:
+            inputs = Variable(episode_samples).type(torch.LongTensor)
             if args.cuda:
-                q_values, hidden = q_network(Variable(episode_samples).type(torch.LongTensor).cuda(), hidden,
-                                             class_vector=state, seq=episode_samples.size()[1])
-            else:
-                q_values, hidden = q_network(Variable(episode_samples).type(torch.LongTensor), hidden,
-                                             class_vector=state, seq=episode_samples.size()[1])
+                inputs = inputs.cuda()
         else:
             # Need to add image to the state vector:
             flat_images = episode_samples.squeeze().view(args.batch_size, -1)
 
-            # Concatenating possible labels/zero vector with image, to create the environment state:
-            state = torch.cat((state, flat_images), 1)
-            
             if args.cuda:
-                q_values, hidden = q_network(Variable(state).type(torch.FloatTensor).cuda(), hidden)
-            else:
-                q_values, hidden = q_network(Variable(state).type(torch.FloatTensor), hidden)
+                flat_images = flat_images.cuda()
+
+            # Concatenating possible labels/zero vector with image, to create the environment state:
+            state = torch.cat((state, flat_images.float()), 1)
+            inputs = state
+
+        # Truncated backpropagation through time, every args.truncation timesteps:
+        if args.truncation > 0 and i_e > 0 and i_e % args.truncation == 0:
+            if previous_q_values is not None:
+                # The previous timestep's target from a read-only pass, before the window's update:
+                with torch.no_grad():
+                    target_value = q_forward(q_network, inputs, hidden, state, text_dataset,
+                                             read_only=True)[0].max(1)[0]
+                discounted_target_value = ((GAMMA * target_value) + previous_rewards).view(args.batch_size, -1)
+                mse_loss = criterion(previous_q_values, discounted_target_value)
+                total_loss += mse_loss.data.item()
+                loss += mse_loss
+                previous_q_values = None
+
+            # Back-propagating the window, and continuing from a detached state:
+            loss = backward_window(loss, optimizer, args)
+            hidden = q_network.detach_hidden(hidden)
+
+        # Selecting an action to perform (Epsilon Greedy):
+        q_values, hidden = q_forward(q_network, inputs, hidden, state, text_dataset)
 
         # Choosing the largest Q-values:
         q_network_actions = q_values.data.max(1)[1].view(args.batch_size)
 
         # Collect Epsilon-Greedy actions:
-        agent_actions = reinforcement_learner.select_actions(epoch, q_network_actions, args.batch_size,
-                                                             args.class_vector_size, episode_labels)
+        agent_actions = reinforcement_learner.select_actions(q_network_actions, episode_labels)
 
         # Collect rewards:
-        rewards = reinforcement_learner.collect_reward_batch(agent_actions, one_hot_labels, args.batch_size)
+        rewards = reinforcement_learner.collect_reward_batch(agent_actions, episode_labels)
 
         # Collecting average reward at time t over the batch:
-        episode_reward += float(sum(rewards) / args.batch_size)
+        episode_reward += rewards.mean().item()
 
         # Just some statistics logging:
         stats = update_dicts(args.batch_size, episode_labels, rewards, reinforcement_learner,
@@ -126,71 +145,83 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
         episode_request += stats[2]
 
         # Observe next state and images:
-        next_state_start = reinforcement_learner.next_state_batch(agent_actions, one_hot_labels,
-                                                                  args.batch_size)
-
-        # Tensoring the reward:
-        if args.cuda:
-            rewards = Variable(torch.Tensor([rewards])).cuda()
-        else:
-            rewards = Variable(torch.Tensor([rewards]))
+        next_state_start = reinforcement_learner.next_state_batch(agent_actions, episode_labels)
 
         # Need to collect the representative Q-values:
-        if args.cuda:
-            agent_actions = Variable(torch.LongTensor(agent_actions)).cuda().unsqueeze(1)
-        else:
-            agent_actions = Variable(torch.LongTensor(agent_actions)).unsqueeze(1)
-
-        current_q_values = q_values.gather(1, agent_actions)
+        current_q_values = q_values.gather(1, agent_actions.unsqueeze(1))
 
-        # Now we need to collect the next episode's q-values to compare with:
-        if i_e < args.episode_size - 1:
+        # Separate read-only forward pass on the next state for the target:
+        if args.separate_target:
+            # Now we need to collect the next episode's q-values to compare with:
+            if i_e < args.episode_size - 1:
 
-            # Collect next state:
-            if text_dataset:
-                next_episode_samples = sample_batch[:, i_e + 1].squeeze()
-            else:
-                next_episode_samples = sample_batch[i_e + 1].squeeze().view(args.batch_size, -1)
+                # Collect next state:
+                if text_dataset:
+                    next_episode_samples = sample_batch[:, i_e + 1].squeeze()
+                else:
+                    next_episode_samples = sample_batch[i_e + 1].squeeze().view(args.batch_size, -1)
 
-            if args.cuda:
-                next_state = Variable(torch.FloatTensor(next_state_start)).cuda()
-            else:
-                next_state = Variable(torch.FloatTensor(next_state_start))
+                next_state = next_state_start
 
-            # Get target value for next state (SHOULD NOT COMPUTE GRADIENT!):
-            if text_dataset:
-                if args.cuda:
-                    target_value = \
-                        q_network(Variable(next_episode_samples).cuda(), hidden, class_vector=next_state,
-                                  read_only=True, seq=next_episode_samples.size()[1])[0].max(1)[0].detach()
+                # Get target value for next state (SHOULD NOT COMPUTE GRADIENT!):
+                if text_dataset:
+                    if args.cuda:
+                        target_value = \
+                            q_network(Variable(next_episode_samples).cuda(), hidden, class_vector=next_state,
+                                      read_only=True, seq=next_episode_samples.size()[1])[0].max(1)[0].detach()
+                    else:
+                        target_value = \
+                            q_network(Variable(next_episode_samples), hidden, class_vector=next_state,
+                                      read_only=True, seq=next_episode_samples.size()[1])[0].max(1)[0].detach()
                 else:
-                    target_value = \
-                        q_network(Variable(next_episode_samples), hidden, class_vector=next_state,
-                                  read_only=True, seq=next_episode_samples.size()[1])[0].max(1)[0].detach()
-            else:
-                next_state = torch.cat((next_state.view(args.batch_size, -1), next_episode_samples), 1)
+                    if args.cuda:
+                        next_episode_samples = next_episode_samples.cuda()
+                    next_state = torch.cat((next_state, next_episode_samples.float()), 1)
 
-                # Get target value for next state (SHOULD NOT COMPUTE GRADIENT!):
-                target_value = q_network(Variable(next_state), hidden, read_only=True)[0].max(1)[0].detach()
+                    # Get target value for next state (SHOULD NOT COMPUTE GRADIENT!):
+                    target_value = q_network(next_state, hidden, read_only=True)[0].max(1)[0].detach()
 
-            # Discounting the next state + reward collected in this state:
-            discounted_target_value = (GAMMA * target_value) + rewards
+                # Discounting the next state + reward collected in this state:
+                discounted_target_value = (GAMMA * target_value) + rewards
 
-        # Final state:
-        else:
-            # As there is no next state, we only have the rewards:
-            discounted_target_value = rewards
+            # Final state:
+            else:
+                # As there is no next state, we only have the rewards:
+                discounted_target_value = rewards
 
-        discounted_target_value = discounted_target_value.view(args.batch_size, -1)
+            discounted_target_value = discounted_target_value.view(args.batch_size, -1)
 
-        # Calculating Bellman error:
-        mse_loss = criterion(current_q_values, discounted_target_value)
+            # Calculating Bellman error:
+            mse_loss = criterion(current_q_values, discounted_target_value)
 
-        # Stats:
-        total_loss += mse_loss.data.item()
+            # Stats:
+            total_loss += mse_loss.data.item()
 
-        # Accumulate time-step loss:
-        loss += mse_loss
+            # Accumulate time-step loss:
+            loss += mse_loss
+
+        # Reusing the next timestep's forward pass for the target:
+        else:
+            # Reads happen before writes within a step, so for NTM/LRUA the next step's Q-values
+            # are identical to those of the read_only pass on the same state and hidden state:
+            if previous_q_values is not None:
+                target_value = q_values.max(1)[0].detach()
+                discounted_target_value = ((GAMMA * target_value) + previous_rewards).view(args.batch_size, -1)
+
+                # Calculating Bellman error for the previous timestep:
+                mse_loss = criterion(previous_q_values, discounted_target_value)
+                total_loss += mse_loss.data.item()
+                loss += mse_loss
+
+            # Final state:
+            if i_e == args.episode_size - 1:
+                # As there is no next state, we only have the rewards:
+                mse_loss = criterion(current_q_values, rewards.view(args.batch_size, -1))
+                total_loss += mse_loss.data.item()
+                loss += mse_loss
+
+            previous_q_values = current_q_values
+            previous_rewards = rewards
 
         # Update current state:
         state = next_state_start
@@ -201,9 +232,6 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
         request_dict[key] = sum(request_dict[key]) / len(request_dict[key])
         accuracy_dict[key] = sum(accuracy_dict[key]) / len(accuracy_dict[key])
 
-    # Zero gradients:
-    optimizer.zero_grad()
-
     # Back-propagating:
     loss.backward()
 
@@ -250,24 +278,85 @@ def train(q_network, epoch, optimizer, train_loader, args, reinforcement_learner
     )
 
 
+def act(q_network, sample_batch, label_batch, args, reinforcement_learner, text_dataset):
+    """
+    Runs an episode batch with Epsilon Greedy actions, without learning (the actors of the actor-learner mode).
+    :return: LongTensor (episode_size, batch_size) of actions, FloatTensor (episode_size, batch_size) of rewards.
+    """
+    state = torch.zeros(args.batch_size, args.class_vector_size)
+    hidden = q_network.reset_hidden(args.batch_size)
+    actions = []
+    rewards = []
+
+    with torch.no_grad():
+        for i_e in range(args.episode_size):
+
+            # Collecting the network input, as in train:
+            if text_dataset:
+                episode_labels, episode_samples = label_batch[:, i_e], sample_batch[:, i_e]
+                inputs = episode_samples.long()
+            else:
+                episode_labels, episode_samples = label_batch[i_e], sample_batch[i_e]
+                flat_images = episode_samples.squeeze().view(args.batch_size, -1)
+                state = torch.cat((state, flat_images.float()), 1)
+                inputs = state
+
+            episode_labels = episode_labels.view(args.batch_size)
+
+            q_values, hidden = q_forward(q_network, inputs, hidden, state, text_dataset)
+            agent_actions = reinforcement_learner.select_actions(q_values.max(1)[1].view(args.batch_size),
+                                                                 episode_labels)
+            actions.append(agent_actions)
+            rewards.append(reinforcement_learner.collect_reward_batch(agent_actions, episode_labels))
+
+            state = reinforcement_learner.next_state_batch(agent_actions, episode_labels)
+
+    return torch.stack(actions), torch.stack(rewards)
+
+
+def q_forward(q_network, inputs, hidden, state, text_dataset, read_only=False):
+    # Text inputs get the state as class vector, image inputs already contain it:
+    if text_dataset:
+        return q_network(inputs, hidden, class_vector=state, read_only=read_only, seq=inputs.size()[1])
+    return q_network(inputs, hidden, read_only=read_only)
+
+
+def backward_window(loss, optimizer, args):
+    """
+    Back-propagates the loss of a truncation window, stepping the optimizer if updating per window.
+    :return: The (zero) loss of the next window.
+    """
+    if loss.requires_grad:
+        loss.backward()
+    if args.truncation_update:
+        optimizer.step()
+        optimizer.zero_grad()
+    return torch.zeros_like(loss)
+
+
 def update_dicts(batch_size, episode_labels, rewards, reinforcement_learner, label_dict, request_dict,
                  accuracy_dict):
     predict = 0.0
     request = 0.0
     correct = 0.0
+
+    # Outcome masks of the batch:
+    requested = (rewards == reinforcement_learner.request_reward).tolist()
+    predicted = (rewards == reinforcement_learner.prediction_reward).tolist()
+    true_labels = episode_labels.view(-1).tolist()
+
     for i in range(batch_size):
-        true_label = episode_labels[i].item()
+        true_label = true_labels[i]
 
         # Statistics:
-        reward = rewards[i]
-        if reward == reinforcement_learner.request_reward:
+        if requested[i]:
             request += 1.0
             predict += 1.0
             if label_dict[i][true_label] in request_dict:
                 request_dict[label_dict[i][true_label]].append(1)
             if label_dict[i][true_label] in accuracy_dict:
                 accuracy_dict[label_dict[i][true_label]].append(0)
-        elif reward == reinforcement_learner.prediction_reward:
+        elif predicted[i]:
             correct += 1.0
             predict += 1.0
             if label_dict[i][true_label] in request_dict:
@@ -27,6 +27,34 @@ def parse_arguments(parser):
     parser.add_argument('--class-vector-size', type=int, default=3, metavar='N',
                         help='Number of classes per episode')
 
+    # Bellman target:
+    parser.add_argument('--separate-target', action='store_true', default=False,
+                        help='Computes Bellman targets with a separate read-only forward pass, '
+                             'instead of reusing the next timestep\'s forward pass')
+
+    # Truncated backpropagation through time:
+    parser.add_argument('--truncation', type=int, default=0, metavar='K',
+                        help='Number of timesteps per truncated backpropagation window, the hidden/memory state '
+                             'is detached between windows (0 = whole episode)')
+
+    # Optimizer step per truncation window:
+    parser.add_argument('--truncation-update', action='store_true', default=False,
+                        help='Steps the optimizer after every truncation window, instead of accumulating the '
+                             'gradients of the whole episode')
+
+    # Actor-learner mode:
+    parser.add_argument('--actors', type=int, default=0, metavar='N',
+                        help='Number of actor processes running the episodes with a snapshot of the Q-network, '
+                             'while training only replays them (0 = train on the episodes directly)')
+
+    # Actor weight refresh:
+    parser.add_argument('--actor-refresh', type=int, default=1, metavar='N',
+                        help='Number of epochs between refreshing the Q-network snapshot the actors run with')
+
+    # Actor queue:
+    parser.add_argument('--actor-queue', type=int, default=4, metavar='N',
+                        help='Number of rollouts the actors may run ahead of training')
+
     """
     Text Specific Setup
     """
@@ -38,6 +66,14 @@ def parse_arguments(parser):
     parser.add_argument('--sentence-length', type=int, default=6, metavar='N',
                         help='Number of words in each sentence')
 
+    # Dataloader workers:
+    parser.add_argument('--num-workers', type=int, default=0, metavar='N',
+                        help='Number of DataLoader worker processes assembling episodes')
+
+    # Prefetch depth:
+    parser.add_argument('--prefetch', type=int, default=2, metavar='N',
+                        help='Number of episode batches prepared ahead of the training step (0 = synchronous)')
+
     """
     PyTorch specific parameters:
     """
@@ -49,6 +85,15 @@ def parse_arguments(parser):
     parser.add_argument('--seed', type=int, default=1, metavar='S',
                         help='random seed for predictable RNG behaviour')
 
+    # Data-parallel processes:
+    parser.add_argument('--processes', type=int, default=1, metavar='N',
+                        help='Number of data-parallel training processes on the CPU, each rolling out its own episode '
+                             'batches, with the gradients averaged over the processes (gloo)')
+
+    # Master port:
+    parser.add_argument('--master-port', type=int, default=29500, metavar='P',
+                        help='Local TCP port the data-parallel processes rendezvous on')
+
     """
     Checkpoints- and Result-names:
     """
@@ -79,6 +124,22 @@ def parse_arguments(parser):
     parser.add_argument('--margin-time', type=int, default=4, metavar='S',
                         help='Number of samples per class during margin sampling')
 
+    # Margin index:
+    parser.add_argument('--margin-index', action='store_true', default=False,
+                        help='Keeps a persistent per-class margin index, drawing the margin pool from it')
+
+    # Margin refresh:
+    parser.add_argument('--margin-refresh', type=float, default=0.25, metavar='F',
+                        help='Fraction of the margin pool rescored every epoch when using the margin index')
+
+    # Margin workers:
+    parser.add_argument('--margin-workers', action='store_true', default=False,
+                        help='Scores the margin pool inside the DataLoader workers, on a shared snapshot of the Q-network')
+
+    # Weight refresh:
+    parser.add_argument('--weight-refresh', type=int, default=10, metavar='N',
+                        help='Number of epochs between refreshing the Q-network snapshot used by the margin workers')
+
     """
     Network architecture:
     """
@@ -94,6 +155,24 @@ def parse_arguments(parser):
     parser.add_argument('--LRUA', action='store_true', default=False,
                         help='Enables LRUA as chosen Q-network')
 
+    # Memory slots:
+    parser.add_argument('--memory-slots', type=int, default=128, metavar='N',
+                        help='Number of memory slots of the NTM/LRUA')
+
+    # Sparse memory:
+    parser.add_argument('--sparse-k', type=int, default=0, metavar='K',
+                        help='Enables the sparse NTM/LRUA memory, where every head only accesses its top-K slots')
+
+    # Reversible memory:
+    parser.add_argument('--reversible-memory', action='store_true', default=False,
+                        help='Keeps only the write vectors of every step of the NTM/LRUA memory for backward, '
+                             'reconstructing the earlier memory states from them')
+
+    # Gradient checkpointing:
+    parser.add_argument('--checkpoint-segment', type=int, default=0, metavar='K',
+                        help='Keeps only the hidden/memory state every K timesteps for backward, recomputing the '
+                             'timesteps in between (0 = no checkpointing, dense memory only)')
+
     """
     Dataset:
     """
@@ -72,6 +72,13 @@ def load_checkpoint(q_network, args, best=False, test=False):
                 statistics.statistics['all_margins'] = checkpoint['all_margins']
                 statistics.statistics['low_margins'] = checkpoint['low_margins']
                 statistics.statistics['all_choices'] = checkpoint['all_choices']
+                if 'class_index' in checkpoint:
+                    statistics.statistics['class_index'] = checkpoint['class_index']
+
+            # Actor-learner metrics (not in older checkpoints):
+            if 'staleness' in checkpoint:
+                statistics.statistics['staleness'] = checkpoint['staleness']
+                statistics.statistics['queue_depth'] = checkpoint['queue_depth']
 
             statistics.statistics['best'] = checkpoint['best']
             args.start_epoch = checkpoint['epoch']
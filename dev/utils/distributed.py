@@ -0,0 +1,98 @@
+"""Data-parallel training over several local processes, averaging the gradients with the gloo backend."""
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def init_process(rank, args):
+    """
+    Joins the process group of the args.processes training processes, splitting the CPU cores between them.
+    Every process samples its episodes with its own numpy RNG stream (seed + rank), and only rank 0 reports,
+    the other processes train silently.
+    """
+    dist.init_process_group('gloo', init_method='tcp://127.0.0.1:' + str(args.master_port),
+                            rank=rank, world_size=args.processes)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.processes))
+
+    np.random.seed(args.seed + rank)
+
+    if rank > 0:
+        sys.stdout = open(os.devnull, 'w')
+
+
+def barrier():
+    dist.barrier()
+
+
+def broadcast_state(model):
+    """Copies the parameters and buffers of rank 0's model to the models of the other processes."""
+    for tensor in model.state_dict().values():
+        dist.broadcast(tensor, 0)
+
+
+def average_gradients(parameters):
+    """All-reduces the gradients of the parameters as one flat tensor, averaged over the processes."""
+    parameters = [p for p in parameters if p.requires_grad]
+    grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in parameters]
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+
+    offset = 0
+    for p, g in zip(parameters, grads):
+        numel = g.numel()
+        p.grad = flat[offset:offset + numel].view_as(p)
+        offset += numel
+
+
+class DistributedOptimizer:
+    """
+    Wraps an optimizer so every step first averages the gradients over the processes. All processes step with
+    the same gradients from the same (broadcast) parameters, so their Q-networks stay identical.
+    """
+
+    def __init__(self, optimizer, parameters):
+        self.optimizer = optimizer
+        self.parameters = list(parameters)
+
+    def step(self):
+        average_gradients(self.parameters)
+        self.optimizer.step()
+
+    def __getattr__(self, name):
+        return getattr(self.optimizer, name)
+
+
+class DistributedStatistics:
+    """
+    Wraps the statistics so the training statistics of an epoch are averaged over the processes before being
+    recorded. Wraps instead of subclassing, as creating a Statistics resets the (shared) statistics.
+    """
+
+    def __init__(self, statistics):
+        self.statistics_handler = statistics
+
+    def update(self, stats_dict, dictionaries):
+        keys = sorted(stats_dict.keys())
+        dict_keys = [(name, key) for name in sorted(dictionaries.keys()) for key in sorted(dictionaries[name].keys())]
+
+        values = torch.tensor([float(stats_dict[key]) for key in keys] +
+                              [float(dictionaries[name][key]) for name, key in dict_keys], dtype=torch.float64)
+        dist.all_reduce(values)
+        values = (values / dist.get_world_size()).tolist()
+
+        stats_dict = {key: value for key, value in zip(keys, values)}
+        dictionaries = {name: dict(dictionaries[name]) for name in dictionaries.keys()}
+        for (name, key), value in zip(dict_keys, values[len(keys):]):
+            dictionaries[name][key] = value
+        self.statistics_handler.update(stats_dict, dictionaries)
+
+    def __getattr__(self, name):
+        return getattr(self.statistics_handler, name)
+
+
+def destroy_process():
+    dist.destroy_process_group()
@@ -0,0 +1,112 @@
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+def seed_worker(worker_id):
+    """Gives each DataLoader worker its own NumPy/random streams, derived from its torch seed."""
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+    # Workers may run the Q-network (margin scoring), one thread each avoids oversubscribing the CPU:
+    torch.set_num_threads(1)
+
+
+class EpisodeStream:
+    """
+    Long-lived stream of episode batches drawn from a DataLoader.
+    A single iterator over the loader is kept alive (and restarted when the loader is exhausted), so
+    workers are not respawned every epoch. With prefetch > 0 a background thread assembles up to
+    prefetch batches ahead, overlapping data preparation with the training step.
+    """
+
+    def __init__(self, loader, prefetch=2):
+        """
+        :param loader: The DataLoader to draw episode batches from.
+        :param prefetch: Number of batches prepared ahead (0 draws synchronously).
+        """
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.prefetch = prefetch
+
+        # Timing, for reporting how much of the time is spent waiting on data:
+        self.wait_time = 0.0
+        self.start_time = None
+
+        self.iterator = None
+        self.stopped = threading.Event()
+        if self.prefetch > 0:
+            self.queue = queue.Queue(maxsize=self.prefetch)
+            self.producer = threading.Thread(target=self._produce, daemon=True)
+            self.producer.start()
+
+    def _next_from_loader(self):
+        if self.iterator is None:
+            self.iterator = iter(self.loader)
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            # Loader exhausted, start over:
+            self.iterator = iter(self.loader)
+            return next(self.iterator)
+
+    def _produce(self):
+        while not self.stopped.is_set():
+            try:
+                batch = self._next_from_loader()
+            except Exception as e:
+                # Hand the error over to the consumer:
+                self._put(e)
+                return
+            if not self._put(batch):
+                return
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        wait_start = time.time()
+        if self.prefetch > 0:
+            batch = self.queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+        else:
+            batch = self._next_from_loader()
+        self.wait_time += time.time() - wait_start
+
+        return batch
+
+    def wait_fraction(self):
+        """Fraction of the time since the first batch was requested, spent waiting on data."""
+        if self.start_time is None:
+            return 0.0
+        return self.wait_time / max(time.time() - self.start_time, 1e-8)
+
+    def close(self):
+        """
+        Stops the producer thread, and drops the iterator, so the loader's (persistent) workers shut down.
+        The loader itself can still be iterated afterwards.
+        """
+        self.stopped.set()
+        if self.prefetch > 0:
+            self.producer.join()
+        self.iterator = None
+        # With persistent workers, the loader keeps the iterator (and its workers) too:
+        if getattr(self.loader, 'persistent_workers', False):
+            self.loader._iterator = None
@@ -1,10 +1,8 @@
 import numpy as np
-from PIL import Image
-from matplotlib import pyplot as plt
 import os
 import os.path
 import random
-from scipy.ndimage import imread
+from multiprocessing import Pool
 from PIL import Image
 import errno
 import torch
@@ -16,14 +14,20 @@ class OmniglotLoader():
 	training_file = 'training.pt'
 	test_file = 'test.pt'
 
-	def __init__(self, root, classify=False, partition=0.8, classes=False):
+	# Version of the processed files, bumped whenever their layout changes:
+	version = 2
+
+	def __init__(self, root, classify=False, partition=0.8, classes=False, workers=None):
 		self.root = os.path.expanduser(root)
 		self.classify = classify
+		self.training_file = "v" + str(self.version) + "_" + self.training_file
+		self.test_file = "v" + str(self.version) + "_" + self.test_file
 		if self.classify:
 			self.training_file = "classify_" + self.training_file
 			self.test_file = "classify_" + self.test_file
 		self.partition = partition
 		self.classes = classes
+		self.workers = workers
 		self.load()
 
 
@@ -37,132 +41,158 @@ class OmniglotLoader():
 			return
 
 		# Make dirs
-		try:
-			os.makedirs(os.path.join(self.root, self.raw_folder))
-			os.makedirs(os.path.join(self.root, self.processed_folder))
-		except OSError as e:
-			if e.errno == errno.EEXIST:
-				pass
-			else:
-				raise
-
-		# process and save as torch files
+		for folder in [self.raw_folder, self.processed_folder]:
+			try:
+				os.makedirs(os.path.join(self.root, folder))
+			except OSError as e:
+				if e.errno == errno.EEXIST:
+					pass
+				else:
+					raise
+
+		# Split the image files, then decode every split into one preallocated array:
 		print('Processing training set...')
 		training_set, test_set, label_stop = read_image_file(os.path.join(self.root, self.raw_folder, 'images_background'), label_start=0, partition=self.partition, classes=self.classes)
 		print('Processing evaluation set...')
 		training_set, test_set, label_stop = read_image_file(os.path.join(self.root, self.raw_folder, 'images_evaluation'), training_set=training_set, test_set=test_set,
 		label_start=label_stop, partition=self.partition, classes=self.classes)
 
-		print("SHAPE: ", torch.ByteTensor(training_set[0]).size())
+		# The arrays are memory-mapped files, removed again once the datasets are written:
+		training_file = os.path.join(self.root, self.processed_folder, self.training_file + ".images.npy")
+		test_file = os.path.join(self.root, self.processed_folder, self.test_file + ".images.npy")
 		self.training_set = (
-			torch.ByteTensor(training_set[0]),
+			decode_images(training_set[0], training_file, classes=self.classes, workers=self.workers),
 			torch.LongTensor(training_set[1])
 		)
 		self.test_set = (
-			torch.ByteTensor(test_set[0]),
+			decode_images(test_set[0], test_file, classes=self.classes, workers=self.workers),
 			torch.LongTensor(test_set[1])
 		)
-		#print("LOADING: ", self.training_set[0][0])
+		print("SHAPE: ", self.training_set[0].size())
+
+		self.write_datasets()
+		os.remove(training_file)
+		os.remove(test_file)
 
 		print('Done!')
 
+	def write_datasets(self):
+		with open(os.path.join(self.root, self.processed_folder, self.training_file), 'wb') as f:
+			torch.save(self.training_set, f)
+		with open(os.path.join(self.root, self.processed_folder, self.test_file), 'wb') as f:
+			torch.save(self.test_set, f)
+
 	def get_training_set(self):
 		return self.training_set
 
 	def get_test_set(self):
 		return self.test_set
 
+
+# Decodes the images of one class folder into its rows of the (memory-mapped) array:
+def read_class_images(task):
+	filename, start, paths = task
+	images = np.load(filename, mmap_mode='r+')
+	for i, path in enumerate(paths):
+		image = np.asarray(Image.open(path), dtype=np.uint8)
+		assert(image.shape == (105, 105))
+		images[start + i] = image
+	images.flush()
+
+# Decodes the class folders (lists of image files) into one uint8 array, sized from the file lists:
+def decode_images(class_files, filename, classes=False, workers=None):
+	rows = sum(len(paths) for paths in class_files)
+	images = np.lib.format.open_memmap(filename, mode='w+', dtype=np.uint8, shape=(rows, 105, 105))
+	del images
+
+	# Every class folder fills its own slice, decoded in parallel:
+	tasks = []
+	start = 0
+	for paths in class_files:
+		tasks.append((filename, start, paths))
+		start += len(paths)
+	pool = Pool(workers)
+	try:
+		pool.map(read_class_images, tasks)
+	finally:
+		pool.close()
+		pool.join()
+
+	images = np.load(filename, mmap_mode='r+')
+	# Split by classes, every class is one (samples, 105, 105) entry:
+	if classes:
+		images = images.reshape(len(class_files), -1, 105, 105)
+	return torch.from_numpy(images)
+
 # Need to ensure a uniformly distributed training/test-set:
 def read_image_file(path, training_set=None, test_set=None, label_start=0, partition=0.8, classes=False):
-	images = []
-	size = 105
-	uniform_distr = {}
-	label_dict = {}
-	labels = []
-	label = label_start
-	curr_dir = ""
+	# Collect the image files of each class folder (folders with fewer than 20 images are skipped):
+	class_files = []
 	for (root, dirs, files) in os.walk(path):
+		if len(files) < 20:
+			if len(files) > 0:
+				print("Length: ", len(files))
+			continue
+		pngs = [os.path.join(root, f) for f in files if f.endswith(".png")]
+		if len(pngs) > 0:
+			class_files.append(pngs)
 
-		for f in files:
-			if (f.endswith(".png")):
-			# Reading image file:
-				if len(files) < 20:
-					print("Length: ", len(files))
-					break
-				#image = imread(os.path.join(root, f), flatten=True)
-				image = np.array(Image.open(os.path.join(root, f)))
-				if root not in label_dict:
-					label_dict[root] = label
-					label += 1
-	
-				assert(image.shape == (105, 105))
-
-				if label_dict[root] not in uniform_distr:
-					uniform_distr[label_dict[root]] = [image.astype(int).tolist()]
-				else:
-					uniform_distr[label_dict[root]].append(image.astype(int).tolist())
-	return create_datasets(uniform_distr, training_set=training_set, test_set=test_set, partition=partition, shuffle=True, classes=classes)
-
+	uniform_distr = {}
+	label = label_start
+	for paths in class_files:
+		uniform_distr[label] = paths
+		label += 1
+	return create_datasets(uniform_distr, training_set=training_set, test_set=test_set, partition=partition, shuffle=True, classes=classes, label_stop=label)
+
+
+# The splits hold the image files of every class (in the order the images are decoded), and the labels:
+def create_datasets(file_dictionary, training_set=None, test_set=None, partition=0.8, shuffle=True, classes=False, label_stop=0):
+	if training_set == None:
+		training_files = []
+		training_labels = []
+		test_files = []
+		test_labels = []
+	else:
+		training_files, training_labels = training_set
+		test_files, test_labels = test_set
 
-def create_datasets(image_dictionary, training_set=None, test_set=None, partition=0.8, shuffle=True, classes=False):
 	# Splitting the dataset into two parts with completely different EXAMPLES, but same CLASSES:
 	if not classes:
-		if training_set == None:
-			training_labels = []
-			training_images = []
-			test_labels = []
-			test_images = []
-		else:
-			training_images, training_labels = training_set
-			test_images, test_labels = test_set
-
-		# Create dataset from the collected images:
-		for label in image_dictionary.keys():
-			imgs = image_dictionary[label]
+		for label in file_dictionary.keys():
+			paths = file_dictionary[label]
 			if shuffle:
-				random.shuffle(imgs)
-			split = int(partition*len(imgs))
-
-			#Train set:
-			for i in range(split):
-				training_images.append(imgs[i])
-				training_labels.append(int(label))
-			#Test set:
-			for i in imgs[split:]:
-				test_images.append(i)
-			for i in range(len(imgs)-split):
-				test_labels.append(int(label))
+				paths = [paths[i] for i in np.random.permutation(len(paths))]
+			split = int(partition*len(paths))
+
+			# Train set:
+			training_files.append(paths[:split])
+			training_labels += [int(label)]*split
+			# Test set:
+			test_files.append(paths[split:])
+			test_labels += [int(label)]*(len(paths) - split)
 
 	# Splitting the dataset into two parts with completely different CLASSES:
 	else:
-		all_images = []
+		all_files = []
 		all_labels = []
-		if training_set != None:
-			training_images, training_labels = training_set
-			test_images, test_labels = test_set
-		else:
-			training_images = []
-			training_labels = []
-			test_images = []
-			test_labels = []
-		for label in image_dictionary.keys():
-			all_images.append(image_dictionary[label])
+		for label in file_dictionary.keys():
+			all_files.append(file_dictionary[label])
 			all_labels.append(label)
 
 		split = int(len(all_labels)*partition)
 
-		shuffle_list = list(zip(all_images, all_labels))
+		shuffle_list = list(zip(all_files, all_labels))
 		random.shuffle(shuffle_list)
-		shuffled_images, shuffled_labels = zip(*shuffle_list)
-		
+		shuffled_files, shuffled_labels = zip(*shuffle_list)
+
 		for i in range(split):
-			training_images.append(shuffled_images[i])
+			training_files.append(shuffled_files[i])
 			training_labels.append(shuffled_labels[i])
 
-		for i in range(split, len(shuffled_images)):
-			test_images.append(shuffled_images[i])
+		for i in range(split, len(shuffled_files)):
+			test_files.append(shuffled_files[i])
 			test_labels.append(shuffled_labels[i])
 
-	print("Length of training set: ", len(training_images), "\nLength of test set: ", len(test_images))
+	print("Length of training set: ", len(training_labels), "\nLength of test set: ", len(test_labels))
 	print("Nof. Classes in training set: ", len(list(set(training_labels))), "\nNof. Classes in test set: ", len(list(set(test_labels))))
-	return (training_images, training_labels), (test_images, test_labels), label
\ No newline at end of file
+	return (training_files, training_labels), (test_files, test_labels), label_stop
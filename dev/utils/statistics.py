@@ -50,6 +50,10 @@ class Statistics:
         self.statistics['low_margins'] = []
         self.statistics['all_choices'] = []
 
+        # Actor-learner mode:
+        self.statistics['staleness'] = []
+        self.statistics['queue_depth'] = []
+
         self.statistics['best'] = -30
         self.statistics['epoch'] = 1
 
@@ -89,17 +89,17 @@ class StatusHandler:
     stats_directory = 'results/stats/'
 
     def __init__(self, args):
-        self.episode = (args.start_epoch - 1) * args.batch_size
+        # Episodes of all the data-parallel processes:
+        self.episode = (args.start_epoch - 1) * args.batch_size * args.processes
         self.epochs = args.epochs
-        self.batch_size = args.batch_size
+        self.batch_size = args.batch_size * args.processes
         self.elapsed_time = 0
         self.name = args.name
         self.setup_folders()
 
     def setup_folders(self):
         # Set up result directory
-        if not os.path.exists(self.stats_directory):
-            os.makedirs(self.stats_directory)
+        os.makedirs(self.stats_directory, exist_ok=True)
 
     def update_status(self, epoch, statistics):
         self.episode += self.batch_size
@@ -166,6 +166,13 @@ def generate_name_from_args(args, text):
     if args.margin_sampling:
         cms = "_CMS_(size_" + str(args.margin_size) + "_time_" + str(args.margin_time) + ")"
 
+    # Memory (only when not the default dense memory)
+    memory = ""
+    if not args.LSTM and (args.memory_slots != 128 or args.sparse_k > 0):
+        memory = "_mem_" + str(args.memory_slots)
+        if args.sparse_k > 0:
+            memory += "_sparse_" + str(args.sparse_k)
+
     # Batch_size
     batch_size = "_bsize_" + str(args.batch_size)
 
@@ -190,4 +197,4 @@ def generate_name_from_args(args, text):
 
     postfix = args.name_postfix
 
-    return model + data_set + cms + batch_size + c_size + text_string + postfix
+    return model + data_set + cms + memory + batch_size + c_size + text_string + postfix
@@ -0,0 +1,132 @@
+from __future__ import print_function
+import os
+import os.path
+import numpy as np
+import torch
+
+
+class PackedText:
+    """
+    Text dataset packed into flat, memory-mapped arrays:
+    - tokens: all sentences concatenated, without their zero padding (uint16 when the vocabulary fits, else int32).
+    - sentence_offsets: start of every sentence in tokens (+ end).
+    - document_offsets: first sentence of every document (+ end).
+    - class_offsets: first document of every class (+ end).
+    - labels: the label of every class.
+    Reading sentences is plain indexing, so no Python objects are created per document.
+    """
+    arrays = ['tokens', 'sentence_offsets', 'document_offsets', 'class_offsets', 'labels']
+
+    def __init__(self, folder, name):
+        """
+        :param folder: Folder holding the processed dataset.
+        :param name: Prefix of the packed files (e.g. training_12_300_fast).
+        """
+        self.files = {array: os.path.join(folder, name + "_" + array + ".npy") for array in self.arrays}
+        self.tokens = None
+        self.sentence_offsets = None
+        self.document_offsets = None
+        self.class_offsets = None
+        self.labels = None
+
+    def exists(self):
+        return all(os.path.exists(f) for f in self.files.values())
+
+    def build(self, texts, labels):
+        """
+        :param texts: List (classes) of lists (documents) of lists (sentences) of LongTensors (sentence_length).
+        :param labels: List of the class labels.
+        """
+        print("Packing text dataset " + self.files['tokens'] + "...")
+        sentences = []
+        sentence_offsets = [0]
+        document_offsets = [0]
+        class_offsets = [0]
+        for documents in texts:
+            for document in documents:
+                for sentence in document:
+                    # Stripping the padding:
+                    sentence = np.trim_zeros(np.asarray(sentence), 'b')
+                    sentences.append(sentence)
+                    sentence_offsets.append(sentence_offsets[-1] + len(sentence))
+                document_offsets.append(len(sentences))
+            class_offsets.append(len(document_offsets) - 1)
+
+        tokens = np.concatenate(sentences) if len(sentences) > 0 else np.zeros(0)
+        dtype = np.uint16 if len(tokens) == 0 or tokens.max() < 2 ** 16 else np.int32
+        packed = {'tokens': tokens.astype(dtype),
+                  'sentence_offsets': np.asarray(sentence_offsets, dtype=np.int64),
+                  'document_offsets': np.asarray(document_offsets, dtype=np.int64),
+                  'class_offsets': np.asarray(class_offsets, dtype=np.int64),
+                  'labels': np.asarray(labels, dtype=np.int64)}
+
+        # Written to temporary files first, so an interrupted build is never picked up:
+        for array in self.arrays:
+            with open(self.files[array] + ".tmp", 'wb') as f:
+                np.save(f, packed[array])
+        for array in self.arrays:
+            os.replace(self.files[array] + ".tmp", self.files[array])
+
+        print("Text dataset successfully packed...")
+
+    def load(self):
+        self.tokens = np.load(self.files['tokens'], mmap_mode='r')
+        self.sentence_offsets = np.load(self.files['sentence_offsets'], mmap_mode='r')
+        self.document_offsets = np.load(self.files['document_offsets'], mmap_mode='r')
+        self.class_offsets = np.load(self.files['class_offsets'])
+        self.labels = np.load(self.files['labels'])
+        return self
+
+    def __len__(self):
+        return len(self.labels)
+
+    def class_sizes(self):
+        return np.diff(self.class_offsets)
+
+    def class_size(self, c):
+        return int(self.class_offsets[c + 1] - self.class_offsets[c])
+
+    def sentences(self, classes, documents, sentence_length, sentence=0):
+        """
+        Gathers one sentence of each of the given documents.
+        :param classes: Array of class indexes.
+        :param documents: Array (same shape) of document indexes within their class.
+        :param sentence_length: Length the sentences are padded (or cut) to.
+        :param sentence: Which sentence of each document.
+        :return: LongTensor (*classes.shape, sentence_length).
+        """
+        classes = np.asarray(classes, dtype=np.int64)
+        documents = self.class_offsets[classes] + np.asarray(documents, dtype=np.int64)
+        sentences = self.document_offsets[documents.reshape(-1)] + sentence
+
+        starts = self.sentence_offsets[sentences]
+        lengths = np.minimum(self.sentence_offsets[sentences + 1] - starts, sentence_length)
+        positions = np.arange(sentence_length)
+        mask = positions[None, :] < lengths[:, None]
+
+        # Padding positions read the first token, and are zeroed after:
+        tokens = self.tokens[np.where(mask, starts[:, None] + positions[None, :], 0)]
+        tokens = np.where(mask, tokens, 0).astype(np.int64)
+
+        return torch.from_numpy(tokens).view(*(classes.shape + (sentence_length,)))
+
+
+def sample_distinct(sizes, k):
+    """
+    Draws k distinct indexes in [0, size) for every given size, in random order.
+    :param sizes: Array of (class) sizes, all >= k.
+    :param k: Number of indexes drawn per size.
+    :return: Array (*sizes.shape, k) of indexes.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    # Else the indexes run past the class, into the next one:
+    assert (sizes >= k).all(), "Fewer than " + str(k) + " indexes to draw from"
+    picks = np.zeros(sizes.shape + (k,), dtype=np.int64)
+    for i in range(k):
+        # Drawing among the (size - i) remaining indexes, then skipping past the ones already taken:
+        pick = (np.random.rand(*sizes.shape) * (sizes - i)).astype(np.int64)
+        taken = np.sort(picks[..., 0:i], axis=-1)
+        for j in range(i):
+            pick += (pick >= taken[..., j])
+        picks[..., i] = pick
+    return picks
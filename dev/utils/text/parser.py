@@ -1,8 +1,9 @@
 import os
 import re
-import operator
+import heapq
 import torch
 import numpy as np
+from multiprocessing import Pool
 from utils.text import pattern_repl as pr
 
 import nltk
@@ -25,6 +26,9 @@ from nltk.stem.porter import PorterStemmer
 porter = PorterStemmer()
 stop = set(stopwords.words("english"))
 
+# Number of files each worker tokenizes at a time:
+SHARD_SIZE = 500
+
 
 class Dictionary(object):
     def __init__(self):
@@ -44,45 +48,83 @@ class Dictionary(object):
 
 
 class Corpus(object):
-    def __init__(self, max_size, root, stopwords=True):
+    def __init__(self, max_size, root, stopwords=True, dictionary_file=None, workers=None):
+        """
+        :param max_size: Number of (most frequent) words kept in the dictionary.
+        :param root: Folder holding the raw text files.
+        :param stopwords: Whether stopwords are removed while parsing.
+        :param dictionary_file: If given, the dictionary is loaded from (or persisted to) this file.
+        :param workers: Number of tokenizing processes (default: number of CPUs).
+        """
         self.root = root
         self.stopwords = stopwords
-        self.dictionary = Dictionary()
-        self.tokenize(max_size)
+        self.workers = workers
+        if dictionary_file is not None and os.path.exists(dictionary_file):
+            print("Loading dictionary from " + dictionary_file)
+            self.dictionary = Dictionary()
+            for word in torch.load(dictionary_file)[1:]:
+                self.dictionary.add_word(word)
+        else:
+            self.dictionary = Dictionary()
+            self.tokenize(max_size)
+            if dictionary_file is not None:
+                torch.save(self.dictionary.idx2word, dictionary_file)
 
     # Tokenizing files to create the dictionaries:
     def tokenize(self, max_size):
 
         print("Reading from " + self.root)
-        files = return_all_data_from_file(self.root)
+        files = return_all_files(self.root)
+        shards = [(files[s:s + SHARD_SIZE], self.stopwords) for s in range(0, len(files), SHARD_SIZE)]
 
         lenghts = 0.0
         i = 0.0
 
+        # Partial counts are merged in file order, so the insertion order equals a sequential pass:
         word_counts = {}
-        print("Creating Dictionary from File...")
-        for f in range(len(files)):
-            if f % 1000 == 0:
-                print("Reading [" + str(f) + "/" + str(len(files)) + "] files...")
-            file = files[f]
-            for line in file.split("\n"):
+        print("Creating Dictionary from " + str(len(files)) + " files...")
+        pool = Pool(self.workers)
+        try:
+            for s, (shard_counts, shard_lengths, shard_lines) in enumerate(pool.imap(count_words, shards)):
+                if (s * SHARD_SIZE) % 1000 == 0:
+                    print("Reading [" + str(s * SHARD_SIZE) + "/" + str(len(files)) + "] files...")
+                lenghts += shard_lengths
+                i += shard_lines
+                for word, count in shard_counts.items():
+                    word_counts[word] = word_counts.get(word, 0) + count
+        finally:
+            pool.close()
+            pool.join()
+
+        print("Average length of sentences: ", (lenghts/max(i, 1.0)))
+        # Keeping the MAX_LENGTH most words (equal counts: the latest first occurrence goes first, as before):
+        most_common = heapq.nlargest(max_size, enumerate(word_counts.items()),
+                                     key=lambda item: (item[1][1], item[0]))
+        for _, (word, freq) in most_common:
+            self.dictionary.add_word(word)
+
+
+# Counting the words in a shard of files (run in a worker process):
+def count_words(shard):
+    """
+    :param shard: Tuple of (list of file paths, stopwords).
+    :return: Word counts (in order of first occurrence), total number of words and number of lines.
+    """
+    paths, stopwords = shard
+    word_counts = {}
+    lenghts = 0
+    lines = 0
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file.read().split("\n"):
                 if len(line) <= 1:
                     continue
-                words = parse(line, self.stopwords)
+                words = parse(line, stopwords)
                 lenghts += len(words)
-                i += 1
+                lines += 1
                 for word in words:
-                    if word not in word_counts:
-                        word_counts[word] = 1
-                    else:
-                        word_counts[word] += 1
-
-        print("Average length of sentences: ", (lenghts/i))
-        # Keeping the MAX_LENGTH most words:
-        sorted_counts = sorted(word_counts.items(), key=operator.itemgetter(1))
-        sorted_counts.reverse()
-        for (word, freq) in sorted_counts[0:max_size]:
-            self.dictionary.add_word(word)
+                    word_counts[word] = word_counts.get(word, 0) + 1
+    return word_counts, lenghts, lines
 
 
 # Parsing a sentence (removing punctuation --> stopwords --> stemming):
@@ -111,18 +153,16 @@ def parse(sentence, stopwords):
     return res
 
 
-# Returns all data from a path
-def return_all_data_from_file(path):
-    all_words = []
+# Returns the paths of all data files in a path
+def return_all_files(path):
+    all_files = []
     print("Loading from path: ", path)
     for root, dirs, files in os.walk(path):
         if len(files) >= 10:
             for file in files:
                 if ".DS_Store" not in file:
-                    new_file = open(os.path.join(root, file), "r")
-                    new_file = new_file.read()
-                    all_words.append(new_file)
-    return all_words
+                    all_files.append(os.path.join(root, file))
+    return all_files
 
 
 def create_word_vectors(words, sen_len, corpus):
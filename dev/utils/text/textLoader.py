@@ -5,6 +5,7 @@ import random
 import errno
 import torch
 from utils.text import parser
+from utils.text.packed_text import PackedText
 
 
 class TextLoader:
@@ -13,6 +14,7 @@ class TextLoader:
     training_file = 'training'
     test_file = 'test'
     word_vector_file = 'word_vectors'
+    dictionary_file = 'dictionary'
 
     def __init__(self, data_loader, root, classify=True, partition=0.8, classes=False, dictionary_max_size=5000,
                  sentence_length=16, stopwords=True, embedding_size=200, glove=False):
@@ -32,18 +34,19 @@ class TextLoader:
 
         # Collecting the correct dataset in regards to parameters
         self.training_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
-                              + "_" + str(self.pretrained_vectors) + ".pt"
+                              + "_" + str(self.pretrained_vectors)
         self.test_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
-                          + "_" + str(self.pretrained_vectors) + ".pt"
+                          + "_" + str(self.pretrained_vectors)
         self.word_vector_file += "_" + str(sentence_length) + "_" + str(embedding_size)\
                                  + "_" + str(self.pretrained_vectors) + ".pt"
+        self.dictionary_file += "_" + str(dictionary_max_size) + "_" + str(stopwords) + ".pt"
 
         self.load()
 
     def _check_exists(self):
         print(os.path.join(self.root, self.processed_folder, self.training_file))
-        return os.path.exists(os.path.join(self.root, self.processed_folder, self.training_file)) and \
-               os.path.exists(os.path.join(self.root, self.processed_folder, self.test_file))
+        return PackedText(os.path.join(self.root, self.processed_folder), self.training_file).exists() and \
+            PackedText(os.path.join(self.root, self.processed_folder), self.test_file).exists()
 
     def load(self):
 
@@ -67,7 +70,8 @@ class TextLoader:
             read_text_file(self.data_loader, os.path.join(self.root, self.raw_folder),
                            label_start=0, partition=self.partition, classes=self.classes,
                            dict_max_size=self.dictionary_max_size, sentence_length=self.sentence_length,
-                           stopwords=self.stopwords, embedding_size=self.embedding_size)
+                           stopwords=self.stopwords, embedding_size=self.embedding_size,
+                           dictionary_file=os.path.join(self.root, self.processed_folder, self.dictionary_file))
 
         self.training_set = (
             training_set[0],
@@ -98,22 +102,27 @@ class TextLoader:
 
 # Need to ensure a uniformly distributed training/test-set:
 def read_text_file(data_loader, path, training_set=None, test_set=None, label_start=0, partition=0.8, classes=False,
-                   dict_max_size=5000, sentence_length=16, stopwords=False, embedding_size=200):
+                   dict_max_size=5000, sentence_length=16, stopwords=False, embedding_size=200, dictionary_file=None):
     # Create a dictionary first:
-    word_dictionary = parser.Corpus(dict_max_size, path, stopwords)
-    pretrained_word_vectors = data_loader.dictionary.word2idx
+    word_dictionary = parser.Corpus(dict_max_size, path, stopwords, dictionary_file=dictionary_file)
+    pretrained_word_vectors = data_loader.word_vectors
 
-    # + 2 because (0 => padding (in case sentence not containing enough words), max + 1 => OOV token:
-    matrix_len = len(word_dictionary.dictionary.idx2word) + 2
+    # The rows are the token ids: 0 => padding (in case sentence not containing enough words), the dictionary words,
+    # then len(idx2word) => OOV token:
+    matrix_len = len(word_dictionary.dictionary.idx2word) + 1
     embedding_weight_matrix = np.zeros((matrix_len, embedding_size))
-    words_found = 0
 
     embedding_weight_matrix[0] = np.random.normal(scale=0.0, size=(embedding_size,))
     embedding_weight_matrix[-1] = np.random.normal(scale=0.6, size=(embedding_size,))
-    for i, word in enumerate(word_dictionary.dictionary.idx2word):
-        if word in pretrained_word_vectors:
-            embedding_weight_matrix[i + 1] = pretrained_word_vectors[word]
-            words_found += 1
+
+    # Only the words in the dictionary are resolved (in one search), and only their rows read. Word idx2word[j] is
+    # token j, so its vector goes to row j (the padding row is kept):
+    rows = pretrained_word_vectors.find(word_dictionary.dictionary.idx2word)
+    rows[0] = -1
+    found = np.flatnonzero(rows >= 0)
+    words_found = len(found)
+    if words_found > 0:
+        embedding_weight_matrix[found] = pretrained_word_vectors.vectors_at(rows[found])
 
     print("Created dictionary of size: ", len(embedding_weight_matrix))
     print("Percentage words found in Pretrained Vectors: ", (100.0 * words_found) / len(embedding_weight_matrix))
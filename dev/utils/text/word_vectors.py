@@ -0,0 +1,130 @@
+from __future__ import print_function
+import io
+import os
+import os.path
+import numpy as np
+
+
+class WordVectorStore:
+    """
+    Pretrained word vectors converted once into a float32 matrix, kept in a memory-mapped .npy file, and a
+    vocabulary file (one word per line, line number = row). The vocabulary is indexed by a sorted (memory-mapped)
+    array of the utf-8 encoded words and their rows, so words are resolved with a binary search instead of a
+    dictionary over the whole vocabulary. Only the rows that are looked up are read.
+    """
+
+    def __init__(self, folder, name):
+        """
+        :param folder: Folder the converted files are written to.
+        :param name: Prefix of the converted files (e.g. fast, glove_200).
+        """
+        self.vector_file = os.path.join(folder, name + "_vectors.npy")
+        self.vocabulary_file = os.path.join(folder, name + "_vocabulary.txt")
+        self.word_file = os.path.join(folder, name + "_words.npy")
+        self.row_file = os.path.join(folder, name + "_rows.npy")
+        self.vectors = None
+        self.words = None
+        self.rows = None
+
+    def exists(self):
+        return os.path.exists(self.vector_file) and os.path.exists(self.vocabulary_file)
+
+    def build(self, lines, size, dim):
+        """
+        One-time conversion of a text vector file.
+        :param lines: Iterable of "word v_1 ... v_dim" lines.
+        :param size: Number of lines (upper bound on the number of rows).
+        :param dim: Dimension of the word vectors.
+        """
+        print("Converting word vectors to " + self.vector_file + "...")
+
+        # Written to temporary files first, so an interrupted conversion is never picked up:
+        temporary_vector_file = self.vector_file + ".tmp"
+        temporary_vocabulary_file = self.vocabulary_file + ".tmp"
+        vectors = np.lib.format.open_memmap(temporary_vector_file, mode='w+', dtype=np.float32, shape=(size, dim))
+        row = 0
+        with io.open(temporary_vocabulary_file, 'w', encoding='utf-8', newline='\n') as vocabulary:
+            for line in lines:
+                tokens = line.rstrip().split(' ')
+                if len(tokens) != dim + 1 or row >= size:
+                    continue
+                vectors[row] = np.asarray(tokens[1:], dtype=np.float32)
+                vocabulary.write(tokens[0] + "\n")
+                row += 1
+                if row % 100000 == 0:
+                    print("Converting word vector [" + str(row) + "/" + str(size) + "]")
+        vectors.flush()
+        del vectors
+        os.replace(temporary_vector_file, self.vector_file)
+        os.replace(temporary_vocabulary_file, self.vocabulary_file)
+        self.build_index()
+
+        print("Word vectors successfully converted...")
+
+    def build_index(self):
+        """One-time sort of the vocabulary file into the word and row arrays."""
+        print("Indexing vocabulary " + self.vocabulary_file + "...")
+        with io.open(self.vocabulary_file, 'r', encoding='utf-8', newline='\n') as vocabulary:
+            words = np.array([word[:-1].encode('utf-8') for word in vocabulary], dtype=np.bytes_)
+        order = np.argsort(words, kind='stable')
+        words = words[order]
+
+        # The first occurrence of a word wins (as with Dictionary.add_word), the stable sort keeps it first:
+        first = np.ones(len(words), dtype=bool)
+        first[1:] = words[1:] != words[:-1]
+
+        np.save(self.row_file, order[first].astype(np.int64))
+        np.save(self.word_file, words[first])
+
+    def load(self):
+        # Stores converted before the index existed are indexed once:
+        if not (os.path.exists(self.word_file) and os.path.exists(self.row_file)):
+            self.build_index()
+        self.vectors = np.load(self.vector_file, mmap_mode='r')
+        self.words = np.load(self.word_file, mmap_mode='r')
+        self.rows = np.load(self.row_file, mmap_mode='r')
+        return self
+
+    def find(self, words):
+        """
+        :param words: List of words.
+        :return: int64 array of the rows of the words, -1 for words not in the vocabulary.
+        """
+        keys = np.array([word.encode('utf-8') for word in words], dtype=np.bytes_)
+        if len(self.words) == 0 or len(keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.words, keys), len(self.words) - 1)
+        return np.where(self.words[positions] == keys, self.rows[positions], -1).astype(np.int64)
+
+    def __contains__(self, word):
+        return self.find([word])[0] >= 0
+
+    def __getitem__(self, word):
+        row = self.find([word])[0]
+        if row < 0:
+            raise KeyError(word)
+        return int(row)
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, words):
+        """
+        :param words: List of words, all in the vocabulary.
+        :return: float32 array (len(words), dim) of their vectors.
+        """
+        rows = self.find(words)
+        if (rows < 0).any():
+            raise KeyError(words[int(np.argmax(rows < 0))])
+        return self.vectors_at(rows)
+
+    def vectors_at(self, rows):
+        """
+        :param rows: int64 array of rows (see find).
+        :return: float32 array (len(rows), dim) of their vectors.
+        """
+        # Reading the rows in file order:
+        order = np.argsort(rows, kind='stable')
+        vectors = np.empty((len(rows), self.vectors.shape[1]), dtype=np.float32)
+        vectors[order] = self.vectors[rows[order]]
+        return vectors
@@ -15,7 +15,6 @@ from torch.utils.data import DataLoader
 from utils import loss_plot, batch_scatterplot as scatterplot, transforms, loader, logger, matrix_plot
 from omniglot import OMNIGLOT
 from baseline import model, validate, train_truncated as train
-from reinforcement import ReplayMemory as memory
 
 
 # Training settings
@@ -286,8 +285,6 @@ if __name__ == '__main__':
                 print("\n\n--- Test epoch " + str(epoch) + " ---\n\n")
                 validate.validate(model, epoch, optimizer, test_loader, args, logger, test_acc_dict, episode, criterion)
 
-            #memory.flush()
-
             ### SAVING CHECKPOINT ###
             save_checkpoint({
                 'epoch': epoch + 1,
@@ -13,12 +13,13 @@ from torch.utils.data import DataLoader
 
 ### CLASSES ###
 from utils import loss_plot, batch_scatterplot as scatterplot, transforms, loader, logger
-from reinforcement import ReinforcementLearning as rl
+from reinforcement import ReinforcementLearning as rl, ReplayMemory
 from omniglot import OMNIGLOT
 
 import model
 import validate
 import train_batch_sum as train
+import train as replay_train
 
 
 ### IMPORTANT NOTICE ###
@@ -78,6 +79,18 @@ parser.add_argument('--seed', type=int, default=1, metavar='S',
 parser.add_argument('--log-interval', type=int, default=50, metavar='N',
                     help='how many batches to wait before logging training status')
 
+# Replay memory:
+parser.add_argument('--replay-memory', type=int, default=0, metavar='N',
+                    help='trains on traces sampled from a replay memory of N transitions (default: 0, off)')
+
+# Prioritized replay:
+parser.add_argument('--prioritized', action='store_true', default=False,
+                    help='samples the replay memory traces by their TD error')
+
+# Replay memory spill directory:
+parser.add_argument('--spill-directory', default=None, type=str,
+                    help='keeps the replay memory states in memory-mapped files in this directory')
+
 
 # Saves checkpoint to disk
 def save_checkpoint(state, filename='checkpoint.pth.tar'):
@@ -241,6 +254,12 @@ if __name__ == '__main__':
     # Modules:
     rl = rl(OUTPUT_CLASSES)
 
+    # Replay memory, of the states (label vector and image) of whole episodes:
+    memory = None
+    if args.replay_memory > 0:
+        memory = ReplayMemory(args.replay_memory, OUTPUT_CLASSES + IMAGE_SIZE, trace_length=args.episode_size,
+                              prioritized=args.prioritized, spill_directory=args.spill_directory, seed=args.seed)
+
     if args.cuda:
         print("\n---Activating GPU Training---\n")
         model.cuda()
@@ -295,7 +314,10 @@ if __name__ == '__main__':
 
             ### TRAINING ###
             print("\n\n--- Training epoch " + str(epoch) + " ---\n\n")
-            prediction_accuracy, requests, accuracy, loss, reward, req_dict, acc_dict = train.train(model, epoch, optimizer, train_loader, args, logger, rl, req_dict, acc_dict, episode, criterion)
+            if memory is not None:
+                prediction_accuracy, requests, accuracy, loss, reward, req_dict, acc_dict = replay_train.train(model, epoch, optimizer, train_loader, args, logger, rl, req_dict, acc_dict, episode, memory)
+            else:
+                prediction_accuracy, requests, accuracy, loss, reward, req_dict, acc_dict = train.train(model, epoch, optimizer, train_loader, args, logger, rl, req_dict, acc_dict, episode, criterion)
             episode += args.batch_size
 
             # STATS:
@@ -334,6 +356,10 @@ if __name__ == '__main__':
         except:
             done = True
 
+    # Removing the spilled replay memory:
+    if memory is not None:
+        memory.close()
+
     scatterplot.plot(acc_dict, args.name + "/", args.batch_size, title="Prediction Accuracy")
     scatterplot.plot(req_dict, args.name + "/", args.batch_size, title="Total Requests")
     
@@ -1,8 +1,11 @@
+import os
 import random
 import math
+import shutil
+import tempfile
 import torch
 from torch.autograd import Variable
-from transition import Transition
+from transition import Transition, Traces
 from torch import FloatTensor
 import numpy as np
 
@@ -105,54 +108,207 @@ class ReinforcementLearning():
         return states
 
 
+# Sum-tree over the priorities of the transitions, for prioritized sampling:
+class SumTree(object):
+
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = torch.zeros(2 * self.leaves, dtype=torch.float64)
+
+    def total(self):
+        return self.tree[1].item()
+
+    def get(self, indices):
+        return self.tree[indices + self.leaves]
+
+    def update(self, indices, values):
+        """Sets the priorities of the (unique) indices, and the sums above them."""
+        nodes = indices + self.leaves
+        self.tree[nodes] = values.double()
+        for _ in range(self.depth):
+            nodes = torch.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """Indices of the leaves where the cumulative priorities reach the values (all at once, level by level)."""
+        values = values.double()
+        nodes = torch.ones(values.size(0), dtype=torch.long)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            right = values >= left_sum
+            values = values - left_sum * right.double()
+            nodes = left + right.long()
+        return nodes - self.leaves
+
+
 # Stored observed transitions used for optimizing the model:
 class ReplayMemory(object):
-    
-    def __init__(self, capacity, episode_capacity):
+    """
+    Preallocated ring buffer of transitions, in fixed-shape tensor columns: state, action, reward, next state,
+    done and episode id. Whole episodes are pushed at once and stored contiguously, so a trace (trace_length
+    consecutive transitions of one episode) is a range of rows, and a batch of traces is sampled and gathered
+    with a few tensor operations.
+    """
+
+    def __init__(self, capacity, state_size, trace_length=30, prioritized=False, alpha=0.6,
+                 spill_directory=None, seed=None):
+        """
+        :param capacity: Number of transitions kept (the oldest are overwritten).
+        :param state_size: Size of the (flat) states.
+        :param trace_length: Number of consecutive transitions per sampled trace.
+        :param prioritized: Samples the traces proportionally to their priority (sum-tree), instead of uniformly.
+        :param alpha: Exponent of the priorities.
+        :param spill_directory: Keeps the state columns in memory-mapped files in this directory, for large capacities.
+                                The files are removed on close.
+        :param seed: Seed of the sampling RNG.
+        """
         self.capacity = capacity
-        self.episode_capacity = episode_capacity
-        self.memory = []
-        self.episode = []
+        self.state_size = state_size
+        self.trace_length = trace_length
         self.position = 0
-        self.episode_position = 0
-        self.trace_length = 30
-
-    def push(self, episode):
-        """Saves a transition."""
-        if len(self.memory) < self.capacity:
-            self.memory.append(None)
-        self.memory[self.position] = episode
-        self.position = (self.position + 1) % self.capacity
-
-    def push_transition(self, *args):
-        if len(self.episode) < self.episode_capacity:
-            self.episode.append(None)
-        self.episode[self.episode_position] = Transition(*args)
-        self.episode_position = (self.episode_position + 1) % self.episode_capacity
-
-    def seq_sample(self):
-        return self.memory
-
-    def last(self):
-        return [self.memory[-1]]
-
-    def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
-
-    def sample_last(self, batch_size):
-    	return self.memory[len(self.memory) - batch_size:]
-
-    def sample_episodes(self, batch_size):
-        sampled_episodes = self.sample(batch_size)
-        sampledTraces = []
-        for episode in sampled_episodes:
-            point = np.random.randint(0,len(episode)+1-self.trace_length)
-            sampledTraces.append(episode[point:point+self.trace_length])
-        return sampledTraces
-
-    def flush(self):
-        self.episode = []
-        self.episode_position = 0
+        self.size = 0
+        self.episodes = 0
+
+        # Own temporary directory for the spilled columns:
+        self.spill_directory = None
+        if spill_directory is not None:
+            if not os.path.exists(spill_directory):
+                os.makedirs(spill_directory)
+            self.spill_directory = tempfile.mkdtemp(dir=spill_directory)
+
+        self.state = self._column((capacity, state_size), torch.float32, 'state')
+        self.next_state = self._column((capacity, state_size), torch.float32, 'next_state')
+        self.action = torch.zeros(capacity, dtype=torch.long)
+        self.reward = torch.zeros(capacity)
+        self.done = torch.zeros(capacity, dtype=torch.bool)
+        self.episode = torch.full((capacity,), -1, dtype=torch.long)
+
+        # Priorities of the traces starting at every row (0 if the episode ends within the trace):
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.max_priority = 1.0
+        if prioritized:
+            self.tree = SumTree(capacity)
+
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+
+    def _column(self, size, dtype, name):
+        if self.spill_directory is None:
+            return torch.zeros(size, dtype=dtype)
+        filename = os.path.join(self.spill_directory, name)
+        return torch.from_file(filename, shared=True, size=size[0] * size[1], dtype=dtype).view(size)
+
+    def close(self):
+        """Removes the spilled columns (the memory can not be used afterwards)."""
+        if getattr(self, 'spill_directory', None) is not None:
+            self.state = self.next_state = None
+            shutil.rmtree(self.spill_directory, ignore_errors=True)
+            self.spill_directory = None
+
+    def __del__(self):
+        self.close()
+
+    def push(self, state, action, reward, next_state, done):
+        """
+        Saves a batch of whole episodes, time-major: state and next_state (episode_size, batch_size, state_size),
+        and action, reward and done (episode_size, batch_size).
+        """
+        episode_size, batch_size = action.size(0), action.size(1)
+        n = episode_size * batch_size
+        if episode_size < self.trace_length or n > self.capacity:
+            raise ValueError("Episodes must be at least trace_length long, and fit in the replay memory")
+
+        # Episode-major rows, every episode contiguous:
+        rows = (self.position + torch.arange(n)) % self.capacity
+        self.state[rows] = state.transpose(0, 1).reshape(n, -1).float()
+        self.next_state[rows] = next_state.transpose(0, 1).reshape(n, -1).float()
+        self.action[rows] = action.t().reshape(n).long()
+        self.reward[rows] = reward.t().reshape(n).float()
+        self.done[rows] = done.t().reshape(n).bool()
+        self.episode[rows] = (self.episodes + torch.arange(batch_size)).repeat_interleave(episode_size)
+
+        # New traces get the highest priority so far:
+        if self.prioritized:
+            valid = torch.arange(episode_size).repeat(batch_size) <= episode_size - self.trace_length
+            self.tree.update(rows, valid.double() * self.max_priority ** self.alpha)
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.episodes += batch_size
+
+    def _sample_starts(self, batch_size):
+        # Uniform over the rows starting a trace within a single episode (rejecting the others):
+        starts = torch.zeros(batch_size, dtype=torch.long)
+        missing = torch.arange(batch_size)
+        while missing.numel() > 0:
+            candidates = torch.randint(0, self.size, (missing.numel(),), generator=self.generator)
+            ends = (candidates + self.trace_length - 1) % self.capacity
+            valid = self.episode[candidates] == self.episode[ends]
+            starts[missing[valid]] = candidates[valid]
+            missing = missing[~valid]
+        return starts
+
+    def _sample_prioritized(self, batch_size):
+        # One trace from each of batch_size equal segments of the total priority:
+        total = self.tree.total()
+        values = (torch.arange(batch_size, dtype=torch.float64) +
+                  torch.rand(batch_size, dtype=torch.float64, generator=self.generator)) * (total / batch_size)
+        starts = self.tree.find(values.clamp(max=total * (1 - 1e-12)))
+
+        # Rounding may reach an empty leaf, those are drawn again:
+        empty = self.tree.get(starts) <= 0
+        while empty.any():
+            values = torch.rand(int(empty.sum()), dtype=torch.float64, generator=self.generator) * total
+            starts[empty] = self.tree.find(values)
+            empty = self.tree.get(starts) <= 0
+        return starts
+
+    def sample(self, batch_size, beta=0.4):
+        """
+        Samples batch_size traces, gathered time-major: (trace_length, batch_size, ...) columns.
+        :param beta: Exponent of the importance-sampling weights correcting prioritized sampling.
+        :return: Traces, with the rows the traces start at and their importance-sampling weights.
+        """
+        if self.size == 0:
+            raise ValueError("Sampling from an empty replay memory")
+
+        if self.prioritized:
+            starts = self._sample_prioritized(batch_size)
+            probabilities = self.tree.get(starts) / self.tree.total()
+            weights = (self.size * probabilities) ** -beta
+            weights = (weights / weights.max()).float()
+        else:
+            starts = self._sample_starts(batch_size)
+            weights = torch.ones(batch_size)
+
+        rows = (starts.unsqueeze(0) + torch.arange(self.trace_length).unsqueeze(1)) % self.capacity
+        return Traces(self.state[rows], self.action[rows], self.reward[rows], self.next_state[rows],
+                      self.done[rows], self.episode[rows], starts, weights)
+
+    def update_priorities(self, starts, priorities):
+        """Sets the priorities of the sampled traces (e.g. to their TD errors)."""
+        if not self.prioritized:
+            return
+        priorities = priorities.detach().abs().double().view(-1) + 1e-6
+        self.max_priority = max(self.max_priority, priorities.max().item())
+
+        # A trace may be sampled more than once:
+        starts, first = _unique_first(starts)
+        self.tree.update(starts, priorities[first] ** self.alpha)
 
     def __len__(self):
-        return len(self.memory)
+        return self.size
+
+
+def _unique_first(indices):
+    """Unique indices, and the position of their first occurrence."""
+    unique, inverse = torch.unique(indices, return_inverse=True)
+    first = torch.full((unique.size(0),), indices.size(0), dtype=torch.long)
+    first.scatter_reduce_(0, inverse, torch.arange(indices.size(0)), reduce='amin')
+    return unique, first
@@ -1,4 +1,5 @@
 import torch
+import torch.nn.functional as F
 from torch.autograd import Variable
 import random
 from transition import Transition
@@ -8,7 +9,7 @@ GAMMA = 0.5
 EPS = 0.05
 
 
-def train(model, epoch, optimizer, train_loader, args, writer, reinforcement_learner, request_dict, accuracy_dict, episode):
+def train(model, epoch, optimizer, train_loader, args, writer, reinforcement_learner, request_dict, accuracy_dict, episode, memory):
 
     # Initialize training:
     model.train()
@@ -208,7 +209,15 @@ def train(model, epoch, optimizer, train_loader, args, writer, reinforcement_lea
 
             ### END TRAIN LOOP ###
 
-        optimize(transitions, model, args)
+        # Saving the episode batch in the replay memory (time-major columns), and learning from sampled traces:
+        batch = Transition(*zip(*transitions))
+        final = [s is None for s in batch.next_state]
+        memory.push(torch.stack(batch.state),
+                    torch.cat(batch.action, 1).t(),
+                    torch.cat(batch.reward),
+                    torch.stack([torch.zeros_like(batch.state[0]) if f else s for s, f in zip(batch.next_state, final)]),
+                    torch.BoolTensor(final).unsqueeze(1).expand(len(final), args.mini_batch_size))
+        avg_loss = optimize(memory, model, optimizer, args)
 
         """
         # Zeroing accumulated gradients:
@@ -270,7 +279,7 @@ def train(model, epoch, optimizer, train_loader, args, writer, reinforcement_lea
     print("Batch Average Prediction Accuracy = " + str(total_prediction_accuracy)[:5] +  " %")
     total_accuracy = float((100.0 * batch_correct) / batch_predict)
     print("Batch Average Accuracy = " + str(total_accuracy)[:5] +  " %")
-    total_loss = float(avg_loss.data[0])
+    total_loss = float(avg_loss.item())
     print("Batch Average Loss = " + str(total_loss)[:5])
     total_requests = float((100.0 * batch_request) / (args.batch_size*args.episode_size))
     print("Batch Average Requests = " + str(total_requests)[:5] + " %")
@@ -293,40 +302,35 @@ def train(model, epoch, optimizer, train_loader, args, writer, reinforcement_lea
     return total_prediction_accuracy, total_requests, total_accuracy, total_loss, total_reward, request_dict, accuracy_dict
 
 
-def optimize(transitions, model, args):
+def optimize(memory, model, optimizer, args):
+    """
+    One Bellman update on a batch of fixed-length traces, sampled from the replay memory as whole tensors.
+    :return: The loss.
+    """
+    traces = memory.sample(args.mini_batch_size)
+    trace_length, batch_size = traces.action.size()
+
+    # Q-values along the traces, from a fresh hidden state:
+    hidden = model.reset_hidden(batch_size)
+    q_values = []
+    for t in range(trace_length):
+        q, hidden = model(traces.state[t], hidden)
+        q_values.append(q)
+    q_values = torch.stack(q_values)
+    state_action_values = q_values.gather(2, traces.action.unsqueeze(2)).squeeze(2)
+
+    # V(s_{t+1}): the next step's Q-values within the trace, and one more step after it:
+    with torch.no_grad():
+        last_q_values = model(traces.next_state[-1], hidden)[0]
+        next_state_values = torch.cat((q_values[1:], last_q_values.unsqueeze(0))).max(2)[0]
+        next_state_values[traces.done] = 0.0
 
-    batch = Transition(*zip(*transitions))
-
-    hidden = model.reset_hidden(args.mini_batch_size)
-
-    non_final_mask = torch.ByteTensor(tuple(map(lambda s: s is not None,
-                                          batch.next_state)))
-    non_final_next_states = Variable(torch.cat([s for s in batch.next_state
-                                                if s is not None]),
-                                     volatile=True)
-
-    state_batch = Variable(torch.cat(batch.state))
-    action_batch = Variable(torch.cat(batch.action))
-    reward_batch = Variable(torch.cat(batch.reward))
-
-    q_values, hidden = model(state_batch, hidden, seq=args.episode_size)
-
-    print(q_values)
-    print(action_batch)
-    state_action_values = q_values.gather(1, action_batch)
-
-    # Compute V(s_{t+1}) for all next states.
-    next_state_values, _ = Variable(torch.zeros(args.episode_size).type(Tensor), hidden)
-    next_state_values[non_final_mask] = model(non_final_next_states, hidden, seq=args.episode_size).max(1)[0]
-    # Now, we don't want to mess up the loss with a volatile flag, so let's
-    # clear it. After this, we'll just end up with a Variable that has
-    # requires_grad=False
-    next_state_values.volatile = False
     # Compute the expected Q values
-    expected_state_action_values = (next_state_values * GAMMA) + reward_batch
+    expected_state_action_values = (next_state_values * GAMMA) + traces.reward
 
-    # Compute Huber loss
-    loss = F.smooth_l1_loss(state_action_values, expected_state_action_values)
+    # Compute Huber loss, weighted per trace (importance sampling, when prioritized)
+    losses = F.smooth_l1_loss(state_action_values, expected_state_action_values, reduction='none')
+    loss = (losses.mean(0) * traces.weight).mean()
 
     # Optimize the model
     optimizer.zero_grad()
@@ -336,8 +340,10 @@ def optimize(transitions, model, args):
         param.grad.data.clamp_(-1, 1)
     optimizer.step()
 
+    # New priorities of the traces, their mean TD error:
+    memory.update_priorities(traces.start, (expected_state_action_values - state_action_values).abs().mean(0))
 
-
+    return loss.detach()
 
 
 def print_graph(grad_fn):
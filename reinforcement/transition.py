@@ -3,3 +3,7 @@ from collections import namedtuple
 # FROM PyTorch Reinforcement Learning DQN Tutorial:
 Transition = namedtuple('Transition', 
                         ('state', 'action', 'next_state', 'reward'))
+
+# Fixed-length traces sampled from the replay memory (time-major), with the rows they start at and their weights:
+Traces = namedtuple('Traces',
+                    ('state', 'action', 'reward', 'next_state', 'done', 'episode', 'start', 'weight'))